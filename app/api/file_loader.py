@@ -0,0 +1,98 @@
+import hashlib
+import os
+from dataclasses import dataclass
+
+import aiofiles
+import aiohttp
+from fastapi import HTTPException
+
+from app.config import settings
+from app.upload_quota import UploadQuota
+
+PDF_MAGIC = b"%PDF-"
+# Спецификация PDF допускает мусор перед заголовком, но не дальше первого килобайта
+PDF_HEADER_SEARCH_BYTES = 1024
+# Шаг резервирования места, когда размер файла заранее неизвестен
+QUOTA_RESERVE_STEP_BYTES = 8 * 1024 * 1024
+
+
+@dataclass
+class DownloadedFile:
+    path: str
+    size: int
+    sha256: str  # Хэш содержимого: ключ кэша результатов
+
+
+def file_too_large_error() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Превышен максимальный размер файла ({settings.MAX_FILE_SIZE_MB} МБ)."
+    )
+
+
+def dir_limit_error() -> HTTPException:
+    return HTTPException(
+        status_code=507,
+        detail=f"Превышен общий лимит размера файлов ({settings.MAX_DIR_SIZE_GB} ГБ). Освободите место и повторите попытку."
+    )
+
+
+async def download_pdf(file_link: str, file_path: str, max_bytes: int, quota: UploadQuota) -> DownloadedFile:
+    """
+    Потоково скачивает PDF по ссылке в file_path, попутно считая его размер и SHA-256.
+
+    Тело ответа пишется на диск частями, поэтому память на одну загрузку не зависит от размера файла.
+    Место в каталоге загрузок резервируется в quota до записи: целиком по Content-Length, если он известен,
+    иначе по мере поступления данных шагами по QUOTA_RESERVE_STEP_BYTES. Загрузка прерывается, как только размер
+    превышает max_bytes, квота исчерпана или начало файла не похоже на PDF; частично записанный файл и резерв
+    при этом освобождаются.
+    """
+    bytes_written = 0
+    reserved_bytes = 0
+    content_hash = hashlib.sha256()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(file_link) as resp:
+                if resp.status != 200:
+                    raise HTTPException(status_code=400, detail="Не удалось скачать файл")
+
+                if resp.content_length is not None:
+                    if resp.content_length > max_bytes:
+                        raise file_too_large_error()
+                    if not await quota.reserve_async(resp.content_length):
+                        raise dir_limit_error()
+                    reserved_bytes = resp.content_length
+
+                header = b""
+                async with aiofiles.open(file_path, "wb") as f:
+                    async for chunk in resp.content.iter_chunked(settings.DOWNLOAD_CHUNK_SIZE_KB * 1024):
+                        bytes_written += len(chunk)
+                        if bytes_written > max_bytes:
+                            raise file_too_large_error()
+                        if bytes_written > reserved_bytes:
+                            # Резерв берётся с запасом, чтобы не обращаться к Redis на каждом фрагменте;
+                            # неиспользованный остаток возвращается после загрузки
+                            reserve_to = min(max(bytes_written, reserved_bytes + QUOTA_RESERVE_STEP_BYTES), max_bytes)
+                            if not await quota.reserve_async(reserve_to - reserved_bytes):
+                                raise dir_limit_error()
+                            reserved_bytes = reserve_to
+
+                        if len(header) < PDF_HEADER_SEARCH_BYTES:
+                            header += chunk[:PDF_HEADER_SEARCH_BYTES - len(header)]
+                            if len(header) >= PDF_HEADER_SEARCH_BYTES and PDF_MAGIC not in header:
+                                raise HTTPException(status_code=400, detail="Файл по ссылке не является PDF")
+
+                        content_hash.update(chunk)
+                        await f.write(chunk)
+
+                if PDF_MAGIC not in header:
+                    raise HTTPException(status_code=400, detail="Файл по ссылке не является PDF")
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        await quota.release_async(reserved_bytes)
+        raise
+
+    # Сервер мог прислать меньше, чем заявил в Content-Length
+    await quota.release_async(reserved_bytes - bytes_written)
+    return DownloadedFile(file_path, bytes_written, content_hash.hexdigest())
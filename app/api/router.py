@@ -1,20 +1,33 @@
+import asyncio
+import json
+import logging
 import os
 import uuid
+from typing import Optional, Tuple
 
-import aiohttp
 from celery.result import AsyncResult
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from app.celery_folder.celery_worker import celery_app
+from app.api.file_loader import DownloadedFile, download_pdf
+from app.callback import send_errors, send_results
+from app.celery_folder.celery_client import celery_app, send_add, send_get_key_phrases, \
+    send_get_key_phrases_batch
 from app.config import settings, redis_client
-from app.celery_folder.tasks import add, get_key_phrases
-from pipeline_module.interfaces import InputPipelineData, InputApiData
+from app.job_coalescing import inflight_jobs, link_coalescing_key
+from app.job_progress import job_progress, progress_hub
+from app.metrics import pipeline_metrics
+from app.result_cache import pipeline_cache, result_cache_key
+from app.upload_quota import upload_quota
+from pipeline_module.interfaces import InputPipelineData, InputApiData, InputApiBatchData
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=['API'])
 
 @router.get("/api/test/")
 async def test():
-    task = add.apply_async(args=(1, 5), countdown=5)  # Запуск через 5 сек
+    task = send_add(1, 5, countdown=5)  # Запуск через 5 сек
     return {"task_id": task.id}
 
 
@@ -28,34 +41,195 @@ async def get_result(task_id: str):
         "result": result.result  # None, если ещё не готов
     }
 
-@router.post("/api/send_request_to_get_key_phrases/")
-async def send_request_to_get_key_phrases(input_data: InputApiData):
-    print("input_data")
-    print(input_data)
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(input_data.file_link) as resp:
-                if resp.status != 200:
-                    raise HTTPException(status_code=400, detail="Не удалось скачать файл")
+@router.get("/api/jobs/{job_id}")
+async def get_job_state(job_id: str):
+    state = await progress_hub.get_state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return state
+
+@router.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Ход обработки задания в формате Server-Sent Events: поток закрывается после этапа done, error или merged."""
+    async def event_stream():
+        async for event in progress_hub.events(job_id, settings.SSE_KEEPALIVE_SECONDS):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {event['seq']}\nevent: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Прокси не должны буферизовать поток, иначе события придут пачкой в конце
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/api/workers/health")
+async def get_workers_health():
+    # broadcast ждёт ответов воркеров до timeout: в потоке, чтобы не блокировать event loop
+    replies = await asyncio.to_thread(celery_app.control.broadcast, "models_health", reply=True, timeout=1.0)
+    workers = {name: state for reply in replies for name, state in reply.items()}
+
+    return {
+        "ready": bool(workers) and all(state.get("ready") for state in workers.values()),
+        "workers": workers
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Формат экспорта Prometheus 0.0.4
+    metrics = await asyncio.to_thread(pipeline_metrics.render)
+    return PlainTextResponse(metrics, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def fail_job(job_id: str, input_data: InputApiData, e: Exception) -> HTTPException:
+    error = e if isinstance(e, HTTPException) else HTTPException(status_code=500, detail=f"Ошибка загрузки файла: {str(e)}")
 
-                file_content = await resp.read()
+    # Клиенты, успевшие присоединиться к заданию, получают ошибку через callback; автор запроса -- в ответе.
+    # Убирается только одна запись: такой же повторный запрос от другого клиента тоже ждёт callback
+    waiting = await asyncio.to_thread(inflight_jobs.finish, job_id)
+    if input_data in waiting:
+        waiting.remove(input_data)
+    send_errors(waiting, str(error.detail))
+    await asyncio.to_thread(job_progress.publish, job_id, "error", detail=str(error.detail))
+    return error
 
-        if len(file_content) > settings.MAX_FILE_SIZE_MB * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="Превышен максимальный размер файла (300 МБ).")
+async def publish_replaced(replaced_job_id: Optional[str], job_id: str) -> None:
+    # Ожидающие потерянного задания перешли к новому: подписчики старого переключаются на него
+    if replaced_job_id:
+        logger.warning(f"Задание {replaced_job_id} перестало продлевать аренду, его клиенты перешли к {job_id}")
+        await asyncio.to_thread(job_progress.publish, replaced_job_id, "merged", merged_into=job_id)
+
+async def discard_download(downloaded_file: DownloadedFile) -> None:
+    """Удаляет скачанный файл, которому не нужен пайплайн, и возвращает занятое им место в квоте."""
+    try:
+        os.remove(downloaded_file.path)
+    except FileNotFoundError:
+        pass
+    await upload_quota.release_async(downloaded_file.size)
 
-        upload_dir = settings.UPLOAD_DIR
-        total_size = sum(os.path.getsize(os.path.join(upload_dir, f)) for f in os.listdir(upload_dir) if os.path.isfile(os.path.join(upload_dir, f)))
-        if total_size + len(file_content) > settings.MAX_DIR_SIZE_GB * 1024 * 1024 * 1024:
-            raise HTTPException(status_code=507, detail="Превышен общий лимит размера файлов (20 ГБ). Освободите место и повторите попытку.")
+async def start_job(input_data: InputApiData) -> Tuple[dict, Optional[dict]]:
+    """
+    Объединение с одинаковыми заданиями, скачивание файла и проверка кэша результатов.
 
+    Возвращает ответ клиенту и аргументы задачи пайплайна; None вместо аргументов -- запускать пайплайн не нужно.
+    Синхронные обращения к Redis выполняются в потоках, чтобы не блокировать event loop.
+    """
+    # Такой же запрос уже обрабатывается: присоединяемся к нему вместо повторного скачивания и запуска
+    job_id = str(uuid.uuid4())
+    link_key = link_coalescing_key(input_data.file_link, input_data.config)
+    running_job_id, replaced_job_id = await asyncio.to_thread(inflight_jobs.join_or_create, link_key, job_id, input_data)
+    await publish_replaced(replaced_job_id, job_id)
+    if running_job_id != job_id:
+        return {"status": "attached to running job", "job_id": running_job_id}, None
+
+    downloaded_file = None
+    try:
+        await asyncio.to_thread(job_progress.publish, job_id, "downloading")
         filename = f"{uuid.uuid4()}.pdf"
         file_path = os.path.join(settings.UPLOAD_DIR, filename)
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        downloaded_file = await download_pdf(input_data.file_link, file_path, settings.MAX_FILE_SIZE_MB * 1024 * 1024, upload_quota)
+
+        # Тот же файл под другой ссылкой уже обрабатывается: переносим ожидающих в то задание
+        content_key = result_cache_key(downloaded_file.sha256, input_data.config)
+        running_job_id, replaced_job_id = await asyncio.to_thread(inflight_jobs.merge_by_content, content_key, link_key, job_id)
+        await publish_replaced(replaced_job_id, job_id)
+        if running_job_id != job_id:
+            await discard_download(downloaded_file)
+            downloaded_file = None
+            await asyncio.to_thread(job_progress.publish, job_id, "merged", merged_into=running_job_id)
+            return {"status": "attached to running job", "job_id": running_job_id}, None
+
+        # Тот же файл с той же конфигурацией уже обрабатывался: отдаём результат без запуска пайплайна
+        cached_result = await asyncio.to_thread(pipeline_cache.get_result, downloaded_file.sha256, input_data.config)
+        if cached_result is not None:
+            await discard_download(downloaded_file)
+            downloaded_file = None
+            send_results(await asyncio.to_thread(inflight_jobs.finish, job_id), cached_result)
+            await asyncio.to_thread(job_progress.publish, job_id, "done", from_cache=True)
+            return {"status": "done from cache", "job_id": job_id}, None
+    except Exception as e:
+        # Файл уже скачан и место зарезервировано, а задачу никто не поставит: освобождаем их здесь
+        if downloaded_file is not None:
+            try:
+                await discard_download(downloaded_file)
+            except Exception as cleanup_error:
+                logger.warning(f"Не удалось освободить файл {downloaded_file.path}: {cleanup_error}")
+        raise await fail_job(job_id, input_data, e)
+
+    task_args = {
+        "file_path": file_path,
+        "input_data_dict": input_data.model_dump(),
+        "file_hash": downloaded_file.sha256,
+        "job_id": job_id,
+    }
+    return {"status": "processing started", "job_id": job_id}, task_args
 
-        get_key_phrases.delay(file_path, input_data.model_dump())
-        return {"status": "processing started"}
-    except HTTPException as e:
-        raise e
+@router.post("/api/send_request_to_get_key_phrases/")
+async def send_request_to_get_key_phrases(input_data: InputApiData):
+    logger.debug("input_data %s", input_data)
+
+    response, task_args = await start_job(input_data)
+    if task_args is None:
+        return response
+
+    try:
+        # Публикуем до постановки: иначе событие воркера может опередить "queued"
+        await asyncio.to_thread(job_progress.publish, task_args["job_id"], "queued")
+        send_get_key_phrases(**task_args)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка загрузки файла: {str(e)}")
\ No newline at end of file
+        # Задача не поставлена: файл никто не удалит, поэтому освобождаем место сразу
+        await asyncio.to_thread(upload_quota.remove_file, task_args["file_path"])
+        raise await fail_job(task_args["job_id"], input_data, e)
+
+    return response
+
+@router.post("/api/send_batch_request_to_get_key_phrases/")
+async def send_batch_request_to_get_key_phrases(batch_data: InputApiBatchData):
+    """
+    Пакет документов с общими или собственными callback_url и конфигурацией.
+
+    Документы, которым нужен пайплайн, ставятся группами по BATCH_GROUP_SIZE в одну задачу; результат
+    каждого документа, как и в одиночном запросе, приходит отдельным callback.
+    """
+    if len(batch_data.documents) > settings.BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"В пакете больше {settings.BATCH_MAX_DOCUMENTS} документов")
+
+    documents = batch_data.to_api_data()
+    download_slots = asyncio.Semaphore(settings.BATCH_DOWNLOAD_CONCURRENCY)
+
+    async def start_document(input_data: InputApiData) -> Tuple[dict, Optional[dict]]:
+        async with download_slots:
+            try:
+                return await start_job(input_data)
+            except HTTPException as error:
+                return {"status": "error", "detail": error.detail}, None
+
+    started = await asyncio.gather(*(start_document(input_data) for input_data in documents))
+    responses = [response for response, _ in started]
+    pending = [(idx, task_args) for idx, (_, task_args) in enumerate(started) if task_args is not None]
+
+    # В поэтапном режиме каждый документ проходит очереди OCR и NLP отдельно
+    group_size = 1 if settings.PIPELINE_STAGED else settings.BATCH_GROUP_SIZE
+    for group_start in range(0, len(pending), group_size):
+        group = pending[group_start:group_start + group_size]
+        try:
+            for _, task_args in group:
+                await asyncio.to_thread(job_progress.publish, task_args["job_id"], "queued")
+            if settings.PIPELINE_STAGED:
+                send_get_key_phrases(**group[0][1])
+            else:
+                send_get_key_phrases_batch([task_args for _, task_args in group])
+        except Exception as e:
+            for idx, task_args in group:
+                await asyncio.to_thread(upload_quota.remove_file, task_args["file_path"])
+                error = await fail_job(task_args["job_id"], documents[idx], e)
+                responses[idx] = {"status": "error", "detail": error.detail}
+
+    return {
+        "documents": [
+            {"file_link": input_data.file_link, **response} for input_data, response in zip(documents, responses)
+        ]
+    }
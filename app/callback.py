@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import ssl
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+import aiohttp
+import redis
+
+from app.config import settings, redis_client
+from pipeline_module.interfaces import InputApiData, OutputPipelineData, OutputWorkerData
+
+logger = logging.getLogger(__name__)
+
+# Ответы, после которых повтор имеет смысл: получатель временно недоступен или просит подождать
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CallbackDispatcher:
+    """
+    Доставка результатов на callback_url из фонового потока с собственным event loop.
+
+    Сессия aiohttp (и пул TLS-соединений) живёт всё время работы процесса, число одновременных
+    запросов ограничено семафором. Неудачная доставка повторяется с экспоненциальной задержкой
+    и случайным разбросом; после последней попытки запрос сохраняется в Redis как dead letter.
+    submit не ждёт ответа, поэтому воркер сразу переходит к следующему документу.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        dead_letter_key: str,
+        max_concurrency: int = 16,
+        max_attempts: int = 5,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 60.0,
+        timeout_seconds: float = 30.0,
+        dead_letter_max: int = 10000
+    ):
+        self.client = client
+        self.dead_letter_key = dead_letter_key
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.timeout_seconds = timeout_seconds
+        self.dead_letter_max = dead_letter_max
+
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: set[Future] = set()
+
+    def submit(self, callback_url: str, payload: dict) -> Future:
+        """Ставит доставку в очередь и сразу возвращает управление."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._deliver(callback_url, payload), loop)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def close(self, timeout: float = 30.0) -> None:
+        """
+        Дожидается отправки поставленных результатов (не дольше timeout) и закрывает сессию.
+
+        Повторный вызов ничего не делает: close вызывается и при остановке процесса пула, и при остановке воркера.
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            # Цикл забирается под блокировкой: второй вызов, в том числе из другого потока, сразу выходит
+            loop, thread, session = self._loop, self._thread, self._session
+            pending = list(self._pending)
+            self._loop = None
+            self._thread = None
+            self._pid = None
+
+        deadline = time.monotonic() + timeout
+        for future in pending:
+            try:
+                future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception:
+                pass
+
+        try:
+            asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # После fork поток родителя в дочернем процессе не существует: запускаем свой
+            if self._loop is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = set()
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="callback-dispatcher", daemon=True
+                )
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self._open_session(), self._loop).result()
+            return self._loop
+
+    async def _open_session(self) -> None:
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(ssl=ssl_context, limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": случайная задержка до экспоненциальной границы, чтобы повторы не шли волной
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)))
+
+    async def _deliver(self, callback_url: str, payload: dict) -> bool:
+        data = json.dumps(payload, ensure_ascii=False)
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._semaphore:
+                try:
+                    async with self._session.post(
+                        callback_url, data=data, headers={"Content-Type": "application/json"}
+                    ) as resp:
+                        if resp.status < 400:
+                            return True
+                        error = f"HTTP {resp.status}"
+                        if resp.status not in RETRYABLE_STATUSES:
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = f"{type(e).__name__}: {e}"
+
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self._backoff(attempt))
+
+        logger.warning(f"Не удалось доставить результат на {callback_url}: {error}")
+        await asyncio.to_thread(self._store_dead_letter, callback_url, payload, error, attempt)
+        return False
+
+    def _store_dead_letter(self, callback_url: str, payload: dict, error: Optional[str], attempts: int) -> None:
+        record = json.dumps({
+            "callback_url": callback_url,
+            "payload": payload,
+            "error": error,
+            "attempts": attempts,
+            "failed_at": time.time()
+        }, ensure_ascii=False)
+        try:
+            pipe = self.client.pipeline()
+            pipe.lpush(self.dead_letter_key, record)
+            pipe.ltrim(self.dead_letter_key, 0, self.dead_letter_max - 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Не удалось сохранить недоставленный результат в Redis: {e}")
+
+
+callback_dispatcher = CallbackDispatcher(
+    redis_client,
+    settings.CALLBACK_DEAD_LETTER_KEY,
+    max_concurrency=settings.CALLBACK_MAX_CONCURRENCY,
+    max_attempts=settings.CALLBACK_MAX_ATTEMPTS,
+    backoff_base_seconds=settings.CALLBACK_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=settings.CALLBACK_BACKOFF_MAX_SECONDS,
+    timeout_seconds=settings.CALLBACK_TIMEOUT_SECONDS,
+    dead_letter_max=settings.CALLBACK_DEAD_LETTER_MAX
+)
+
+
+def send_callback(callback_url: str, output_result: OutputWorkerData) -> Future:
+    return callback_dispatcher.submit(callback_url, {
+        "status": "done",
+        "result": output_result.model_dump()
+    })
+
+
+def send_results(waiting: List[InputApiData], output_data: OutputPipelineData) -> None:
+    """Отправляет один результат всем клиентам, ожидающим задание, каждому со своими входными данными."""
+    for input_data in waiting:
+        send_callback(input_data.callback_url, OutputWorkerData(input_data=input_data, output_data=output_data))
+
+
+def send_errors(waiting: List[InputApiData], detail: str) -> None:
+    for input_data in waiting:
+        callback_dispatcher.submit(input_data.callback_url, {
+            "status": "error",
+            "detail": detail,
+            "input_data": input_data.model_dump()
+        })
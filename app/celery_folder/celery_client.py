@@ -0,0 +1,57 @@
+"""
+Лёгкий клиент Celery для API: приложение, маршруты и постановка задач по имени.
+
+Модуль не импортирует задачи, поэтому API не загружает PyMuPDF, spaCy, torch и остальной стек
+пайплайна. Сами задачи регистрируются только в воркере (app.celery_folder.celery_worker).
+"""
+import time
+from typing import List, Optional
+
+from celery import Celery
+from celery.signals import before_task_publish
+
+from app.config import settings, ssl_options
+
+ADD_TASK = "app.celery_folder.tasks.add"
+GET_KEY_PHRASES_TASK = "app.celery_folder.tasks.get_key_phrases"
+GET_KEY_PHRASES_BATCH_TASK = "app.celery_folder.tasks.get_key_phrases_batch"
+PREPARE_DOCUMENT_TASK = "app.celery_folder.stages.prepare_document"
+RECOGNIZE_PAGE_GROUP_TASK = "app.celery_folder.stages.recognize_page_group"
+PROCESS_DOCUMENT_TEXT_TASK = "app.celery_folder.stages.process_document_text"
+
+# celery_app = Celery("celery_worker", broker=f'{settings.REDIS_URL}/0', backend=f'{settings.REDIS_URL}/0')
+celery_app = Celery("celery_worker", broker=f'{settings.REDIS_URL}/0', backend=None)
+
+celery_app.conf.update(
+    result_expires=3600,  # Время хранения результатов
+    task_track_started=True,
+    # Процесс воркера сообщает о готовности только после загрузки моделей, поэтому даём ему на это время
+    worker_proc_alive_timeout=settings.WORKER_MODEL_LOAD_TIMEOUT,
+    # Маршруты заданы по имени, а не в декораторах: API отправляет задачи, не импортируя их
+    task_routes={
+        PREPARE_DOCUMENT_TASK: {"queue": settings.OCR_QUEUE},
+        RECOGNIZE_PAGE_GROUP_TASK: {"queue": settings.OCR_QUEUE},
+        PROCESS_DOCUMENT_TEXT_TASK: {"queue": settings.NLP_QUEUE},
+    }
+)
+
+
+@before_task_publish.connect
+def add_enqueued_at_header(headers=None, **kwargs):
+    # Заголовки сообщения попадают в task.request воркера: по ним считается время ожидания в очереди
+    headers.setdefault("enqueued_at", time.time())
+
+
+def send_add(x: int, y: int, countdown: Optional[float] = None):
+    return celery_app.send_task(ADD_TASK, args=(x, y), countdown=countdown)
+
+
+def send_get_key_phrases(file_path: str, input_data_dict: dict, file_hash: Optional[str], job_id: Optional[str]):
+    # В поэтапном режиме документ сначала попадает в очередь OCR, иначе обрабатывается одной задачей
+    task_name = PREPARE_DOCUMENT_TASK if settings.PIPELINE_STAGED else GET_KEY_PHRASES_TASK
+    return celery_app.send_task(task_name, args=(file_path, input_data_dict, file_hash, job_id))
+
+
+def send_get_key_phrases_batch(items: List[dict]):
+    """items -- аргументы get_key_phrases для каждого документа группы (file_path, input_data_dict, file_hash, job_id)."""
+    return celery_app.send_task(GET_KEY_PHRASES_BATCH_TASK, args=(items,))
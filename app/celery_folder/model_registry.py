@@ -0,0 +1,310 @@
+import gc
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Optional, TYPE_CHECKING
+
+import redis
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from celery.worker.control import inspect_command
+
+from app.callback import callback_dispatcher
+from app.config import settings, redis_client
+from pipeline_module.ocr import RussianPDFOCR, available_cpu_count
+
+if TYPE_CHECKING:
+    from pipeline_module.pipeline import TextProcessingPipeline
+
+logger = logging.getLogger(__name__)
+
+
+WORKER_ROLES = ("all", "ocr", "nlp")
+
+
+def build_ocr() -> RussianPDFOCR:
+    return RussianPDFOCR(
+        workers=settings.OCR_WORKERS,
+        reserved_cpus=settings.OCR_RESERVED_CPUS,
+        use_text_layer=settings.OCR_USE_TEXT_LAYER,
+        backend=settings.OCR_BACKEND
+    )
+
+
+class ModelRegistry:
+    """
+    Хранит один прогретый экземпляр пайплайна на процесс воркера.
+
+    Воркеру с ролью "ocr" модели spaCy и BERT не нужны: он загружает только OCR.
+    """
+
+    def __init__(self, spacy_model_name: str, bert_model_name: str, role: str = "all"):
+        if role not in WORKER_ROLES:
+            raise ValueError(f"Неизвестная роль воркера '{role}', доступны: {', '.join(WORKER_ROLES)}")
+        self.spacy_model_name = spacy_model_name
+        self.bert_model_name = bert_model_name
+        self.role = role
+        self._pipeline: Optional['TextProcessingPipeline'] = None
+        self._ocr: Optional[RussianPDFOCR] = None
+        self._torch_threads: Optional[int] = None
+        self._lock = threading.Lock()
+        self._load_seconds: Optional[float] = None
+        self._error: Optional[str] = None
+        # Главный процесс воркера и размер его пула: известны после worker_init, процессы prefork наследуют их
+        self._main_pid: Optional[int] = None
+        self._pool_size: Optional[int] = None
+
+    def load(self) -> 'TextProcessingPipeline':
+        """Загружает и прогревает модели, если это ещё не сделано в текущем процессе."""
+        with self._lock:
+            if self._pipeline is not None:
+                return self._pipeline
+
+            logger.info(f'Загрузка моделей в процессе {os.getpid()}')
+            started_at = time.perf_counter()
+            try:
+                # spaCy, sentence-transformers и torch нужны только воркерам NLP: воркер OCR их не импортирует
+                from pipeline_module.pipeline import TextProcessingPipeline
+
+                pipeline = TextProcessingPipeline(
+                    self.spacy_model_name,
+                    self.bert_model_name,
+                    ocr_workers=settings.OCR_WORKERS,
+                    ocr_reserved_cpus=settings.OCR_RESERVED_CPUS,
+                    use_text_layer=settings.OCR_USE_TEXT_LAYER,
+                    ocr_backend=settings.OCR_BACKEND,
+                    encode_batch_size=settings.BERT_ENCODE_BATCH_SIZE,
+                    normalize_embeddings=settings.BERT_NORMALIZE_EMBEDDINGS,
+                    doc_embedding_mode=settings.BERT_DOC_EMBEDDING,
+                    doc_chunk_tokens=settings.BERT_DOC_CHUNK_TOKENS,
+                    doc_max_chunks=settings.BERT_DOC_MAX_CHUNKS,
+                    phrase_cache_dir=settings.PHRASE_CACHE_DIR or None,
+                    phrase_cache_capacity=settings.PHRASE_CACHE_CAPACITY,
+                    spacy_max_length=settings.SPACY_MAX_LENGTH
+                )
+                pipeline.warm_up()
+            except Exception as e:
+                self._error = str(e)
+                raise
+
+            self._pipeline = pipeline
+            self._load_seconds = round(time.perf_counter() - started_at, 3)
+            self._error = None
+            logger.info(f'Модели загружены за {self._load_seconds} с')
+
+            self._write_ready_file()
+            return pipeline
+
+    def preload(self, concurrency: int) -> None:
+        """
+        Загружает модели в главном процессе воркера до создания пула, чтобы дочерние процессы prefork
+        получили их через fork и делили страницы с весами, а не загружали каждый свою копию.
+        """
+        # Токенизатор HF и пул потоков OpenMP, запущенные до fork, в дочернем процессе могут зависнуть:
+        # до fork всё считается в один поток, число потоков каждый процесс выставляет себе сам
+        if self.role != "ocr":
+            import torch
+
+            os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+            torch.set_num_threads(1)
+            self._torch_threads = settings.TORCH_THREADS_PER_PROCESS or max(1, available_cpu_count() // max(concurrency, 1))
+
+        self.load_for_role()
+
+        # Модели живут столько же, сколько воркер: переносим их объекты в постоянное поколение сборщика
+        # мусора, чтобы обход GC в дочерних процессах не записывал в их страницы и не копировал их
+        gc.freeze()
+        logger.info(f'Модели загружены до fork, потоков torch на процесс: {self._torch_threads}')
+
+    def on_worker_init(self, pool_size: int) -> None:
+        self._main_pid = os.getpid()
+        self._pool_size = pool_size
+        # Записи процессов от предыдущего запуска с тем же pid не должны считаться готовыми
+        self.clear_processes()
+
+    def clear_processes(self) -> None:
+        if self._main_pid is None:
+            return
+        try:
+            redis_client.delete(self._processes_key())
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось очистить состояние процессов воркера в Redis: {e}")
+
+    def on_process_init(self) -> None:
+        if self._torch_threads is not None:
+            import torch
+
+            torch.set_num_threads(self._torch_threads)
+        # После preload модели уже есть в памяти процесса и load_for_role ничего не загружает
+        try:
+            self.load_for_role()
+        finally:
+            self._report_process()
+        self._write_ready_file()
+
+    def load_for_role(self) -> None:
+        if self.role == "ocr":
+            self.get_ocr()
+        else:
+            self.load()
+
+    def get_ocr(self) -> RussianPDFOCR:
+        with self._lock:
+            if self._pipeline is not None:
+                return self._pipeline.ocr
+            if self._ocr is None:
+                ocr = build_ocr()
+                ocr.warm_up()
+                self._ocr = ocr
+                self._error = None
+                self._write_ready_file()
+            return self._ocr
+
+    def get_pipeline(self) -> 'TextProcessingPipeline':
+        if self._pipeline is None:
+            return self.load()
+        return self._pipeline
+
+    def is_ready(self) -> bool:
+        if self.role == "ocr":
+            return self._ocr is not None
+        return self._pipeline is not None
+
+    def process_health(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "role": self.role,
+            "ready": self.is_ready(),
+            "spacy_model": self.spacy_model_name,
+            "bert_model": self.bert_model_name,
+            "load_seconds": self._load_seconds,
+            "error": self._error,
+        }
+
+    def health(self) -> dict:
+        """
+        Готовность воркера. Управляющие команды обрабатывает главный процесс, а модели загружают процессы пула
+        (без preload главный процесс моделей не загружает), поэтому готовность берётся из их записей в Redis:
+        воркер готов, когда готовы все процессы пула.
+        """
+        if self._main_pid != os.getpid() or not self._pool_size:
+            return self.process_health()
+
+        try:
+            processes = self._read_processes()
+        except redis.RedisError as e:
+            return {**self.process_health(), "ready": False, "error": f"Состояние процессов недоступно: {e}"}
+
+        ready_count = sum(1 for process in processes.values() if process["ready"])
+        errors = [process["error"] for process in processes.values() if process["error"]]
+        return {
+            "pid": os.getpid(),
+            "role": self.role,
+            "ready": ready_count >= self._pool_size,
+            "pool_size": self._pool_size,
+            "ready_processes": ready_count,
+            "spacy_model": self.spacy_model_name,
+            "bert_model": self.bert_model_name,
+            "error": errors[0] if errors else self._error,
+            "processes": processes,
+        }
+
+    def _processes_key(self) -> str:
+        # pid главного процесса уникален только на своей машине
+        return f"{settings.WORKER_PROCESSES_KEY_PREFIX}:{socket.gethostname()}:{self._main_pid}"
+
+    def _report_process(self) -> None:
+        if self._main_pid is None:
+            return
+        try:
+            redis_client.hset(self._processes_key(), str(os.getpid()), json.dumps(self.process_health()))
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось записать готовность процесса {os.getpid()} в Redis: {e}")
+
+    def remove_process(self) -> None:
+        if self._main_pid is None:
+            return
+        try:
+            redis_client.hdel(self._processes_key(), str(os.getpid()))
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось удалить процесс {os.getpid()} из состояния воркера в Redis: {e}")
+
+    def _read_processes(self) -> dict:
+        processes = {}
+        dead = []
+        for pid, state in redis_client.hgetall(self._processes_key()).items():
+            pid = int(pid)
+            # Процесс, убитый без worker_process_shutdown, не успел удалить свою запись
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead.append(pid)
+                continue
+            except PermissionError:
+                pass
+            processes[pid] = json.loads(state)
+        if dead:
+            redis_client.hdel(self._processes_key(), *map(str, dead))
+        return processes
+
+    def _ready_file_path(self) -> Optional[str]:
+        if not settings.WORKER_READY_FILE:
+            return None
+        return f"{settings.WORKER_READY_FILE}.{os.getpid()}"
+
+    def _write_ready_file(self) -> None:
+        ready_file = self._ready_file_path()
+        if ready_file is None:
+            return
+        with open(ready_file, "w") as f:
+            f.write(str(self._load_seconds))
+
+    def remove_ready_file(self) -> None:
+        ready_file = self._ready_file_path()
+        if ready_file and os.path.exists(ready_file):
+            os.remove(ready_file)
+
+
+model_registry = ModelRegistry(settings.SPACY_MODEL_NAME, settings.BERT_MODEL_NAME, settings.WORKER_ROLE)
+
+
+@worker_init.connect
+def preload_models_before_fork(sender=None, **kwargs):
+    # Сигнал приходит в главном процессе воркера до запуска пула
+    # solo выполняет задачи в самом главном процессе, и все ядра достаются ему
+    concurrency = 1 if "solo" in str(sender.pool_cls) else sender.concurrency
+    model_registry.on_worker_init(concurrency)
+    if settings.WORKER_PRELOAD_MODELS:
+        model_registry.preload(concurrency)
+
+
+@worker_process_init.connect
+def load_models_on_process_init(**kwargs):
+    # Сигнал приходит до того, как процесс начнёт принимать задачи (и для solo, и для prefork),
+    # поэтому задача никогда не попадёт в процесс с непрогретыми моделями
+    model_registry.on_process_init()
+
+
+@worker_process_shutdown.connect
+def cleanup_on_process_shutdown(**kwargs):
+    model_registry.remove_ready_file()
+    model_registry.remove_process()
+    # Даём фоновой доставке отправить уже готовые результаты
+    callback_dispatcher.close(timeout=settings.CALLBACK_TIMEOUT_SECONDS)
+
+
+@worker_shutdown.connect
+def cleanup_on_worker_shutdown(**kwargs):
+    # Файл готовности главного процесса, записанный при preload
+    model_registry.remove_ready_file()
+    model_registry.clear_processes()
+    # Пул solo выполняет задачи в главном процессе и не присылает worker_process_shutdown
+    callback_dispatcher.close(timeout=settings.CALLBACK_TIMEOUT_SECONDS)
+
+
+@inspect_command()
+def models_health(state):
+    """Состояние моделей в процессах пула воркера."""
+    return model_registry.health()
@@ -0,0 +1,129 @@
+import json
+import zlib
+from typing import Dict, List, Optional
+
+import redis
+
+from app.config import settings, redis_client
+from app.result_cache import recognized_adapter
+from pipeline_module.interfaces import RecognizedDocument, StageTiming
+
+STAGE_PREFIX = "stage"
+
+# Сохраняет распознанные страницы и уменьшает счётчик оставшихся на число новых страниц. Повторно
+# выполненная задача группы не уменьшит счётчик второй раз; после ошибки документа страницы не принимаются
+STORE_PAGES_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return -1
+end
+local added = 0
+for i = 1, #ARGV, 2 do
+    added = added + redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return redis.call('DECRBY', KEYS[2], added)
+"""
+
+
+class DocumentStageState:
+    """
+    Промежуточное состояние документа между этапами конвейера в Redis.
+
+    Задачи получают только идентификатор этапа: метаданные, тексты страниц и итоговый текст документа
+    хранятся здесь, а не передаются в сообщениях брокера.
+    """
+
+    def __init__(self, client: redis.Redis, ttl_seconds: int):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._store_pages = client.register_script(STORE_PAGES_SCRIPT)
+
+    @staticmethod
+    def key(stage_id: str, name: str) -> str:
+        return f"{STAGE_PREFIX}:{stage_id}:{name}"
+
+    def create(self, stage_id: str, meta: dict, pages_text: List[Optional[str]]) -> List[int]:
+        """Сохраняет страницы из текстового слоя и возвращает номера страниц, которые нужно распознать."""
+        ocr_page_indices = [idx for idx, page_text in enumerate(pages_text) if page_text is None]
+        meta = {
+            **meta,
+            "page_count": len(pages_text),
+            "text_layer_pages": len(pages_text) - len(ocr_page_indices),
+            "ocr_pages": len(ocr_page_indices),
+        }
+
+        pipe = self.client.pipeline()
+        pipe.set(self.key(stage_id, "meta"), json.dumps(meta, ensure_ascii=False), ex=self.ttl_seconds)
+        pipe.set(self.key(stage_id, "remaining"), len(ocr_page_indices), ex=self.ttl_seconds)
+        text_layer_pages = {idx: page_text for idx, page_text in enumerate(pages_text) if page_text is not None}
+        if text_layer_pages:
+            pipe.hset(self.key(stage_id, "pages"), mapping=text_layer_pages)
+            pipe.expire(self.key(stage_id, "pages"), self.ttl_seconds)
+        pipe.execute()
+        return ocr_page_indices
+
+    def get_meta(self, stage_id: str) -> Optional[dict]:
+        value = self.client.get(self.key(stage_id, "meta"))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def store_pages(self, stage_id: str, pages_text: Dict[int, str]) -> int:
+        """Возвращает число страниц, которые ещё распознаются, или -1, если документ уже завершился ошибкой."""
+        args = []
+        for page_idx, page_text in pages_text.items():
+            args.extend([page_idx, page_text])
+        remaining = self._store_pages(
+            keys=[self.key(stage_id, "pages"), self.key(stage_id, "remaining"), self.key(stage_id, "failed")],
+            args=args
+        )
+        self.client.expire(self.key(stage_id, "pages"), self.ttl_seconds)
+        return int(remaining)
+
+    def add_ocr_timing(self, stage_id: str, timing: StageTiming) -> None:
+        """Суммирует время распознавания по задачам группы."""
+        key = self.key(stage_id, "ocr_timing")
+        pipe = self.client.pipeline()
+        pipe.hincrbyfloat(key, "wall_seconds", timing.wall_seconds)
+        pipe.hincrbyfloat(key, "cpu_seconds", timing.cpu_seconds)
+        pipe.expire(key, self.ttl_seconds)
+        pipe.execute()
+
+    def get_ocr_timing(self, stage_id: str) -> Optional[StageTiming]:
+        values = self.client.hgetall(self.key(stage_id, "ocr_timing"))
+        if not values:
+            return None
+        return StageTiming(
+            wall_seconds=round(float(values[b"wall_seconds"]), 4),
+            cpu_seconds=round(float(values[b"cpu_seconds"]), 4)
+        )
+
+    def get_pages(self, stage_id: str, page_count: int) -> List[str]:
+        pages = self.client.hgetall(self.key(stage_id, "pages"))
+        return [pages[str(idx).encode()].decode() for idx in range(page_count)]
+
+    def mark_failed(self, stage_id: str) -> bool:
+        """Отмечает документ как завершившийся ошибкой; True получает только первый вызов."""
+        return bool(self.client.set(self.key(stage_id, "failed"), 1, nx=True, ex=self.ttl_seconds))
+
+    def is_failed(self, stage_id: str) -> bool:
+        return bool(self.client.exists(self.key(stage_id, "failed")))
+
+    def put_text(self, stage_id: str, recognized_document: RecognizedDocument) -> None:
+        value = recognized_adapter.dump_json(recognized_document)
+        pipe = self.client.pipeline()
+        pipe.set(self.key(stage_id, "text"), zlib.compress(value), ex=self.ttl_seconds)
+        # Страницы собраны в один текст и больше не нужны
+        pipe.delete(self.key(stage_id, "pages"), self.key(stage_id, "remaining"), self.key(stage_id, "ocr_timing"))
+        pipe.execute()
+
+    def get_text(self, stage_id: str) -> Optional[RecognizedDocument]:
+        value = self.client.get(self.key(stage_id, "text"))
+        if value is None:
+            return None
+        return recognized_adapter.validate_json(zlib.decompress(value))
+
+    def delete(self, stage_id: str) -> None:
+        self.client.delete(*(self.key(stage_id, name) for name in ("meta", "pages", "remaining", "ocr_timing", "text")))
+
+
+stage_state = DocumentStageState(redis_client, settings.STAGE_STATE_TTL_SECONDS)
@@ -0,0 +1,148 @@
+"""
+Пайплайн цепочкой задач на отдельных очередях.
+
+prepare_document (очередь OCR) берёт текстовый слой и раздаёт остальные страницы группе задач
+recognize_page_group. Последняя завершившаяся задача группы собирает текст документа и ставит
+process_document_text в очередь NLP. Между этапами передаётся только идентификатор, сам текст лежит в Redis.
+"""
+import logging
+import uuid
+from typing import Optional
+
+import fitz
+from celery import group
+
+from app.celery_folder.celery_client import celery_app
+from app.celery_folder.model_registry import model_registry
+from app.celery_folder.stage_state import stage_state
+from app.celery_folder.tasks import deliver_error, deliver_result
+from app.config import settings
+from app.job_coalescing import inflight_jobs
+from app.job_progress import job_progress
+from app.result_cache import pipeline_cache
+from app.upload_quota import upload_quota
+from pipeline_module.interfaces import InputApiData, RecognizedDocument
+from pipeline_module.ocr import RussianPDFOCR
+from pipeline_module.timing import measure_stage
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task
+def prepare_document(file_path: str, input_data_dict: dict, file_hash: Optional[str] = None, job_id: Optional[str] = None):
+    stage_id = job_id or str(uuid.uuid4())
+    meta = {"file_path": file_path, "input_data": input_data_dict, "file_hash": file_hash, "job_id": job_id}
+    try:
+        with inflight_jobs.keep_alive([job_id]):
+            recognized_document = pipeline_cache.get_ocr_text(file_hash) if file_hash else None
+            if recognized_document is not None:
+                logger.info('Текст документа взят из кэша OCR')
+                upload_quota.remove_file(file_path)
+                start_nlp_stage(stage_id, meta, recognized_document)
+                return
+
+            ocr = model_registry.get_ocr()
+            with fitz.open(file_path) as doc:
+                pages_text = ocr.get_text_layers(doc)
+            ocr_page_indices = stage_state.create(stage_id, meta, pages_text)
+            logger.info(f"Текстовый слой: {len(pages_text) - len(ocr_page_indices)} стр., OCR: {len(ocr_page_indices)} стр.")
+
+            if job_id:
+                job_progress.publish(job_id, "ocr", 0, len(ocr_page_indices))
+
+            if not ocr_page_indices:
+                finish_ocr_stage(stage_id)
+                return
+
+            pages_per_task = max(settings.OCR_PAGES_PER_TASK, 1)
+            group(
+                recognize_page_group.s(stage_id, ocr_page_indices[start:start + pages_per_task])
+                for start in range(0, len(ocr_page_indices), pages_per_task)
+            ).apply_async()
+
+    except Exception as e:
+        fail_document(stage_id, meta, e)
+        raise
+
+
+@celery_app.task
+def recognize_page_group(stage_id: str, page_indices: list[int]):
+    meta = stage_state.get_meta(stage_id)
+    if meta is None or stage_state.is_failed(stage_id):
+        logger.info(f'Документ {stage_id} уже завершился ошибкой, страницы {page_indices} не распознаются')
+        return
+
+    try:
+        with inflight_jobs.keep_alive([meta["job_id"]]):
+            ocr = model_registry.get_ocr()
+            stages = {}
+            with measure_stage(stages, "ocr"):
+                with fitz.open(meta["file_path"]) as doc:
+                    pages_text = ocr.recognize_pages(doc, page_indices)
+            stage_state.add_ocr_timing(stage_id, stages["ocr"])
+            remaining = stage_state.store_pages(stage_id, dict(zip(page_indices, pages_text)))
+    except Exception as e:
+        fail_document(stage_id, meta, e)
+        raise
+
+    # Страницы распознаются группами в разных процессах: ход обновляется по завершении группы
+    if meta["job_id"] and remaining >= 0:
+        job_progress.publish(meta["job_id"], "ocr", meta["ocr_pages"] - remaining, meta["ocr_pages"])
+
+    if remaining == 0:
+        finish_ocr_stage(stage_id)
+
+
+@celery_app.task
+def process_document_text(stage_id: str, input_data_dict: dict, file_hash: Optional[str] = None, job_id: Optional[str] = None):
+    try:
+        input_obj = InputApiData(**input_data_dict)
+        recognized_document = stage_state.get_text(stage_id)
+        if recognized_document is None:
+            raise RuntimeError(f"Текст документа {stage_id} не найден: истёк срок хранения промежуточного состояния")
+
+        with inflight_jobs.keep_alive([job_id]):
+            pipeline = model_registry.get_pipeline()
+            result = pipeline.process_recognized_text(recognized_document, input_obj.config, job_progress.reporter(job_id))
+        deliver_result(input_obj, result, file_hash, job_id)
+
+    except Exception as e:
+        deliver_error(job_id, e)
+        raise
+
+    finally:
+        stage_state.delete(stage_id)
+
+
+def finish_ocr_stage(stage_id: str) -> None:
+    """Собирает текст документа из страниц и передаёт его этапу NLP."""
+    meta = stage_state.get_meta(stage_id)
+    try:
+        recognized_document = RecognizedDocument(
+            text=RussianPDFOCR.join_pages(stage_state.get_pages(stage_id, meta["page_count"])),
+            text_layer_pages=meta["text_layer_pages"],
+            ocr_pages=meta["ocr_pages"],
+            # Сумма по задачам группы: время работы распознавания, а не длительность этапа по часам
+            ocr_timing=stage_state.get_ocr_timing(stage_id)
+        )
+        if meta["file_hash"]:
+            pipeline_cache.put_ocr_text(meta["file_hash"], recognized_document)
+        upload_quota.remove_file(meta["file_path"])
+        start_nlp_stage(stage_id, meta, recognized_document)
+    except Exception as e:
+        fail_document(stage_id, meta, e)
+        raise
+
+
+def start_nlp_stage(stage_id: str, meta: dict, recognized_document: RecognizedDocument) -> None:
+    stage_state.put_text(stage_id, recognized_document)
+    process_document_text.delay(stage_id, meta["input_data"], meta["file_hash"], meta["job_id"])
+
+
+def fail_document(stage_id: str, meta: dict, error: Exception) -> None:
+    # Несколько задач группы могут упасть одновременно: клиенты получают одну ошибку
+    if not stage_state.mark_failed(stage_id):
+        return
+    upload_quota.remove_file(meta["file_path"])
+    stage_state.delete(stage_id)
+    deliver_error(meta["job_id"], error)
@@ -1,50 +1,146 @@
-import asyncio
-import os
-import ssl
+import dataclasses
+import logging
+import time
+from typing import List, Optional
 
-import json
-import aiohttp
 import fitz
-from app.celery_folder.celery_worker import celery_app
-from pipeline_module.interfaces import OutputWorkerData, InputApiData
-from pipeline_module.pipeline import TextProcessingPipeline
+from celery import current_task
+from celery.signals import task_prerun
+from app.callback import send_errors, send_results
+from app.celery_folder.celery_client import celery_app
+from app.celery_folder.model_registry import model_registry
+from app.config import settings
+from app.job_coalescing import inflight_jobs
+from app.job_progress import job_progress
+from app.metrics import pipeline_metrics
+from app.result_cache import pipeline_cache
+from app.upload_quota import upload_quota
+from pipeline_module.interfaces import InputApiData, OutputPipelineData, RecognizedDocument
+
+logger = logging.getLogger(__name__)
+
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at is None:
+        return
+    task.request.queue_wait_seconds = max(time.time() - enqueued_at, 0.0)
+    pipeline_metrics.observe_queue_wait(task.name, task.request.queue_wait_seconds)
+
 
 @celery_app.task
 def add(x, y):
     return x + y
 
 
+def deliver_result(input_obj: InputApiData, result: OutputPipelineData, file_hash: Optional[str], job_id: Optional[str]) -> None:
+    if result.timing is not None and current_task:
+        result.timing.queue_wait_seconds = getattr(current_task.request, "queue_wait_seconds", None)
+    pipeline_metrics.record_result(result)
+    if not settings.RESULT_INCLUDE_TIMING:
+        result = dataclasses.replace(result, timing=None)
+
+    if file_hash:
+        pipeline_cache.put_result(file_hash, input_obj.config, result)
+
+    # Результат получают все клиенты, присоединившиеся к заданию, каждый со своими входными данными.
+    # Доставка идёт в фоне, задача не ждёт ответа получателя
+    waiting = inflight_jobs.finish(job_id) if job_id else [input_obj]
+    send_results(waiting, result)
+    if job_id:
+        job_progress.publish(job_id, "done")
+
+
+def deliver_error(job_id: Optional[str], error: Exception) -> None:
+    if job_id:
+        detail = f"Ошибка обработки файла: {str(error)}"
+        send_errors(inflight_jobs.finish(job_id), detail)
+        job_progress.publish(job_id, "error", detail=detail)
+
+
+def recognize_file(pipeline, file_path: str, file_hash: Optional[str], progress) -> RecognizedDocument:
+    # Текст после OCR не зависит от паттернов и настроек NER, поэтому кэшируется отдельно
+    recognized_document = pipeline_cache.get_ocr_text(file_hash) if file_hash else None
+    if recognized_document is None:
+        with fitz.open(file_path) as doc:
+            recognized_document = pipeline.recognize_document(doc, progress)
+        if file_hash:
+            pipeline_cache.put_ocr_text(file_hash, recognized_document)
+    else:
+        logger.info('Текст документа взят из кэша OCR')
+    return recognized_document
+
+
+@celery_app.task
+def get_key_phrases(file_path: str, input_data_dict: dict, file_hash: Optional[str] = None, job_id: Optional[str] = None):
+    try:
+        input_obj = InputApiData(**input_data_dict)
+        pipeline = model_registry.get_pipeline()
+        progress = job_progress.reporter(job_id)
+
+        with inflight_jobs.keep_alive([job_id]):
+            recognized_document = recognize_file(pipeline, file_path, file_hash, progress)
+            result = pipeline.process_recognized_text(recognized_document, input_obj.config, progress)
+        deliver_result(input_obj, result, file_hash, job_id)
+
+    except Exception as e:
+        deliver_error(job_id, e)
+        raise
+
+    finally:
+        upload_quota.remove_file(file_path)
+
+
 @celery_app.task
-def get_key_phrases(file_path: str, input_data_dict: dict):
-    async def async_main():
-        try:
-            input_obj = InputApiData(**input_data_dict)
-            pipeline = TextProcessingPipeline("ru_core_news_md", "paraphrase-multilingual-MiniLM-L12-v2")
-
-            with fitz.open(file_path) as doc:
-                result = pipeline.process_text(doc, input_obj.config)
-                output_result = OutputWorkerData(input_data=input_obj, output_data=result)
-
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-
-            payload = {
-                "status": "done",
-                "result": output_result.model_dump()
-            }
-            json_payload = json.dumps(payload, ensure_ascii=False)
-
-            async with aiohttp.ClientSession() as session:
-                await session.post(
-                    input_obj.callback_url,
-                    data=json_payload,
-                    headers={"Content-Type": "application/json"},
-                    ssl=ssl_context
+def get_key_phrases_batch(items: List[dict]):
+    """
+    Группа документов пакетного запроса: OCR по документам, затем общий прогон spaCy и модели эмбеддингов.
+
+    items -- аргументы get_key_phrases для каждого документа. Ошибка распознавания или обработки одного документа
+    не мешает остальным; результаты и ошибки доставляются по документам.
+    """
+    pipeline = model_registry.get_pipeline()
+    recognized = []
+    try:
+        with inflight_jobs.keep_alive(item["job_id"] for item in items):
+            for item in items:
+                try:
+                    input_obj = InputApiData(**item["input_data_dict"])
+                    progress = job_progress.reporter(item["job_id"])
+                    recognized_document = recognize_file(pipeline, item["file_path"], item["file_hash"], progress)
+                    pipeline.check_text_length(recognized_document)
+                    recognized.append((input_obj, recognized_document, progress, item))
+                except Exception as e:
+                    logger.exception(f"Ошибка распознавания документа {item['input_data_dict']['file_link']}")
+                    deliver_error(item["job_id"], e)
+
+            if not recognized:
+                return
+
+            try:
+                results = pipeline.process_recognized_batch(
+                    [recognized_document for _, recognized_document, _, _ in recognized],
+                    [input_obj.config for input_obj, _, _, _ in recognized],
+                    [progress for _, _, progress, _ in recognized]
                 )
+            except Exception:
+                # Один документ не должен ронять всю группу: документы обрабатываются заново по одному,
+                # и каждый получает свой результат или свою ошибку
+                logger.exception(f"Ошибка обработки группы из {len(recognized)} документов, документы обрабатываются по одному")
+                for input_obj, recognized_document, progress, item in recognized:
+                    try:
+                        result = pipeline.process_recognized_text(recognized_document, input_obj.config, progress)
+                    except Exception as e:
+                        logger.exception(f"Ошибка обработки документа {item['input_data_dict']['file_link']}")
+                        deliver_error(item["job_id"], e)
+                        continue
+                    deliver_result(input_obj, result, item["file_hash"], item["job_id"])
+                return
 
-        finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            for (input_obj, _, _, item), result in zip(recognized, results):
+                deliver_result(input_obj, result, item["file_hash"], item["job_id"])
 
-    asyncio.run(async_main())
+    finally:
+        for item in items:
+            upload_quota.remove_file(item["file_path"])
@@ -1,6 +1,9 @@
+import logging
 import os
 import ssl
+from typing import Optional
 import redis
+import redis.asyncio
 from celery import Celery
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -15,12 +18,65 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = os.path.join(BASE_DIR, 'app/uploads')
     MAX_FILE_SIZE_MB: int
     MAX_DIR_SIZE_GB: int
+    DOWNLOAD_CHUNK_SIZE_KB: int = 1024  # Размер части, которой скачиваемый файл пишется на диск
+    UPLOAD_QUOTA_KEY: str = "upload_quota:used_bytes"  # Ключ Redis со счётчиком занятого места в UPLOAD_DIR
+    RESULT_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # Время жизни готовых результатов в кэше
+    RESULT_CACHE_MAX_MB: int = 256  # Предельный суммарный размер кэша результатов (в сжатом виде)
+    OCR_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # Время жизни распознанного текста в кэше
+    OCR_CACHE_MAX_MB: int = 1024  # Предельный суммарный размер кэша распознанного текста (в сжатом виде)
+    INFLIGHT_JOB_TTL_SECONDS: int = 24 * 3600  # Сколько живёт запись о выполняющемся задании, если воркер её не закрыл
+    INFLIGHT_QUEUED_LEASE_SECONDS: int = 3600  # Сколько задание может ждать в очереди, прежде чем считаться потерянным
+    INFLIGHT_HEARTBEAT_SECONDS: float = 30.0  # Период продления аренды задания воркером во время обработки
+    CALLBACK_MAX_CONCURRENCY: int = 16  # Одновременных запросов на callback_url из одного процесса
+    CALLBACK_MAX_ATTEMPTS: int = 5  # Попыток доставки результата, прежде чем он уйдёт в dead letter
+    CALLBACK_BACKOFF_BASE_SECONDS: float = 1.0  # Начальная задержка между попытками (удваивается с каждой)
+    CALLBACK_BACKOFF_MAX_SECONDS: float = 60.0  # Верхняя граница задержки между попытками
+    CALLBACK_TIMEOUT_SECONDS: float = 30.0  # Таймаут одного запроса на callback_url
+    CALLBACK_DEAD_LETTER_KEY: str = "callbacks:dead_letter"  # Список Redis с недоставленными результатами
+    CALLBACK_DEAD_LETTER_MAX: int = 10000  # Сколько последних недоставленных результатов хранить
+    SPACY_MODEL_NAME: str = "ru_core_news_md"
+    SPACY_MAX_LENGTH: int = 400000  # Максимальная длина текста для spaCy в символах; длиннее -- ошибка обработки документа
+    BERT_MODEL_NAME: str = "paraphrase-multilingual-MiniLM-L12-v2"
+    WORKER_READY_FILE: Optional[str] = None  # Префикс файла-маркера готовности воркера (к нему добавляется pid)
+    WORKER_PROCESSES_KEY_PREFIX: str = "worker_processes"  # Префикс хэша Redis с готовностью процессов пула каждого воркера
+    WORKER_MODEL_LOAD_TIMEOUT: float = 300.0  # Сколько секунд процесс воркера может загружать модели
+    WORKER_ROLE: str = "all"  # "all" -- весь пайплайн, "ocr" -- только распознавание, "nlp" -- этапы после OCR
+    PIPELINE_STAGED: bool = False  # Запускать пайплайн цепочкой задач: OCR группами страниц, затем NLP
+    OCR_QUEUE: str = "ocr"  # Очередь задач распознавания страниц
+    NLP_QUEUE: str = "nlp"  # Очередь задач spaCy, BERT, NER и склонения
+    OCR_PAGES_PER_TASK: int = 8  # Сколько страниц распознаёт одна задача группы OCR
+    STAGE_STATE_TTL_SECONDS: int = 24 * 3600  # Время жизни промежуточного состояния документа между этапами
+    WORKER_PRELOAD_MODELS: bool = False  # Загружать модели до fork, чтобы процессы prefork делили их память
+    TORCH_THREADS_PER_PROCESS: int = 0  # Потоков torch на процесс после fork (0 -- ядра поровну между процессами)
+    OCR_WORKERS: int = 1  # Максимум процессов для постраничного OCR (1 -- последовательное распознавание)
+    OCR_RESERVED_CPUS: int = 1  # Ядра, которые OCR оставляет свободными под spaCy и модель эмбеддингов
+    OCR_USE_TEXT_LAYER: bool = True  # Не распознавать страницы с пригодным текстовым слоем
+    OCR_BACKEND: str = "pytesseract"  # "pytesseract" или "tesserocr" (нужен пакет tesserocr)
+    BERT_ENCODE_BATCH_SIZE: int = 64  # Размер батча SentenceTransformer.encode для фраз-кандидатов
+    BERT_NORMALIZE_EMBEDDINGS: bool = True  # Нормировать эмбеддинги, чтобы сходство считалось скалярным произведением
+    BERT_DOC_EMBEDDING: str = "full"  # "full" -- начало текста в пределах max_seq_length, "chunks" -- среднее по фрагментам
+    BERT_DOC_CHUNK_TOKENS: int = 0  # Максимум токенов во фрагменте документа (0 -- max_seq_length модели)
+    BERT_DOC_MAX_CHUNKS: int = 64  # Сколько фрагментов кодировать у длинного документа (0 -- все)
+    PHRASE_CACHE_DIR: str = ""  # Каталог кэша эмбеддингов фраз, общего для воркеров машины (пусто -- без кэша)
+    PHRASE_CACHE_CAPACITY: int = 100000  # Фраз в кэше; место на диске -- capacity * размерность * 4 байта
+    BATCH_MAX_DOCUMENTS: int = 1000  # Максимум документов в одном пакетном запросе
+    BATCH_GROUP_SIZE: int = 16  # Документов пакета в одной задаче: spaCy и модель эмбеддингов обрабатывают их вместе
+    BATCH_DOWNLOAD_CONCURRENCY: int = 8  # Одновременные скачивания файлов пакетного запроса
+    JOB_PROGRESS_TTL_SECONDS: int = 24 * 3600  # Сколько хранится последнее состояние задания для новых подписчиков
+    SSE_KEEPALIVE_SECONDS: float = 15.0  # Период пустых сообщений в потоке SSE, чтобы прокси не закрывали соединение
+    LOG_LEVEL: str = "INFO"  # Уровень логов пайплайна и приложения; DEBUG выводит кандидатов и промежуточные данные
+    RESULT_INCLUDE_TIMING: bool = False  # Добавлять в результат блок timing с временем этапов
+    METRICS_KEY_PREFIX: str = "metrics"  # Префикс ключей Redis с накопленными метриками пайплайна
     model_config = SettingsConfigDict(env_file=f"{BASE_DIR}/.env")
 
 
 # Получаем параметры для загрузки переменных среды
 settings = Settings()
 
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+for logger_name in ("app", "pipeline_module"):
+    logging.getLogger(logger_name).setLevel(settings.LOG_LEVEL)
+
 ssl_options = {
     "ssl_cert_reqs": ssl.CERT_NONE,
     "ssl_check_hostname": False  # это важно!
@@ -35,3 +91,14 @@ redis_client = redis.Redis(
     ssl_cert_reqs=None,
     ssl_check_hostname=False
 )
+
+# Асинхронный клиент с теми же параметрами: нужен API для подписки на события без блокировки event loop
+async_redis_client = redis.asyncio.Redis(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=0,
+    password=settings.REDIS_PASSWORD,
+    ssl=True,
+    ssl_cert_reqs=None,
+    ssl_check_hostname=False
+)
@@ -0,0 +1,190 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+import redis
+
+from app.config import settings, redis_client
+from app.result_cache import canonical_hash, config_adapter
+from pipeline_module.interfaces import InputApiData, InputPipelineData
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "inflight:key"
+JOB_PREFIX = "inflight:job"
+LEASE_PREFIX = "inflight:lease"
+
+# Задание живо, пока существуют список ожидающих его клиентов и аренда. Аренду продлевает воркер, пока
+# обрабатывает задание; если воркер упал или задача потерялась, аренда истекает, и следующий такой же
+# запрос забирает себе ожидающих мёртвого задания и запускает новое. Ключ без списка остаётся
+# от завершённого задания и перезаписывается.
+# Возвращает {id задания, к которому присоединён клиент; id перехваченного мёртвого задания или ''}
+JOIN_OR_CREATE_SCRIPT = """
+local job_id = redis.call('GET', KEYS[1])
+local new_job_key = ARGV[4] .. ':' .. ARGV[1]
+local replaced = ''
+if job_id and redis.call('EXISTS', ARGV[4] .. ':' .. job_id) == 1 then
+    if redis.call('EXISTS', ARGV[5] .. ':' .. job_id) == 1 then
+        redis.call('RPUSH', ARGV[4] .. ':' .. job_id, ARGV[2])
+        return {job_id, ''}
+    end
+    redis.call('RENAME', ARGV[4] .. ':' .. job_id, new_job_key)
+    replaced = job_id
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('RPUSH', new_job_key, ARGV[2])
+redis.call('EXPIRE', new_job_key, ARGV[3])
+redis.call('SET', ARGV[5] .. ':' .. ARGV[1], '1', 'EX', ARGV[6])
+return {ARGV[1], replaced}
+"""
+
+# После скачивания: если тот же файл (по содержимому) с той же конфигурацией уже обрабатывается под
+# другой ссылкой, переносим всех ожидающих в то задание и перенаправляем на него ключ ссылки.
+# Ожидающие мёртвого задания, наоборот, переходят к нашему
+MERGE_BY_CONTENT_SCRIPT = """
+local my_job_key = ARGV[3] .. ':' .. ARGV[1]
+local other_job_id = redis.call('GET', KEYS[1])
+local replaced = ''
+if other_job_id and other_job_id ~= ARGV[1] and redis.call('EXISTS', ARGV[3] .. ':' .. other_job_id) == 1 then
+    local other_job_key = ARGV[3] .. ':' .. other_job_id
+    if redis.call('EXISTS', ARGV[4] .. ':' .. other_job_id) == 1 then
+        local waiting = redis.call('LRANGE', my_job_key, 0, -1)
+        for _, payload in ipairs(waiting) do
+            redis.call('RPUSH', other_job_key, payload)
+        end
+        redis.call('DEL', my_job_key)
+        redis.call('SET', KEYS[2], other_job_id, 'KEEPTTL')
+        return {other_job_id, ''}
+    end
+    for _, payload in ipairs(redis.call('LRANGE', other_job_key, 0, -1)) do
+        redis.call('RPUSH', my_job_key, payload)
+    end
+    redis.call('DEL', other_job_key)
+    replaced = other_job_id
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return {ARGV[1], replaced}
+"""
+
+FINISH_SCRIPT = """
+local waiting = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+return waiting
+"""
+
+# Продлевает аренду только живым заданиям: у завершённого списка ожидающих уже нет
+RENEW_LEASES_SCRIPT = """
+for i, job_id in ipairs(ARGV) do
+    if i > 3 and redis.call('EXISTS', ARGV[2] .. ':' .. job_id) == 1 then
+        redis.call('SET', ARGV[3] .. ':' .. job_id, '1', 'PX', ARGV[1])
+    end
+end
+return 0
+"""
+
+
+def link_coalescing_key(file_link: str, config: InputPipelineData) -> str:
+    config_hash = canonical_hash(config_adapter.dump_python(config, mode="json"))
+    return canonical_hash({"file_link": file_link, "config": config_hash})
+
+
+class InflightJobs:
+    """
+    Объединение одинаковых одновременных запросов в одно задание пайплайна.
+
+    Каждое задание хранит в Redis список InputApiData всех клиентов, которые ждут его результат; воркер
+    по завершении забирает список целиком и отправляет результат каждому клиенту отдельно.
+    """
+
+    def __init__(self, client: redis.Redis, ttl_seconds: int, queued_lease_seconds: int, heartbeat_seconds: float):
+        """
+        ttl_seconds -- предельный срок жизни записи о задании;
+        queued_lease_seconds -- аренда задания, ожидающего в очереди: столько оно может не подавать признаков жизни;
+        heartbeat_seconds -- период продления аренды воркером; во время обработки аренда -- три периода.
+        """
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.queued_lease_seconds = queued_lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._join_or_create = client.register_script(JOIN_OR_CREATE_SCRIPT)
+        self._merge_by_content = client.register_script(MERGE_BY_CONTENT_SCRIPT)
+        self._finish = client.register_script(FINISH_SCRIPT)
+        self._renew_leases = client.register_script(RENEW_LEASES_SCRIPT)
+
+    @staticmethod
+    def key(coalescing_key: str) -> str:
+        return f"{KEY_PREFIX}:{coalescing_key}"
+
+    @staticmethod
+    def _job_reply(result) -> Tuple[str, Optional[str]]:
+        job_id, replaced_job_id = (item.decode() for item in result)
+        return job_id, replaced_job_id or None
+
+    def join_or_create(self, coalescing_key: str, job_id: str, input_data: InputApiData) -> Tuple[str, Optional[str]]:
+        """
+        Возвращает id задания, к которому присоединён клиент (совпадение с job_id означает новое задание),
+        и id мёртвого задания, ожидающие которого перешли к новому.
+        """
+        result = self._join_or_create(
+            keys=[self.key(coalescing_key)],
+            args=[job_id, input_data.model_dump_json(), self.ttl_seconds, JOB_PREFIX, LEASE_PREFIX,
+                  self.queued_lease_seconds]
+        )
+        return self._job_reply(result)
+
+    def merge_by_content(self, content_key: str, link_key: str, job_id: str) -> Tuple[str, Optional[str]]:
+        result = self._merge_by_content(
+            keys=[self.key(content_key), self.key(link_key)],
+            args=[job_id, self.ttl_seconds, JOB_PREFIX, LEASE_PREFIX]
+        )
+        return self._job_reply(result)
+
+    def finish(self, job_id: str) -> List[InputApiData]:
+        """Завершает задание и возвращает всех клиентов, которые ждали его результат."""
+        waiting = self._finish(keys=[f"{JOB_PREFIX}:{job_id}", f"{LEASE_PREFIX}:{job_id}"])
+        return [InputApiData(**json.loads(payload)) for payload in waiting]
+
+    def renew_leases(self, job_ids: Iterable[str], lease_seconds: float) -> None:
+        try:
+            self._renew_leases(args=[max(int(lease_seconds * 1000), 1), JOB_PREFIX, LEASE_PREFIX, *job_ids])
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось продлить аренду заданий: {e}")
+
+    @contextmanager
+    def keep_alive(self, job_ids: Iterable[Optional[str]]):
+        """
+        Продлевает аренду заданий, пока выполняется блок.
+
+        После блока аренда снова рассчитана на ожидание в очереди: в поэтапном режиме задание
+        переходит в следующую очередь.
+        """
+        job_ids = [job_id for job_id in job_ids if job_id]
+        if not job_ids:
+            yield
+            return
+
+        stop = threading.Event()
+
+        def heartbeat() -> None:
+            while not stop.wait(self.heartbeat_seconds):
+                self.renew_leases(job_ids, 3 * self.heartbeat_seconds)
+
+        self.renew_leases(job_ids, 3 * self.heartbeat_seconds)
+        thread = threading.Thread(target=heartbeat, name="inflight-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.renew_leases(job_ids, self.queued_lease_seconds)
+
+
+inflight_jobs = InflightJobs(
+    redis_client,
+    settings.INFLIGHT_JOB_TTL_SECONDS,
+    settings.INFLIGHT_QUEUED_LEASE_SECONDS,
+    settings.INFLIGHT_HEARTBEAT_SECONDS
+)
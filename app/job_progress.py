@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Set
+
+import redis
+import redis.asyncio
+
+from app.config import settings, redis_client, async_redis_client
+from pipeline_module.interfaces import ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_PREFIX = "progress"
+# После этих этапов событий по заданию больше не будет; "merged" -- задание присоединено к другому (merged_into)
+TERMINAL_STAGES = {"done", "error", "merged"}
+
+
+def events_channel(job_id: str) -> str:
+    return f"{PROGRESS_PREFIX}:events:{job_id}"
+
+
+def state_key(job_id: str) -> str:
+    return f"{PROGRESS_PREFIX}:state:{job_id}"
+
+
+def seq_key(job_id: str) -> str:
+    return f"{PROGRESS_PREFIX}:seq:{job_id}"
+
+
+class JobProgress:
+    """
+    Публикация хода обработки заданий через Redis pub/sub.
+
+    Каждое событие получает порядковый номер и, кроме публикации в канал задания, сохраняется как последнее
+    состояние: подписчик, пришедший позже, сразу видит текущий этап.
+    """
+
+    def __init__(self, client: redis.Redis, ttl_seconds: int):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    def publish(self, job_id: str, stage: str, current: Optional[int] = None, total: Optional[int] = None,
+                **extra) -> None:
+        # Ход обработки -- вспомогательная информация: ошибка Redis не должна прерывать задание
+        try:
+            seq = self.client.incr(seq_key(job_id))
+            event = {"job_id": job_id, "seq": seq, "stage": stage, "time": time.time(), **extra}
+            if total is not None:
+                event["current"] = current
+                event["total"] = total
+            payload = json.dumps(event, ensure_ascii=False)
+
+            pipe = self.client.pipeline(transaction=False)
+            pipe.expire(seq_key(job_id), self.ttl_seconds)
+            pipe.set(state_key(job_id), payload, ex=self.ttl_seconds)
+            pipe.publish(events_channel(job_id), payload)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось опубликовать ход задания {job_id}: {e}")
+
+    def reporter(self, job_id: Optional[str]) -> Optional[ProgressCallback]:
+        """Callback для пайплайна, публикующий этапы задания job_id."""
+        if job_id is None:
+            return None
+
+        def report(stage: str, current: Optional[int] = None, total: Optional[int] = None) -> None:
+            self.publish(job_id, stage, current, total)
+
+        return report
+
+
+class ProgressHub:
+    """
+    Раздача событий заданий подписчикам внутри процесса API.
+
+    На процесс открывается одна подписка Redis по шаблону канала; события раскладываются по очередям
+    подписчиков в памяти, поэтому число соединений с Redis не зависит от числа клиентов.
+    Пока подписка не подтверждена Redis, события не доставляются: подписчики ждут подтверждения,
+    а после него перечитывают сохранённое состояние задания.
+    """
+
+    def __init__(self, client: redis.asyncio.Redis):
+        self.client = client
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    def _ensure_listening(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.psubscribe(events_channel("*"))
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        # События, опубликованные до подтверждения (в том числе пока подписка восстанавливалась),
+                        # не придут: подписчики сверяются с сохранённым состоянием
+                        self._subscribed.set()
+                        for queues in self._subscribers.values():
+                            for queue in queues:
+                                queue.put_nowait(None)
+                        continue
+                    if message["type"] != "pmessage":
+                        continue
+                    job_id = message["channel"].decode().rsplit(":", 1)[1]
+                    for queue in self._subscribers.get(job_id, ()):
+                        queue.put_nowait(message["data"])
+            except redis.RedisError as e:
+                logger.warning(f"Подписка на ход заданий прервана: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._subscribed.clear()
+                await pubsub.aclose()
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def events(self, job_id: str, keepalive_seconds: float) -> AsyncIterator[Optional[dict]]:
+        """
+        События задания начиная с текущего состояния и до завершения.
+
+        None означает, что за keepalive_seconds событий не было: поток нужно поддержать пустым сообщением.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        # Подписываемся до чтения состояния, чтобы не пропустить событие между ними
+        self._ensure_listening()
+        self._subscribers[job_id].add(queue)
+        try:
+            # При холодном старте psubscribe ещё не подтверждён: событие, опубликованное до подтверждения,
+            # потерялось бы, а без "done" поток не закрылся бы никогда
+            while not self._subscribed.is_set():
+                try:
+                    await asyncio.wait_for(self._subscribed.wait(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+
+            last_seq = 0
+            state = await self.client.get(state_key(job_id))
+            if state is not None:
+                event = json.loads(state)
+                last_seq = event["seq"]
+                yield event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                if payload is None:
+                    # Подписка (вос)становлена: пропущенные события видны по сохранённому состоянию
+                    payload = await self.client.get(state_key(job_id))
+                    if payload is None:
+                        continue
+
+                event = json.loads(payload)
+                # Событие уже могло прийти в сохранённом состоянии
+                if event["seq"] <= last_seq:
+                    continue
+                last_seq = event["seq"]
+                yield event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+        finally:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    async def get_state(self, job_id: str) -> Optional[dict]:
+        state = await self.client.get(state_key(job_id))
+        if state is None:
+            return None
+        return json.loads(state)
+
+
+job_progress = JobProgress(redis_client, settings.JOB_PROGRESS_TTL_SECONDS)
+progress_hub = ProgressHub(async_redis_client)
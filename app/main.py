@@ -1,12 +1,31 @@
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.router import router as router_api
+from app.callback import callback_dispatcher
 from app.config import settings
+from app.job_progress import progress_hub
+from app.upload_quota import upload_quota
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Сверяем счётчик квоты с фактическим содержимым каталога загрузок
+    used_bytes = await asyncio.to_thread(upload_quota.reconcile, settings.UPLOAD_DIR)
+    logger.info(f"Занято в каталоге загрузок: {used_bytes} байт")
+    yield
+    await progress_hub.stop()
+    await asyncio.to_thread(callback_dispatcher.close, settings.CALLBACK_TIMEOUT_SECONDS)
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 # Добавляем middleware для CORS
 app.add_middleware(
     CORSMiddleware,
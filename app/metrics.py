@@ -0,0 +1,114 @@
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+
+import redis
+
+from app.config import settings, redis_client
+from pipeline_module.interfaces import OutputPipelineData
+
+logger = logging.getLogger(__name__)
+
+# Описание метрик для экспорта в формате Prometheus: имя -> (тип, описание)
+METRICS = {
+    "pipeline_documents_total": ("counter", "Обработанные пайплайном документы"),
+    "pipeline_pages_total": ("counter", "Страницы документов по источнику текста"),
+    "pipeline_stage_wall_seconds": ("summary", "Время этапа пайплайна по часам"),
+    "pipeline_stage_cpu_seconds": ("summary", "Процессорное время этапа пайплайна"),
+    "pipeline_ocr_pages_per_second": ("summary", "Скорость распознавания страниц через OCR"),
+    "pipeline_candidates": ("summary", "Фразы-кандидаты, найденные паттерном"),
+    "pipeline_encode_batch_size": ("summary", "Размер батча, отправленного в модель эмбеддингов"),
+    "pipeline_phrase_cache_lookups_total": ("counter", "Поиск фраз в кэше эмбеддингов по результату"),
+    "pipeline_phrase_cache_evictions_total": ("counter", "Фразы, вытесненные из кэша эмбеддингов"),
+    "celery_queue_wait_seconds": ("summary", "Время ожидания задачи в очереди Celery"),
+}
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+class PipelineMetrics:
+    """
+    Метрики пайплайна, общие для всех процессов воркеров.
+
+    Воркеры накапливают суммы и счётчики в одном хэше Redis, API отдаёт их в текстовом формате Prometheus.
+    Гистограммы не ведутся: для summary хранятся только _sum и _count, среднее считается на стороне Prometheus.
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str):
+        self.client = client
+        self.key = f"{prefix}:values"
+
+    def _inc(self, pipe, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        pipe.hincrbyfloat(self.key, f"{name}{format_labels(labels)}", amount)
+
+    def _observe(self, pipe, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        pipe.hincrbyfloat(self.key, f"{name}_sum{format_labels(labels)}", value)
+        pipe.hincrby(self.key, f"{name}_count{format_labels(labels)}", 1)
+
+    def record_result(self, result: OutputPipelineData) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        self._inc(pipe, "pipeline_documents_total")
+        self._inc(pipe, "pipeline_pages_total", result.text_layer_pages, {"source": "text_layer"})
+        self._inc(pipe, "pipeline_pages_total", result.ocr_pages, {"source": "ocr"})
+
+        timing = result.timing
+        if timing is not None:
+            for stage, stage_timing in timing.stages.items():
+                self._observe(pipe, "pipeline_stage_wall_seconds", stage_timing.wall_seconds, {"stage": stage})
+                self._observe(pipe, "pipeline_stage_cpu_seconds", stage_timing.cpu_seconds, {"stage": stage})
+            if timing.ocr_pages_per_second is not None:
+                self._observe(pipe, "pipeline_ocr_pages_per_second", timing.ocr_pages_per_second)
+            for pattern_code, candidates in timing.candidates_per_pattern.items():
+                self._observe(pipe, "pipeline_candidates", candidates, {"pattern": pattern_code})
+            for batch_size in timing.encode_batch_sizes:
+                self._observe(pipe, "pipeline_encode_batch_size", batch_size)
+            if timing.phrase_cache:
+                self._inc(pipe, "pipeline_phrase_cache_lookups_total", timing.phrase_cache["hits"], {"result": "hit"})
+                self._inc(pipe, "pipeline_phrase_cache_lookups_total", timing.phrase_cache["misses"], {"result": "miss"})
+                self._inc(pipe, "pipeline_phrase_cache_evictions_total", timing.phrase_cache["evictions"])
+
+        self._execute(pipe)
+
+    def observe_queue_wait(self, task_name: str, seconds: float) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        self._observe(pipe, "celery_queue_wait_seconds", seconds, {"task": task_name})
+        self._execute(pipe)
+
+    @staticmethod
+    def _execute(pipe) -> None:
+        # Метрики не должны ронять обработку документа
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось записать метрики в Redis: {e}")
+
+    def render(self) -> str:
+        """Текущие значения в текстовом формате Prometheus."""
+        samples = defaultdict(list)
+        for field, value in sorted(self.client.hgetall(self.key).items()):
+            sample_name = field.decode()
+            base_name = sample_name.split("{", 1)[0]
+            for suffix in ("_sum", "_count"):
+                if base_name.endswith(suffix) and base_name[:-len(suffix)] in METRICS:
+                    base_name = base_name[:-len(suffix)]
+            samples[base_name].append(f"{sample_name} {float(value)}")
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            if name not in samples:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+
+pipeline_metrics = PipelineMetrics(redis_client, settings.METRICS_KEY_PREFIX)
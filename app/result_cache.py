@@ -0,0 +1,154 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import time
+import zlib
+from typing import Optional
+
+import redis
+from pydantic import TypeAdapter
+
+from app.config import settings, redis_client
+from pipeline_module.interfaces import InputPipelineData, OutputPipelineData, RecognizedDocument
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменениях пайплайна, которые меняют результат: старые записи кэша перестают находиться
+PIPELINE_CACHE_VERSION = 2
+
+output_adapter = TypeAdapter(OutputPipelineData)
+config_adapter = TypeAdapter(InputPipelineData)
+recognized_adapter = TypeAdapter(RecognizedDocument)
+
+
+def canonical_hash(data: dict) -> str:
+    canonical_json = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical_json.encode("utf-8")).hexdigest()
+
+
+def ocr_signature() -> dict:
+    """Настройки, от которых зависит текст документа"""
+    return {
+        "version": PIPELINE_CACHE_VERSION,
+        "backend": settings.OCR_BACKEND,
+        "use_text_layer": settings.OCR_USE_TEXT_LAYER,
+    }
+
+
+def ocr_cache_key(file_hash: str) -> str:
+    return f"{file_hash}:{canonical_hash(ocr_signature())}"
+
+
+def result_cache_key(file_hash: str, config: InputPipelineData) -> str:
+    signature = {
+        "ocr": ocr_signature(),
+        "config": config_adapter.dump_python(config, mode="json"),
+        "spacy_model": settings.SPACY_MODEL_NAME,
+        "bert_model": settings.BERT_MODEL_NAME,
+        "doc_embedding": [settings.BERT_DOC_EMBEDDING, settings.BERT_DOC_CHUNK_TOKENS, settings.BERT_DOC_MAX_CHUNKS],
+    }
+    return f"{file_hash}:{canonical_hash(signature)}"
+
+
+class RedisBlobCache:
+    """
+    Кэш сжатых значений в Redis с TTL и ограничением суммарного размера.
+
+    Записи учитываются в отсортированном по времени добавления индексе; при превышении max_bytes
+    удаляются самые старые.
+    """
+
+    def __init__(self, client: redis.Redis, prefix: str, ttl_seconds: int, max_bytes: int):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.index_key = f"{prefix}:index"
+        self.sizes_key = f"{prefix}:sizes"
+        self.total_key = f"{prefix}:total_bytes"
+
+    def get(self, key: str) -> Optional[bytes]:
+        # Кэш не должен ломать обработку: при недоступном Redis просто считаем, что записи нет
+        try:
+            value = self.client.get(f"{self.prefix}:{key}")
+        except redis.RedisError as e:
+            logger.warning(f"Кэш {self.prefix} недоступен: {e}")
+            return None
+
+        if value is None:
+            return None
+        return zlib.decompress(value)
+
+    def put(self, key: str, value: bytes) -> None:
+        try:
+            self.__put(key, value)
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось сохранить запись в кэш {self.prefix}: {e}")
+
+    def __put(self, key: str, value: bytes) -> None:
+        compressed = zlib.compress(value)
+        if len(compressed) > self.max_bytes:
+            return
+
+        pipe = self.client.pipeline()
+        pipe.set(f"{self.prefix}:{key}", compressed, ex=self.ttl_seconds)
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.hget(self.sizes_key, key)
+        pipe.hset(self.sizes_key, key, len(compressed))
+        _, _, previous_size, _ = pipe.execute()
+        self.client.incrby(self.total_key, len(compressed) - int(previous_size or 0))
+
+        self.__evict()
+
+    def __evict(self) -> None:
+        while int(self.client.get(self.total_key) or 0) > self.max_bytes:
+            oldest = self.client.zpopmin(self.index_key)
+            if not oldest:
+                self.client.set(self.total_key, 0)
+                return
+
+            oldest_key = oldest[0][0].decode()
+            # Запись могла уже истечь по TTL: её размер всё равно вычитается из счётчика
+            pipe = self.client.pipeline()
+            pipe.delete(f"{self.prefix}:{oldest_key}")
+            pipe.hget(self.sizes_key, oldest_key)
+            pipe.hdel(self.sizes_key, oldest_key)
+            _, size, _ = pipe.execute()
+            self.client.decrby(self.total_key, int(size or 0))
+
+
+class PipelineCache:
+    """Кэш результатов пайплайна по хэшу PDF и конфигурации, а также отдельный кэш текста после OCR."""
+
+    def __init__(self, client: redis.Redis):
+        self.results = RedisBlobCache(
+            client, "result_cache", settings.RESULT_CACHE_TTL_SECONDS, settings.RESULT_CACHE_MAX_MB * 1024 * 1024
+        )
+        self.ocr_texts = RedisBlobCache(
+            client, "ocr_cache", settings.OCR_CACHE_TTL_SECONDS, settings.OCR_CACHE_MAX_MB * 1024 * 1024
+        )
+
+    def get_result(self, file_hash: str, config: InputPipelineData) -> Optional[OutputPipelineData]:
+        value = self.results.get(result_cache_key(file_hash, config))
+        if value is None:
+            return None
+        return output_adapter.validate_json(value)
+
+    def put_result(self, file_hash: str, config: InputPipelineData, result: OutputPipelineData) -> None:
+        value = output_adapter.dump_json(dataclasses.replace(result, timing=None))
+        self.results.put(result_cache_key(file_hash, config), value)
+
+    def get_ocr_text(self, file_hash: str) -> Optional[RecognizedDocument]:
+        value = self.ocr_texts.get(ocr_cache_key(file_hash))
+        if value is None:
+            return None
+        return recognized_adapter.validate_json(value)
+
+    def put_ocr_text(self, file_hash: str, recognized_document: RecognizedDocument) -> None:
+        # Время распознавания относится к исходному запуску, а не к тем, кто возьмёт текст из кэша
+        value = recognized_adapter.dump_json(dataclasses.replace(recognized_document, ocr_timing=None))
+        self.ocr_texts.put(ocr_cache_key(file_hash), value)
+
+
+pipeline_cache = PipelineCache(redis_client)
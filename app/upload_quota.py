@@ -0,0 +1,97 @@
+import os
+
+import redis
+import redis.asyncio
+
+from app.config import settings, redis_client, async_redis_client
+
+# Атомарное резервирование: проверка лимита и увеличение счётчика выполняются в Redis одной операцией,
+# поэтому две одновременные загрузки не могут обе пройти проверку
+RESERVE_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local size = tonumber(ARGV[1])
+if used + size > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('INCRBY', KEYS[1], size)
+return 1
+"""
+
+RELEASE_SCRIPT = """
+local used = redis.call('DECRBY', KEYS[1], ARGV[1])
+if used < 0 then
+    redis.call('SET', KEYS[1], 0)
+end
+return used
+"""
+
+
+def get_directory_size(directory: str) -> int:
+    return sum(
+        entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()
+    )
+
+
+class UploadQuota:
+    """
+    Счётчик занятого места в каталоге загрузок, общий для всех процессов API и воркеров.
+
+    Воркеры вызывают синхронные методы; API при скачивании -- reserve_async и release_async,
+    чтобы запросы к Redis не блокировали event loop.
+    """
+
+    def __init__(self, client: redis.Redis, async_client: redis.asyncio.Redis, key: str, limit_bytes: int):
+        self.client = client
+        self.key = key
+        self.limit_bytes = limit_bytes
+        self._reserve = client.register_script(RESERVE_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+        self._reserve_async = async_client.register_script(RESERVE_SCRIPT)
+        self._release_async = async_client.register_script(RELEASE_SCRIPT)
+
+    def reserve(self, size: int) -> bool:
+        if size <= 0:
+            return True
+        return bool(self._reserve(keys=[self.key], args=[size, self.limit_bytes]))
+
+    def release(self, size: int) -> None:
+        if size > 0:
+            self._release(keys=[self.key], args=[size])
+
+    async def reserve_async(self, size: int) -> bool:
+        if size <= 0:
+            return True
+        return bool(await self._reserve_async(keys=[self.key], args=[size, self.limit_bytes]))
+
+    async def release_async(self, size: int) -> None:
+        if size > 0:
+            await self._release_async(keys=[self.key], args=[size])
+
+    def remove_file(self, file_path: str) -> None:
+        """Удаляет файл из каталога загрузок и возвращает занятое им место."""
+        if os.path.exists(file_path):
+            file_size = os.path.getsize(file_path)
+            os.remove(file_path)
+            self.release(file_size)
+
+    def used(self) -> int:
+        return int(self.client.get(self.key) or 0)
+
+    def reconcile(self, directory: str) -> int:
+        """Приводит счётчик к фактическому размеру каталога, исправляя накопившееся расхождение."""
+        lock_key = f"{self.key}:reconcile_lock"
+        # Несколько процессов uvicorn стартуют одновременно: сверку выполняет только один из них
+        if not self.client.set(lock_key, os.getpid(), nx=True, ex=60):
+            return self.used()
+
+        actual_size = get_directory_size(directory)
+        self.client.set(self.key, actual_size)
+        return actual_size
+
+
+upload_quota = UploadQuota(
+    redis_client,
+    async_redis_client,
+    settings.UPLOAD_QUOTA_KEY,
+    settings.MAX_DIR_SIZE_GB * 1024 * 1024 * 1024
+)
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+# Тяжёлые библиотеки пайплайна, которые не должны загружаться в процессе API
+HEAVY_MODULES = ("torch", "spacy", "sentence_transformers", "sklearn", "fitz", "pytesseract", "pymorphy3")
+
+# Выполняется в отдельном процессе: каждое измерение начинается с холодного интерпретатора
+CHILD_CODE = """
+import importlib, json, sys, time
+started_at = time.perf_counter()
+for module_name in sys.argv[1].split(","):
+    importlib.import_module(module_name)
+import_seconds = time.perf_counter() - started_at
+with open("/proc/self/status") as f:
+    status = dict(line.split(":", 1) for line in f)
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "rss_mb": int(status["VmRSS"].split()[0]) / 1024,
+    "loaded_heavy_modules": [name for name in sys.argv[2].split(",") if name in sys.modules],
+}))
+"""
+
+# Вторая группа повторяет то, что раньше загружал API: приложение вместе со стеком пайплайна
+DEFAULT_TARGETS = ["app.main", "app.main,pipeline_module.pipeline"]
+
+
+def measure(target: str) -> dict:
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE, target, ",".join(HEAVY_MODULES)],
+        cwd=project_dir, capture_output=True, text=True, check=True
+    ).stdout
+    # Модули приложения печатают свои сообщения при импорте: результат -- последняя строка
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(targets: list[str], repeats: int) -> list[dict]:
+    results = []
+    print(f"{'модули':<40} {'импорт, с':>10} {'RSS, МБ':>9}  тяжёлые модули")
+    for target in targets:
+        runs = [measure(target) for _ in range(repeats)]
+        result = {
+            "target": target,
+            "import_seconds": round(median(run["import_seconds"] for run in runs), 3),
+            "rss_mb": round(median(run["rss_mb"] for run in runs), 1),
+            "loaded_heavy_modules": runs[0]["loaded_heavy_modules"],
+            "runs": runs,
+        }
+        results.append(result)
+        print(f"{target:<40} {result['import_seconds']:>10.3f} {result['rss_mb']:>9.1f}  "
+              f"{', '.join(result['loaded_heavy_modules']) or '-'}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время импорта и RSS процесса API (app.main) на холодном старте")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS,
+                        help="Модули для импорта; несколько модулей одного замера перечисляются через запятую")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="JSON-файл с результатами")
+    args = parser.parse_args()
+
+    results = run(args.targets, args.repeats)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,63 @@
+import argparse
+import json
+from collections import defaultdict
+from statistics import median
+
+
+def load_cases(path: str) -> dict:
+    """Медианы по повторам для каждой пары (вариант, число страниц)."""
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+
+    grouped = defaultdict(list)
+    for case in report["results"]:
+        # Упавшие прогоны не участвуют в сравнении
+        if "error" in case:
+            continue
+        grouped[(case["variant"], case["pages"])].append(case)
+
+    cases = {}
+    for key, runs in grouped.items():
+        stages = {
+            stage: median(run["stages"][stage]["wall_seconds"] for run in runs)
+            for stage in runs[0]["stages"]
+        }
+        cases[key] = {
+            "end_to_end_seconds": median(run["end_to_end_seconds"] for run in runs),
+            "peak_rss_mb": median(run["peak_rss_mb"] for run in runs),
+            "stages": stages,
+        }
+    return cases
+
+
+def ratio(baseline: float, candidate: float) -> str:
+    if baseline == 0:
+        return "   -"
+    return f"{candidate / baseline:>6.2f}x"
+
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    baseline = load_cases(baseline_path)
+    candidate = load_cases(candidate_path)
+
+    print(f"{'вариант':>8} {'страниц':>8} {'метрика':>20} {'было':>10} {'стало':>10} {'отношение':>10}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        variant, pages = key
+        rows = [("всего, с", baseline[key]["end_to_end_seconds"], candidate[key]["end_to_end_seconds"])]
+        rows += [
+            (f"{stage}, с", baseline[key]["stages"][stage], candidate[key]["stages"][stage])
+            for stage in baseline[key]["stages"] if stage in candidate[key]["stages"]
+        ]
+        rows.append(("пик RSS, МБ", baseline[key]["peak_rss_mb"], candidate[key]["peak_rss_mb"]))
+
+        for name, before, after in rows:
+            print(f"{variant:>8} {pages:>8} {name:>20} {before:>10.3f} {after:>10.3f} {ratio(before, after):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение двух JSON-отчётов pipeline_benchmark")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    compare(args.baseline, args.candidate)
@@ -0,0 +1,52 @@
+import argparse
+import resource
+import time
+import tracemalloc
+
+import spacy
+
+from benchmarks.synthetic import SAMPLE_PHRASES, generate_pages
+from pipeline_module.declination import TextDeclinationObj
+
+
+def peak_rss_mb() -> float:
+    # На Linux ru_maxrss возвращается в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(spacy_model_name: str, page_counts: list[int], phrase_repeats: int) -> None:
+    nlp = spacy.load(spacy_model_name)
+    nlp.max_length = 10_000_000
+    phrases = SAMPLE_PHRASES * phrase_repeats
+
+    print(f"{'страниц':>8} {'токенов':>9} {'индекс, с':>10} {'склонение, с':>13} "
+          f"{'пик Python, МБ':>15} {'пик RSS, МБ':>12}")
+    for page_count in page_counts:
+        doc = nlp("\n\n".join(generate_pages(page_count)))
+
+        # tracemalloc считает только память, выделенную на стороне Python: ровно то, что занимают
+        # объекты токенов декларатора, без самого Doc
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        declination_obj = TextDeclinationObj(doc)
+        index_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        declination_obj.decline_phrase_list(phrases, preserve_case=True)
+        declination_obj.decline_phrase_list(phrases, preserve_case=False)
+        decline_seconds = time.perf_counter() - started_at
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{page_count:>8} {len(doc):>9} {index_seconds:>10.3f} {decline_seconds:>13.3f} "
+              f"{python_peak / 1024 / 1024:>15.2f} {peak_rss_mb():>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время и память склонения фраз в зависимости от размера документа")
+    parser.add_argument("--spacy-model", default="ru_core_news_md")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--phrase-repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    run(args.spacy_model, args.pages, args.phrase_repeats)
@@ -0,0 +1,141 @@
+import os
+
+# Бенчмарк работает без сети: модель берётся только из локального кэша
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+from statistics import median
+
+import numpy as np
+
+from benchmarks.synthetic import SAMPLE_PHRASES, SENTENCE_TEMPLATES, generate_page
+from pipeline_module.keybert_wrapper import CustomKeyBertForArchive
+
+# Режимы эмбеддинга документа: имя -> (doc_embedding_mode, doc_max_chunks)
+MODES = {
+    "full": ("full", 0),
+    "chunks": ("chunks", 0),
+    "chunks_64": ("chunks", 64),
+    "chunks_16": ("chunks", 16),
+}
+# Эталон релевантности -- среднее по всем фрагментам документа
+REFERENCE_MODE = "chunks"
+TOP_K = 5
+
+
+def generate_sectioned_pages(page_count: int, seed: int) -> tuple[list[str], list[int]]:
+    """
+    Страницы документа, разбитого на разделы по темам: каждый раздел собран из одного шаблона предложений.
+
+    В режиме "full" модель видит только начало первого раздела, поэтому разделы дальше по тексту
+    показывают, насколько вектор документа отражает весь текст.
+    """
+    rng = random.Random(seed)
+    section_size = max(page_count // len(SENTENCE_TEMPLATES), 1)
+    topics = [min(page_idx // section_size, len(SENTENCE_TEMPLATES) - 1) for page_idx in range(page_count)]
+    pages = [generate_page(rng, templates=[SENTENCE_TEMPLATES[topic]]) for topic in topics]
+    return pages, topics
+
+
+def set_mode(extractor: CustomKeyBertForArchive, mode: str) -> None:
+    extractor.doc_embedding_mode, extractor.doc_max_chunks = MODES[mode]
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a @ b.T) / (np.linalg.norm(a, axis=-1, keepdims=True) * np.linalg.norm(b, axis=-1))
+
+
+def top_phrases(doc_embedding: np.ndarray, phrase_embeddings: np.ndarray) -> list[str]:
+    similarity = cosine(doc_embedding[None, :], phrase_embeddings)[0]
+    return [SAMPLE_PHRASES[idx] for idx in np.argsort(-similarity)[:TOP_K]]
+
+
+def run(args) -> dict:
+    extractor = CustomKeyBertForArchive(args.bert_model, encode_batch_size=args.encode_batch_size,
+                                        normalize_embeddings=True)
+    phrase_embeddings = extractor.encode(SAMPLE_PHRASES)
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "bert_model": args.bert_model,
+            "max_seq_length": extractor.model.max_seq_length,
+            "encode_batch_size": args.encode_batch_size,
+        },
+        "results": [],
+    }
+
+    print(f"{'режим':>10} {'страниц':>8} {'фрагментов':>11} {'время, с':>9} {'сходство со стр.':>17} "
+          f"{'мин. по темам':>14} {f'топ-{TOP_K} как у эталона':>20}")
+    for page_count in args.pages:
+        pages, topics = generate_sectioned_pages(page_count, args.seed)
+        text = "".join(f"\n\n{page}" for page in pages)
+
+        # Векторы страниц и тем считаются по всем фрагментам: по ним оценивается, что попало в вектор документа
+        set_mode(extractor, REFERENCE_MODE)
+        page_embeddings = extractor.embed_documents(pages)
+        topic_embeddings = np.vstack([
+            page_embeddings[[idx for idx, page_topic in enumerate(topics) if page_topic == topic]].mean(axis=0)
+            for topic in sorted(set(topics))
+        ])
+        reference_top = top_phrases(extractor.embed_documents([text])[0], phrase_embeddings)
+
+        for mode in args.modes:
+            set_mode(extractor, mode)
+            durations = []
+            for _ in range(args.repeats):
+                started_at = time.perf_counter()
+                doc_embedding = extractor.embed_documents([text])[0]
+                durations.append(time.perf_counter() - started_at)
+
+            chunk_count = len(extractor.split_into_chunks(text)[0]) if MODES[mode][0] == "chunks" else 1
+            page_similarity = cosine(doc_embedding[None, :], page_embeddings)[0]
+            topic_similarity = cosine(doc_embedding[None, :], topic_embeddings)[0]
+            mode_top = top_phrases(doc_embedding, phrase_embeddings)
+            case = {
+                "mode": mode,
+                "pages": page_count,
+                "text_chars": len(text),
+                "chunks": chunk_count,
+                "seconds": round(median(durations), 4),
+                "page_similarity_mean": round(float(page_similarity.mean()), 4),
+                "page_similarity_min": round(float(page_similarity.min()), 4),
+                "topic_similarity_min": round(float(topic_similarity.min()), 4),
+                "top_overlap_with_reference": len(set(mode_top) & set(reference_top)) / TOP_K,
+                "top_phrases": mode_top,
+            }
+            report["results"].append(case)
+            print(f"{mode:>10} {page_count:>8} {chunk_count:>11} {case['seconds']:>9.3f} "
+                  f"{case['page_similarity_mean']:>17.3f} {case['topic_similarity_min']:>14.3f} "
+                  f"{case['top_overlap_with_reference']:>20.2f}")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Время и релевантность вектора документа: начало текста против усреднения по фрагментам"
+    )
+    parser.add_argument("--bert-model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--encode-batch-size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON-файл с результатами (по умолчанию benchmarks/results/<время>.json)")
+    args = parser.parse_args()
+
+    report = run(args)
+
+    output_path = args.output or os.path.join(
+        os.path.dirname(__file__), "results", f"doc_embedding_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output_path}")
@@ -0,0 +1,191 @@
+import os
+
+# Бенчмарк работает без сети: модели берутся только из локального кэша
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import fitz
+
+from benchmarks.synthetic import generate_pages, write_image_pdf, write_text_pdf
+from pipeline_module.ocr import available_cpu_count
+from pipeline_module.pipeline import TextProcessingPipeline
+
+VARIANTS = {
+    "text": write_text_pdf,  # Текстовый слой на каждой странице
+    "image": write_image_pdf,  # Только изображения: весь документ идёт через OCR
+}
+
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+class PeakRssSampler:
+    """Фоновый замер RSS: ru_maxrss только растёт за всю жизнь процесса и не показывает пик отдельного прогона."""
+
+    def __init__(self, interval_seconds: float = 0.05):
+        self.interval_seconds = interval_seconds
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval_seconds)
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(pipeline: TextProcessingPipeline, pdf_path: str) -> dict:
+    rss_before_mb = current_rss_mb()
+    with PeakRssSampler() as sampler:
+        started_at = time.perf_counter()
+        with fitz.open(pdf_path) as doc:
+            result = pipeline.process_text(doc)
+        end_to_end_seconds = time.perf_counter() - started_at
+
+    timing = result.timing
+    return {
+        "end_to_end_seconds": round(end_to_end_seconds, 4),
+        "stages": {
+            stage: {"wall_seconds": stage_timing.wall_seconds, "cpu_seconds": stage_timing.cpu_seconds}
+            for stage, stage_timing in timing.stages.items()
+        },
+        "ocr_pages_per_second": timing.ocr_pages_per_second,
+        "text_layer_pages": result.text_layer_pages,
+        "ocr_pages": result.ocr_pages,
+        "candidates_per_pattern": timing.candidates_per_pattern,
+        "encode_batches": len(timing.encode_batch_sizes),
+        "rss_before_mb": round(rss_before_mb, 1),
+        "peak_rss_mb": round(sampler.peak_mb, 1),
+    }
+
+
+def save_report(report: dict, output_path: str) -> None:
+    # Пишется после каждого прогона: падение или прерывание на большом документе не теряет уже готовые результаты
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, output_path)
+
+
+def run(args, output_path: str) -> dict:
+    load_started_at = time.perf_counter()
+    pipeline = TextProcessingPipeline(
+        args.spacy_model,
+        args.bert_model,
+        ocr_workers=args.ocr_workers,
+        ocr_backend=args.ocr_backend,
+        normalize_embeddings=True,
+        spacy_max_length=args.spacy_max_length
+    )
+    pipeline.warm_up()
+    load_seconds = time.perf_counter() - load_started_at
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": available_cpu_count(),
+            "spacy_model": args.spacy_model,
+            "bert_model": args.bert_model,
+            "ocr_backend": args.ocr_backend,
+            "ocr_workers": args.ocr_workers,
+            "image_dpi": args.image_dpi,
+            "spacy_max_length": args.spacy_max_length,
+            "model_load_seconds": round(load_seconds, 3),
+        },
+        "results": [],
+    }
+
+    print(f"{'вариант':>8} {'страниц':>8} {'прогон':>7} {'всего, с':>10} {'OCR, с':>9} {'spaCy, с':>9} "
+          f"{'BERT, с':>9} {'склонение, с':>13} {'пик RSS, МБ':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for variant in args.variants:
+            for page_count in args.pages:
+                pdf_path = os.path.join(tmp_dir, f"{variant}_{page_count}.pdf")
+                VARIANTS[variant](pdf_path, generate_pages(page_count, seed=args.seed), **(
+                    {"dpi": args.image_dpi} if variant == "image" else {}
+                ))
+
+                for repeat in range(args.repeats):
+                    case = {
+                        "variant": variant,
+                        "pages": page_count,
+                        "repeat": repeat,
+                        "file_size_bytes": os.path.getsize(pdf_path),
+                    }
+                    try:
+                        case.update(run_case(pipeline, pdf_path))
+                    except Exception as e:
+                        # Ошибка одного прогона записывается в отчёт, остальные прогоны продолжаются
+                        case["error"] = f"{type(e).__name__}: {e}"
+                    report["results"].append(case)
+                    save_report(report, output_path)
+
+                    if "error" in case:
+                        print(f"{variant:>8} {page_count:>8} {repeat:>7}  ошибка: {case['error']}")
+                        continue
+                    stages = case["stages"]
+                    print(f"{variant:>8} {page_count:>8} {repeat:>7} {case['end_to_end_seconds']:>10.3f} "
+                          f"{stages['ocr']['wall_seconds']:>9.3f} {stages['spacy']['wall_seconds']:>9.3f} "
+                          f"{stages['bert']['wall_seconds']:>9.3f} {stages['declination']['wall_seconds']:>13.3f} "
+                          f"{case['peak_rss_mb']:>12.1f}")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Время этапов пайплайна и пиковая память на синтетических PDF (текстовый слой и скан)"
+    )
+    parser.add_argument("--spacy-model", default="ru_core_news_md")
+    parser.add_argument("--bert-model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--image-dpi", type=int, default=200)
+    parser.add_argument("--ocr-backend", default="pytesseract")
+    parser.add_argument("--ocr-workers", type=int, default=1)
+    # 500 синтетических страниц -- около 1,6 млн символов, больше ограничения spaCy в воркере
+    parser.add_argument("--spacy-max-length", type=int, default=2_000_000)
+    parser.add_argument("--output", help="JSON-файл с результатами (по умолчанию benchmarks/results/<время>.json)")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(
+        os.path.dirname(__file__), "results", f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    run(args, output_path)
+    print(f"\nРезультаты сохранены в {output_path}")
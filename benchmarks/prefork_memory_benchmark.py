@@ -0,0 +1,115 @@
+import argparse
+import gc
+import multiprocessing
+import os
+
+import torch
+
+from benchmarks.synthetic import generate_pages
+from pipeline_module.interfaces import RecognizedDocument
+from pipeline_module.ocr import available_cpu_count
+from pipeline_module.pipeline import TextProcessingPipeline
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_memory_mb() -> dict:
+    """RSS, PSS и USS текущего процесса из /proc/self/smaps_rollup (Linux)."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in SMAPS_FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+        "shared": values["Shared_Clean"] + values["Shared_Dirty"],
+    }
+
+
+def load_pipeline(spacy_model_name: str, bert_model_name: str) -> TextProcessingPipeline:
+    pipeline = TextProcessingPipeline(spacy_model_name, bert_model_name, normalize_embeddings=True)
+    pipeline.warm_up()
+    return pipeline
+
+
+def child_main(pipeline, model_names, text, torch_threads, barrier, results) -> None:
+    torch.set_num_threads(torch_threads)
+    if pipeline is None:
+        pipeline = load_pipeline(*model_names)
+
+    pipeline.process_recognized_text(RecognizedDocument(text))
+    # Замер после того, как все процессы обработали документ: PSS делит общие страницы между живыми процессами
+    barrier.wait()
+    results.put(read_memory_mb())
+    barrier.wait()
+
+
+def run_children(pipeline, model_names, text: str, children: int) -> list[dict]:
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(children)
+    results = context.Queue()
+    torch_threads = max(1, available_cpu_count() // children)
+
+    processes = [
+        context.Process(target=child_main, args=(pipeline, model_names, text, torch_threads, barrier, results))
+        for _ in range(children)
+    ]
+    for process in processes:
+        process.start()
+    memory = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return memory
+
+
+def average(memory: list[dict], field: str) -> float:
+    return sum(item[field] for item in memory) / len(memory)
+
+
+def print_row(mode: str, memory: list[dict]) -> None:
+    print(f"{mode:<22} {average(memory, 'rss'):>12.1f} {average(memory, 'pss'):>12.1f} "
+          f"{average(memory, 'uss'):>12.1f} {average(memory, 'shared'):>13.1f} "
+          f"{sum(item['pss'] for item in memory):>14.1f}")
+
+
+def run(spacy_model_name: str, bert_model_name: str, children: int, page_count: int, gc_freeze: bool) -> None:
+    model_names = (spacy_model_name, bert_model_name)
+    text = "\n\n".join(generate_pages(page_count))
+
+    print(f"{'режим':<22} {'RSS, МБ':>12} {'PSS, МБ':>12} {'USS, МБ':>12} {'общие, МБ':>13} "
+          f"{'сумма PSS, МБ':>14}")
+
+    # Каждый процесс загружает свои модели: так работает prefork без предзагрузки
+    per_child_memory = run_children(None, model_names, text, children)
+    print_row("загрузка в процессе", per_child_memory)
+
+    # Модели загружены до fork, как при WORKER_PRELOAD_MODELS
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    torch.set_num_threads(1)
+    pipeline = load_pipeline(*model_names)
+    if gc_freeze:
+        gc.freeze()
+    parent_memory = read_memory_mb()
+    preload_memory = run_children(pipeline, model_names, text, children)
+    print_row("предзагрузка до fork", preload_memory)
+
+    saved_per_child = average(per_child_memory, "uss") - average(preload_memory, "uss")
+    print(f"\nРодитель с моделями: RSS {parent_memory['rss']:.1f} МБ")
+    print(f"Экономия на дочерний процесс (USS): {saved_per_child:.1f} МБ, "
+          f"на {children} процессов: {saved_per_child * children:.1f} МБ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память дочерних процессов prefork с предзагрузкой моделей и без неё")
+    parser.add_argument("--spacy-model", default="ru_core_news_md")
+    parser.add_argument("--bert-model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--children", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--no-gc-freeze", action="store_true", help="Не вызывать gc.freeze() перед fork")
+    args = parser.parse_args()
+
+    run(args.spacy_model, args.bert_model, args.children, args.pages, not args.no_gc_freeze)
@@ -0,0 +1,139 @@
+import os
+
+# Бенчмарк работает без сети: модели берутся только из локального кэша
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import dataclasses
+import json
+import time
+from datetime import datetime, timezone
+from statistics import median
+
+import fitz
+
+from benchmarks.synthetic import generate_pages
+from pipeline_module.interfaces import InputPipelineData, OutputPipelineData, RecognizedDocument
+from pipeline_module.ocr import RussianPDFOCR
+from pipeline_module.pipeline import TextProcessingPipeline
+
+
+def with_max_candidates(config: InputPipelineData, max_candidates: int | None) -> InputPipelineData:
+    return dataclasses.replace(config, phrases_config=[
+        dataclasses.replace(pattern_config, max_candidates=max_candidates) for pattern_config in config.phrases_config
+    ])
+
+
+def load_documents(args) -> dict[str, RecognizedDocument]:
+    documents = {}
+    for pdf_path in args.pdf:
+        with fitz.open(pdf_path) as doc:
+            documents[os.path.basename(pdf_path)] = RecognizedDocument(
+                text=RussianPDFOCR.join_pages([page.get_text("text") for page in doc])
+            )
+    for page_count in args.pages:
+        pages = generate_pages(page_count, seed=args.seed)
+        documents[f"synthetic_{page_count}"] = RecognizedDocument(text=RussianPDFOCR.join_pages(pages))
+    return documents
+
+
+def key_phrases_by_pattern(result: OutputPipelineData) -> dict[str, list[str]]:
+    return {item.pattern_config.code: item.key_phrases for item in result.key_phrases_obj}
+
+
+def overlap(phrases: list[str], reference: list[str]) -> float:
+    """Доля ключевых фраз эталона (без ограничения кандидатов), которые остались в результате."""
+    if not reference:
+        return 1.0
+    return len(set(phrases) & set(reference)) / len(reference)
+
+
+def run_case(pipeline: TextProcessingPipeline, document: RecognizedDocument, config: InputPipelineData,
+             repeats: int) -> tuple[OutputPipelineData, dict]:
+    durations = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        result = pipeline.process_recognized_text(document, config)
+        durations.append(time.perf_counter() - started_at)
+
+    timing = result.timing
+    return result, {
+        "seconds": round(median(durations), 4),
+        "bert_seconds": timing.stages["bert"].wall_seconds,
+        "prerank_seconds": timing.stages["prerank"].wall_seconds,
+        # Текст документа и кандидаты, которые действительно ушли в модель эмбеддингов
+        "encoded_texts": sum(timing.encode_batch_sizes),
+        "candidates_per_pattern": timing.candidates_per_pattern,
+    }
+
+
+def run(args) -> dict:
+    pipeline = TextProcessingPipeline(args.spacy_model, args.bert_model, normalize_embeddings=True)
+    pipeline.warm_up()
+    base_config = pipeline.get_default_config()
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "spacy_model": args.spacy_model,
+            "bert_model": args.bert_model,
+            "patterns": [pattern_config.code for pattern_config in base_config.phrases_config],
+        },
+        "results": [],
+    }
+
+    print(f"{'документ':>16} {'K':>6} {'всего, с':>9} {'BERT, с':>8} {'закодировано':>13} "
+          f"{'пересечение с эталоном':>23}")
+    for name, document in load_documents(args).items():
+        reference_result, reference_case = run_case(pipeline, document, base_config, args.repeats)
+        reference_phrases = key_phrases_by_pattern(reference_result)
+
+        for max_candidates in [None, *args.max_candidates]:
+            if max_candidates is None:
+                case = reference_case
+                phrases = reference_phrases
+            else:
+                result, case = run_case(pipeline, document, with_max_candidates(base_config, max_candidates), args.repeats)
+                phrases = key_phrases_by_pattern(result)
+
+            overlap_per_pattern = {
+                code: round(overlap(phrases.get(code, []), reference), 3) for code, reference in reference_phrases.items()
+            }
+            case = {
+                "document": name,
+                "max_candidates": max_candidates,
+                **case,
+                "overlap_per_pattern": overlap_per_pattern,
+                "overlap_mean": round(sum(overlap_per_pattern.values()) / max(len(overlap_per_pattern), 1), 3),
+            }
+            report["results"].append(case)
+            print(f"{name:>16} {str(max_candidates or '-'):>6} {case['seconds']:>9.3f} {case['bert_seconds']:>8.3f} "
+                  f"{case['encoded_texts']:>13} {case['overlap_mean']:>23.3f}")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Влияние ограничения кандидатов (PatternConfig.max_candidates) на время и ключевые фразы"
+    )
+    parser.add_argument("--spacy-model", default="ru_core_news_md")
+    parser.add_argument("--bert-model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--max-candidates", type=int, nargs="+", default=[50, 100, 200, 500])
+    parser.add_argument("--pages", type=int, nargs="*", default=[10, 100])
+    parser.add_argument("--pdf", nargs="*", default=[], help="PDF с текстовым слоем в дополнение к синтетическим документам (--pages без значений -- только PDF)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON-файл с результатами (по умолчанию benchmarks/results/<время>.json)")
+    args = parser.parse_args()
+
+    report = run(args)
+
+    output_path = args.output or os.path.join(
+        os.path.dirname(__file__), "results", f"prerank_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output_path}")
@@ -0,0 +1,88 @@
+import random
+from typing import List, Sequence
+
+import fitz
+
+# Страница A4 в пунктах и поля текста
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+PAGE_MARGINS = (50, 50, -50, -50)
+
+# Шаблоны предложений в стиле архивных документов; из них собираются воспроизводимые страницы текста
+SENTENCE_TEMPLATES = [
+    "Государственный архив {region} принял на хранение документы {organization} за {year} год.",
+    "Согласно приказу министерства {number} от {day} {month} {year} года комиссия провела проверку наличия дел.",
+    "В описи указаны личные дела сотрудников, протоколы заседаний учёного совета и переписка с {organization}.",
+    "Передача документов постоянного хранения в {region} осуществляется по акту приёма-передачи.",
+    "Экспертная комиссия рассмотрела вопрос о выделении к уничтожению документов с истёкшими сроками хранения.",
+    "Начальник отдела комплектования {name} подписал акт о неисправимых повреждениях документов.",
+    "Фонд {organization} включает распорядительные документы, годовые отчёты и финансовую документацию.",
+    "Научно-справочный аппарат архива дополнен новыми описями и тематическими каталогами.",
+]
+
+REGIONS = ["Московской области", "Санкт-Петербурга", "Республики Татарстан", "Свердловской области",
+           "Новосибирской области", "Краснодарского края"]
+ORGANIZATIONS = ["Министерства культуры", "городского управления образования", "районной администрации",
+                 "научно-исследовательского института", "областного суда", "железнодорожного управления"]
+NAMES = ["Иванов И. И.", "Петрова А. С.", "Сидоров П. В.", "Кузнецова Е. Н."]
+MONTHS = ["января", "февраля", "марта", "апреля", "мая", "июня", "июля", "августа", "сентября", "октября",
+          "ноября", "декабря"]
+
+# Фразы, которые встречаются в сгенерированном тексте и склоняются так же, как ключевые фразы пайплайна
+SAMPLE_PHRASES = [
+    "государственный архив", "документов постоянного хранения", "учёного совета", "личные дела сотрудников",
+    "экспертная комиссия", "годовые отчёты", "финансовую документацию", "научно-справочный аппарат",
+    "Министерства культуры", "районной администрации", "областного суда", "Московской области",
+]
+
+
+def generate_page(rng: random.Random, sentences_per_page: int = 30,
+                  templates: Sequence[str] = SENTENCE_TEMPLATES) -> str:
+    sentences = []
+    for _ in range(sentences_per_page):
+        template = rng.choice(templates)
+        sentences.append(template.format(
+            region=rng.choice(REGIONS),
+            organization=rng.choice(ORGANIZATIONS),
+            name=rng.choice(NAMES),
+            number=rng.randint(1, 999),
+            day=rng.randint(1, 28),
+            month=rng.choice(MONTHS),
+            year=rng.randint(1920, 2020),
+        ))
+    return " ".join(sentences)
+
+
+def generate_pages(page_count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [generate_page(rng) for _ in range(page_count)]
+
+
+def write_text_pdf(path: str, pages_text: List[str], font_name: str = "tiro", font_size: float = 10) -> None:
+    """PDF с текстовым слоем: по одной странице A4 на элемент pages_text."""
+    # Встроенные шрифты MuPDF содержат кириллицу, поэтому внешние файлы шрифтов не нужны
+    font = fitz.Font(font_name)
+    with fitz.open() as doc:
+        for page_text in pages_text:
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            writer = fitz.TextWriter(page.rect)
+            writer.fill_textbox(page.rect + PAGE_MARGINS, page_text, font=font, fontsize=font_size)
+            writer.write_text(page)
+        doc.save(path, garbage=3, deflate=True)
+
+
+def write_image_pdf(path: str, pages_text: List[str], dpi: int = 200, font_name: str = "tiro",
+                    font_size: float = 10) -> None:
+    """PDF без текстового слоя: каждая страница -- растровое изображение, как у отсканированного документа."""
+    font = fitz.Font(font_name)
+    with fitz.open() as doc:
+        for page_text in pages_text:
+            with fitz.open() as text_doc:
+                text_page = text_doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+                writer = fitz.TextWriter(text_page.rect)
+                writer.fill_textbox(text_page.rect + PAGE_MARGINS, page_text, font=font, fontsize=font_size)
+                writer.write_text(text_page)
+                pixmap = text_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            page.insert_image(page.rect, pixmap=pixmap)
+        doc.save(path, garbage=3, deflate=True)
@@ -1,10 +1,110 @@
-from typing import List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 
+import numpy as np
 from pymorphy3 import MorphAnalyzer
-from spacy.tokens import Doc
+from spacy.attrs import ORTH
+from spacy.tokens import Doc, Token
 
 from pipeline_module.interfaces import TokenInfo, POS_MAPPING
 
+# Границы кэшей pymorphy: словарь архивных документов ограничен, а память процесса воркера -- нет
+PARSE_CACHE_SIZE = 50000
+INFLECT_CACHE_SIZE = 50000
+
+
+@lru_cache(maxsize=1)
+def get_morph_analyzer() -> MorphAnalyzer:
+    """Один MorphAnalyzer на процесс: загрузка словарей занимает заметное время и память."""
+    return MorphAnalyzer()
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_word(input_word: str) -> tuple:
+    return tuple(get_morph_analyzer().parse(input_word))
+
+
+@lru_cache(maxsize=INFLECT_CACHE_SIZE)
+def inflect_word_to_nominative(input_word: str, input_pos: str, input_gender: Optional[str] = None,
+                               input_number: Optional[str] = None) -> str:
+    parsed_info = parse_word(input_word)
+    if not parsed_info:
+        return input_word
+
+    def is_suitable(variant):
+        mapped_pos = POS_MAPPING.get(input_pos)
+        if mapped_pos is None:
+            return False
+        if variant.tag.POS != mapped_pos:
+            return False
+        if input_gender and 'GNdr' not in variant.tag:
+            if input_gender == "masc" and 'masc' not in variant.tag:
+                return False
+            if input_gender == "fem" and 'femn' not in variant.tag:
+                return False
+            if input_gender == "neut" and 'neut' not in variant.tag:
+                return False
+        if input_number:
+            if input_number == "sing" and 'sing' not in variant.tag:
+                return False
+            if input_number == "plur" and 'plur' not in variant.tag:
+                return False
+        return True
+
+    best_match = next((p for p in parsed_info if is_suitable(p)), None)
+    if best_match is None and len(parsed_info) == 1:
+        best_match = parsed_info[0]
+
+    if best_match:
+        inflected_word = best_match.inflect({'nomn'})
+        if inflected_word:
+            return inflected_word.word
+
+    return input_word
+
+
+def build_token_info(token: Token) -> TokenInfo:
+    gender_list = token.morph.get("Gender")
+    number_list = token.morph.get("Number")
+
+    return TokenInfo(
+        word=token.text,
+        pos=token.pos_,
+        start_char=token.idx,
+        end_char=token.idx + len(token),
+        number=number_list[0].lower() if number_list else None,
+        gender=gender_list[0].lower() if gender_list else None
+    )
+
+
+class DocTokenIndex:
+    """
+    Ленивое представление токенов spaCy Doc для склонения.
+
+    Хранит только два numpy-массива (хэш слова и позиция его первого вхождения), а TokenInfo создаёт
+    лишь для слов, которые действительно ищутся при склонении.
+    """
+
+    def __init__(self, doc: Doc):
+        self.doc = doc
+        self.orth_hashes, self.first_positions = np.unique(doc.to_array(ORTH), return_index=True)
+        self._materialized: Dict[str, Optional[TokenInfo]] = {}
+
+    def get(self, word: str) -> Optional[TokenInfo]:
+        if word in self._materialized:
+            return self._materialized[word]
+
+        # Для слова, которого нет в StringStore, возвращается его хэш без добавления в словарь
+        word_hash = self.doc.vocab.strings[word]
+        position = int(np.searchsorted(self.orth_hashes, word_hash))
+
+        token_info = None
+        if position < len(self.orth_hashes) and self.orth_hashes[position] == word_hash:
+            token_info = build_token_info(self.doc[int(self.first_positions[position])])
+
+        self._materialized[word] = token_info
+        return token_info
+
 
 class TextDeclinationObj:
     @staticmethod
@@ -26,61 +126,8 @@ class TextDeclinationObj:
         print('-' * 60)
 
     def __init__(self, inner_processed_nlp_text: Doc):
-        self.morph = MorphAnalyzer()
-        self.tokens_info: List[TokenInfo] = []
-
-        for token in inner_processed_nlp_text:
-            gender_list = token.morph.get("Gender")
-            number_list = token.morph.get("Number")
-
-            current_gender = gender_list[0].lower() if gender_list else None
-            current_number = number_list[0].lower() if number_list else None
-
-            self.tokens_info.append(TokenInfo(
-                word=token.text,
-                pos=token.pos_,
-                start_char=token.idx,
-                end_char=token.idx + len(token),
-                number=current_number,
-                gender=current_gender
-            ))
-
-    def __inflect_word_to_nominative(self, input_word: str, input_pos: str, input_gender: Optional[str] = None,
-                                     input_number: Optional[str] = None) -> str:
-        parsed_info = self.morph.parse(input_word)
-        if not parsed_info:
-            return input_word
-
-        def is_suitable(variant):
-            mapped_pos = POS_MAPPING.get(input_pos)
-            if mapped_pos is None:
-                return False
-            if variant.tag.POS != mapped_pos:
-                return False
-            if input_gender and 'GNdr' not in variant.tag:
-                if input_gender == "masc" and 'masc' not in variant.tag:
-                    return False
-                if input_gender == "fem" and 'femn' not in variant.tag:
-                    return False
-                if input_gender == "neut" and 'neut' not in variant.tag:
-                    return False
-            if input_number:
-                if input_number == "sing" and 'sing' not in variant.tag:
-                    return False
-                if input_number == "plur" and 'plur' not in variant.tag:
-                    return False
-            return True
-
-        best_match = next((p for p in parsed_info if is_suitable(p)), None)
-        if best_match is None and len(parsed_info) == 1:
-            best_match = parsed_info[0]
-
-        if best_match:
-            inflected_word = best_match.inflect({'nomn'})
-            if inflected_word:
-                return inflected_word.word
-
-        return input_word
+        # Признаки токенов берутся из Doc по требованию, по первому вхождению слова в документе
+        self.tokens_index = DocTokenIndex(inner_processed_nlp_text)
 
     def __decline_phrase_to_nominative(self, current_phrase: str, preserve_case: bool) -> str:
         """Склоняет слова в фразе в именительный падеж, учитывая предыдущее слово."""
@@ -90,7 +137,7 @@ class TextDeclinationObj:
         phrase_has_adp = False
 
         for word_token in words_in_phrase:
-            matched_token = next((t for t in self.tokens_info if t.word == word_token), None)
+            matched_token = self.tokens_index.get(word_token)
 
             # Если прошлое слово было предлогом или существительным — текущее не склоняем
             if previous_pos in ("PREP", "NOUN", "PROPN", "ADP") or phrase_has_adp:
@@ -98,7 +145,7 @@ class TextDeclinationObj:
             else:
                 if matched_token:
                     phrase_was_declined = True
-                    declined_word = self.__inflect_word_to_nominative(
+                    declined_word = inflect_word_to_nominative(
                         matched_token.word,
                         matched_token.pos,
                         matched_token.gender,
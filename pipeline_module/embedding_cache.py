@@ -0,0 +1,231 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении формата файлов: кэш старого формата создаётся заново
+CACHE_FORMAT_VERSION = 1
+
+# Поля заголовка (массив int64): первые три определяют формат, остальные -- состояние кэша
+HEADER_VERSION, HEADER_DIM, HEADER_CAPACITY, HEADER_COUNT, HEADER_CLOCK_HAND, HEADER_TOMBSTONES = range(6)
+HEADER_SIZE = 6
+
+# Значения ячеек хэш-таблицы; остальные значения -- номер слота + 1
+EMPTY = 0
+TOMBSTONE = -1
+
+
+def normalize_phrase(phrase: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(phrase.split()))
+
+
+def phrase_key(phrase: str) -> int:
+    key = int.from_bytes(hashlib.blake2b(normalize_phrase(phrase).encode("utf-8"), digest_size=8).digest(), "little")
+    # Ноль обозначает пустой слот
+    return key or 1
+
+
+class PhraseEmbeddingCache:
+    """
+    Постоянный кэш эмбеддингов фраз в файлах, отображённых в память.
+
+    Векторы лежат в одном массиве float32 на capacity фраз, индекс -- хэш-таблица с открытой адресацией
+    по 64-битному хэшу нормализованной фразы. Все процессы воркеров на машине открывают одни и те же файлы,
+    поэтому кэш общий и не копируется в память каждого процесса. Запись идёт под файловой блокировкой,
+    чтение -- без блокировки: слот проверяется по ключу до и после копирования вектора. Когда кэш заполнен,
+    слот для новой фразы освобождается алгоритмом CLOCK (приближение LRU).
+    """
+
+    def __init__(self, directory: str, model_name: str, dim: int, capacity: int, normalized: bool):
+        self.dim = dim
+        self.capacity = capacity
+        # Таблица минимум вдвое больше числа слотов, чтобы цепочки поиска оставались короткими
+        self.table_size = 1 << max(2 * capacity - 1, 1).bit_length()
+        self.mask = self.table_size - 1
+
+        # Векторы разных моделей и режимов нормировки несовместимы, а файлы другой ёмкости или формата
+        # нельзя открыть поверх существующих: у каждой комбинации свой каталог
+        model_slug = re.sub(r"[^\w.-]+", "_", model_name).strip("_")[-64:]
+        model_hash = hashlib.sha256(
+            f"{model_name}|{dim}|{normalized}|{capacity}|{CACHE_FORMAT_VERSION}".encode("utf-8")
+        ).hexdigest()[:12]
+        self.path = os.path.join(directory, f"{model_slug}-{model_hash}")
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock_file = None
+        self._lock_pid = None
+        with self._locked():
+            self._open()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        # flock принадлежит открытому файлу, а он после fork общий: каждый процесс открывает файл блокировки сам
+        if self._lock_pid != os.getpid():
+            self._lock_file = open(self._file("lock"), "a")
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        shapes = {
+            "header.i64": (np.int64, (HEADER_SIZE,)),
+            "keys.u64": (np.uint64, (self.capacity,)),
+            "refs.u8": (np.uint8, (self.capacity,)),
+            "table.i32": (np.int32, (self.table_size,)),
+            "vectors.f32": (np.float32, (self.capacity, self.dim)),
+        }
+        expected_header = [CACHE_FORMAT_VERSION, self.dim, self.capacity]
+
+        reuse = all(
+            os.path.exists(self._file(name))
+            and os.path.getsize(self._file(name)) == np.dtype(dtype).itemsize * int(np.prod(shape))
+            for name, (dtype, shape) in shapes.items()
+        )
+        if reuse:
+            header = np.memmap(self._file("header.i64"), dtype=np.int64, mode="r")
+            reuse = header[:3].tolist() == expected_header
+            del header
+
+        if not reuse:
+            logger.info(f"Создаётся кэш эмбеддингов фраз {self.path} на {self.capacity} фраз")
+            self._create(shapes, expected_header)
+
+        arrays = {
+            name: np.memmap(self._file(name), dtype=dtype, mode="r+", shape=shape)
+            for name, (dtype, shape) in shapes.items()
+        }
+        self.header = arrays["header.i64"]
+        self.keys = arrays["keys.u64"]
+        self.refs = arrays["refs.u8"]
+        self.table = arrays["table.i32"]
+        self.vectors = arrays["vectors.f32"]
+
+    def _create(self, shapes: dict, expected_header: list[int]) -> None:
+        # Файлы могут быть отображены в память другими процессами: усечение на месте привело бы к SIGBUS
+        # при обращении к ним. Новые файлы создаются рядом и подменяют старые через os.replace,
+        # а процессы со старым отображением дочитывают прежние файлы
+        for name, (dtype, shape) in shapes.items():
+            tmp_path = f"{self._file(name)}.tmp{os.getpid()}"
+            array = np.memmap(tmp_path, dtype=dtype, mode="w+", shape=shape)
+            if name == "header.i64":
+                array[:3] = expected_header
+            array.flush()
+            del array
+            os.replace(tmp_path, self._file(name))
+
+    def _find(self, key: int) -> int:
+        """Позиция ключа в хэш-таблице или -1."""
+        pos = key & self.mask
+        for _ in range(self.table_size):
+            entry = int(self.table[pos])
+            if entry == EMPTY:
+                return -1
+            if entry != TOMBSTONE and int(self.keys[entry - 1]) == key:
+                return pos
+            pos = (pos + 1) & self.mask
+        return -1
+
+    def get_many(self, phrases: list[str]) -> tuple[np.ndarray, list[int]]:
+        """Эмбеддинги найденных фраз и индексы фраз, которых нет в кэше (их строки в массиве не заполнены)."""
+        embeddings = np.zeros((len(phrases), self.dim), dtype=np.float32)
+        missing = []
+        for idx, phrase in enumerate(phrases):
+            key = phrase_key(phrase)
+            pos = self._find(key)
+            slot = int(self.table[pos]) - 1 if pos >= 0 else -1
+            # Слот мог быть вытеснен другим процессом во время чтения: ключ проверяется до и после копирования
+            if slot >= 0 and int(self.keys[slot]) == key:
+                embeddings[idx] = self.vectors[slot]
+                if int(self.keys[slot]) == key:
+                    self.refs[slot] = 1
+                    continue
+            missing.append(idx)
+        return embeddings, missing
+
+    def put_many(self, phrases: list[str], embeddings: np.ndarray) -> int:
+        """Добавляет фразы в кэш и возвращает число вытесненных фраз."""
+        evicted = 0
+        with self._locked():
+            for phrase, embedding in zip(phrases, embeddings):
+                key = phrase_key(phrase)
+                if self._find(key) >= 0:
+                    continue
+
+                if self.header[HEADER_COUNT] < self.capacity:
+                    slot = int(self.header[HEADER_COUNT])
+                    self.header[HEADER_COUNT] += 1
+                else:
+                    slot = self._evict()
+                    evicted += 1
+
+                # Ключ записывается после вектора: читатель не примет слот, пока вектор не записан полностью
+                self.vectors[slot] = embedding
+                self.keys[slot] = key
+                self.refs[slot] = 1
+                self._insert(key, slot)
+
+            if self.header[HEADER_TOMBSTONES] > self.capacity // 2:
+                self._rebuild_table()
+        return evicted
+
+    def _insert(self, key: int, slot: int) -> None:
+        pos = key & self.mask
+        while self.table[pos] not in (EMPTY, TOMBSTONE):
+            pos = (pos + 1) & self.mask
+        if self.table[pos] == TOMBSTONE:
+            self.header[HEADER_TOMBSTONES] -= 1
+        self.table[pos] = slot + 1
+
+    def _evict(self) -> int:
+        # CLOCK: недавно прочитанные слоты получают второй шанс, вытесняется первый слот без отметки
+        hand = int(self.header[HEADER_CLOCK_HAND])
+        while self.refs[hand]:
+            self.refs[hand] = 0
+            hand = (hand + 1) % self.capacity
+        self.header[HEADER_CLOCK_HAND] = (hand + 1) % self.capacity
+
+        pos = self._find(int(self.keys[hand]))
+        if pos >= 0:
+            self.table[pos] = TOMBSTONE
+            self.header[HEADER_TOMBSTONES] += 1
+        self.keys[hand] = 0
+        return hand
+
+    def _rebuild_table(self) -> None:
+        # Удалённые ячейки удлиняют поиск: таблица перестраивается по ключам занятых слотов
+        self.table[:] = EMPTY
+        self.header[HEADER_TOMBSTONES] = 0
+        for slot in range(int(self.header[HEADER_COUNT])):
+            key = int(self.keys[slot])
+            if key:
+                self._insert(key, slot)
+
+    def stats(self) -> dict:
+        return {"path": self.path, "entries": int(self.header[HEADER_COUNT]), "capacity": self.capacity}
+
+
+def open_phrase_cache(directory: Optional[str], model_name: str, dim: int, capacity: int,
+                      normalized: bool) -> Optional[PhraseEmbeddingCache]:
+    """Кэш эмбеддингов фраз или None, если он отключён или каталог недоступен."""
+    if not directory:
+        return None
+    try:
+        return PhraseEmbeddingCache(directory, model_name, dim, capacity, normalized)
+    except OSError as e:
+        # Без кэша пайплайн работает так же, только кодирует все фразы моделью
+        logger.warning(f"Кэш эмбеддингов фраз отключён: {e}")
+        return None
@@ -1,7 +1,10 @@
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
+
+# Уведомление о ходе обработки: этап и, для постраничных этапов, номер текущей страницы и их общее число
+ProgressCallback = Callable[[str, Optional[int], Optional[int]], None]
 
 
 @dataclass
@@ -12,11 +15,13 @@ class PatternConfig:
     diversity: float = 0.5
     top_n: int = 5
     threshold_filter: float = 0.2
+    max_candidates: Optional[int] = None  # Сколько самых частых кандидатов передавать модели эмбеддингов (None -- всех)
 
 @dataclass
 class FoundPhrases:
     pattern_config: PatternConfig
     found_words: list[str]
+    frequencies: list[int] = field(default_factory=list)  # Частота каждой фразы в документе
 
 @dataclass
 class KeyPhraseData:
@@ -53,16 +58,72 @@ class PatternKeyPhrases:
     pattern_config: PatternConfig
     key_phrases: list[str]
 
+@dataclass
+class StageTiming:
+    wall_seconds: float
+    cpu_seconds: float  # Включая завершившиеся дочерние процессы (tesseract) и задачи постоянного пула OCR
+
+@dataclass
+class PipelineTiming:
+    stages: dict[str, StageTiming] = field(default_factory=dict)
+    ocr_pages_per_second: Optional[float] = None
+    candidates_per_pattern: dict[str, int] = field(default_factory=dict)  # По коду паттерна
+    encode_batch_sizes: list[int] = field(default_factory=list)
+    phrase_cache: dict[str, int] = field(default_factory=dict)  # Попадания, промахи и вытеснения кэша эмбеддингов фраз
+    queue_wait_seconds: Optional[float] = None  # Ожидание задачи NLP в очереди Celery
+
+@dataclass
+class RecognizedDocument:
+    text: str
+    text_layer_pages: int = 0  # Страницы, текст которых взят из текстового слоя PDF
+    ocr_pages: int = 0  # Страницы, распознанные через OCR
+    ocr_timing: Optional[StageTiming] = None
+
 @dataclass
 class OutputPipelineData:
     key_phrases_obj: list[PatternKeyPhrases]
     ner_phrases: list[str]
+    text_layer_pages: int = 0
+    ocr_pages: int = 0
+    timing: Optional[PipelineTiming] = None
 
 class InputApiData(BaseModel):
     file_link: str
     callback_url: str
     config: InputPipelineData
 
+class InputApiBatchItem(BaseModel):
+    file_link: str
+    callback_url: Optional[str] = None  # Если не задан, берётся общий для пакета
+    config: Optional[InputPipelineData] = None  # Если не задана, берётся общая для пакета
+
+class InputApiBatchData(BaseModel):
+    documents: List[InputApiBatchItem]
+    callback_url: Optional[str] = None
+    config: Optional[InputPipelineData] = None
+
+    @model_validator(mode="after")
+    def check_documents(self):
+        if not self.documents:
+            raise ValueError("Пакет не содержит документов")
+        for idx, item in enumerate(self.documents):
+            if (item.callback_url or self.callback_url) is None:
+                raise ValueError(f"Для документа {idx} не задан callback_url")
+            if (item.config or self.config) is None:
+                raise ValueError(f"Для документа {idx} не задана конфигурация")
+        return self
+
+    def to_api_data(self) -> List[InputApiData]:
+        """Запросы отдельных документов с подставленными общими параметрами."""
+        return [
+            InputApiData(
+                file_link=item.file_link,
+                callback_url=item.callback_url or self.callback_url,
+                config=item.config or self.config
+            )
+            for item in self.documents
+        ]
+
 class OutputWorkerData(BaseModel):
     input_data: InputApiData
     output_data: OutputPipelineData
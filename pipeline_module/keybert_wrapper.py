@@ -1,11 +1,39 @@
-from typing import List
+import logging
+import re
+from itertools import islice
+from typing import List, Optional
+
 import numpy as np
 
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 
+from pipeline_module.embedding_cache import open_phrase_cache
 from pipeline_module.interfaces import BertKeyPhrases, FoundPhrases, KeyPhraseData
 
+logger = logging.getLogger(__name__)
+
+DOC_EMBEDDING_MODES = ("full", "chunks")
+
+# Границы фрагментов: конец предложения или граница страниц (страницы документа разделены пустой строкой)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+
+# В режиме "full" модель всё равно обрезает текст по max_seq_length: в токене не бывает больше этого числа
+# непробельных символов, поэтому хвост документа можно не отдавать токенизатору
+MAX_CHARS_PER_TOKEN = 16
+NON_SPACE = re.compile(r"\S")
+
+# Оценки MMR, отличающиеся меньше чем на эту величину, считаются равными: из них выбирается кандидат с меньшим
+# индексом. Без допуска порядок равных кандидатов (например, фраз с одинаковыми эмбеддингами) зависел бы
+# от ошибок округления конкретного способа вычисления сходства
+MMR_TIE_TOLERANCE = 1e-6
+
+
+def argmax_with_ties(scores: np.ndarray) -> int:
+    """Индекс максимума; среди значений в пределах MMR_TIE_TOLERANCE от максимума -- наименьший."""
+    return int(np.flatnonzero(scores >= scores.max() - MMR_TIE_TOLERANCE)[0])
+
 
 class CustomKeyBertForArchive:
     @staticmethod
@@ -24,28 +52,202 @@ class CustomKeyBertForArchive:
 
     def __init__(
             self,
-            bert_model_name: str
+            bert_model_name: str,
+            encode_batch_size: int = 64,
+            normalize_embeddings: bool = False,
+            doc_embedding_mode: str = "full",
+            doc_chunk_tokens: int = 0,
+            doc_max_chunks: int = 0,
+            phrase_cache_dir: Optional[str] = None,
+            phrase_cache_capacity: int = 100000
     ) -> None:
+        """
+        doc_embedding_mode -- "full" (вектор документа по началу текста, которое помещается в max_seq_length модели)
+                              или "chunks" (текст делится на фрагменты по предложениям и страницам, вектор документа --
+                              среднее векторов фрагментов, взвешенное по числу токенов);
+        doc_chunk_tokens -- максимум токенов во фрагменте (0 -- max_seq_length модели);
+        doc_max_chunks -- сколько фрагментов кодировать у длинного документа (0 -- все); фрагменты берутся
+                          равномерно по всему тексту;
+        phrase_cache_dir -- каталог постоянного кэша эмбеддингов фраз, общего для процессов (None -- без кэша);
+        phrase_cache_capacity -- сколько фраз хранит кэш.
+        """
+        if doc_embedding_mode not in DOC_EMBEDDING_MODES:
+            raise ValueError(f"Неизвестный режим эмбеддинга документа '{doc_embedding_mode}', "
+                             f"доступны: {', '.join(DOC_EMBEDDING_MODES)}")
         self.model: SentenceTransformer = SentenceTransformer(bert_model_name)
+        self.encode_batch_size = encode_batch_size
+        # Для нормированных эмбеддингов косинусное сходство равно скалярному произведению
+        self.normalize_embeddings = normalize_embeddings
+        self.doc_embedding_mode = doc_embedding_mode
+        self.doc_chunk_tokens = doc_chunk_tokens
+        self.doc_max_chunks = doc_max_chunks
+        self.phrase_cache = open_phrase_cache(
+            phrase_cache_dir,
+            bert_model_name,
+            self.model.get_sentence_embedding_dimension(),
+            phrase_cache_capacity,
+            normalize_embeddings
+        )
+
+    def encode(self, texts: list[str], encode_batch_sizes: Optional[list[int]] = None) -> np.ndarray:
+        if encode_batch_sizes is not None:
+            encode_batch_sizes.extend(
+                min(self.encode_batch_size, len(texts) - start) for start in range(0, len(texts), self.encode_batch_size)
+            )
+        return self.model.encode(
+            texts,
+            batch_size=self.encode_batch_size,
+            normalize_embeddings=self.normalize_embeddings,
+            convert_to_numpy=True
+        )
+
+    def truncate_to_model_input(self, text: str) -> str:
+        """Начало текста, которое модель увидит в пределах max_seq_length токенов."""
+        # Пробелы и переводы строк токенов не дают (а в тексте после OCR их много), поэтому запас для
+        # токенизатора отсчитывается по непробельным символам
+        max_chars = self.model.max_seq_length * MAX_CHARS_PER_TOKEN
+        last_char = next(islice(NON_SPACE.finditer(text), max_chars - 1, None), None)
+        prefix = text[:last_char.end()] if last_char else text
+
+        tokenizer = self.model.tokenizer
+        if not getattr(tokenizer, "is_fast", False):
+            return prefix
+        # Граница -- конец последнего токена, который поместился в max_seq_length (у служебных токенов смещения нулевые)
+        offsets = tokenizer(
+            prefix, truncation=True, max_length=self.model.max_seq_length, return_offsets_mapping=True
+        )["offset_mapping"]
+        return prefix[:max((end for _, end in offsets), default=len(prefix))]
+
+    def split_into_chunks(self, text: str) -> tuple[list[str], list[int]]:
+        """Фрагменты текста не длиннее doc_chunk_tokens токенов и число токенов в каждом."""
+        # Служебные токены [CLS] и [SEP] тоже занимают место в max_seq_length
+        max_tokens = max((self.doc_chunk_tokens or self.model.max_seq_length) - 2, 1)
+        sentences = [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+        if not sentences:
+            return [text], [1]
+        token_counts = [
+            len(input_ids) for input_ids in self.model.tokenizer(sentences, add_special_tokens=False)["input_ids"]
+        ]
+
+        chunks, chunk_tokens = [], []
+        current, current_tokens = [], 0
+        for sentence, token_count in zip(sentences, token_counts):
+            if current and current_tokens + token_count > max_tokens:
+                chunks.append(" ".join(current))
+                chunk_tokens.append(current_tokens)
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += token_count
+        chunks.append(" ".join(current))
+        chunk_tokens.append(current_tokens)
+        # Предложение длиннее лимита модель обрежет сама: в вес идут только токены, которые она увидит
+        chunk_tokens = [min(token_count, max_tokens) for token_count in chunk_tokens]
+
+        if self.doc_max_chunks and len(chunks) > self.doc_max_chunks:
+            sampled = np.unique(np.linspace(0, len(chunks) - 1, self.doc_max_chunks).round().astype(int))
+            chunks = [chunks[idx] for idx in sampled]
+            chunk_tokens = [chunk_tokens[idx] for idx in sampled]
+
+        return chunks, chunk_tokens
+
+    def encode_phrases(self, phrases: list[str], encode_batch_sizes: Optional[list[int]] = None,
+                       cache_counts: Optional[dict[str, int]] = None) -> np.ndarray:
+        """Эмбеддинги фраз: в модель отправляются только фразы, которых нет в кэше."""
+        if self.phrase_cache is None:
+            return self.encode(phrases, encode_batch_sizes)
+
+        embeddings, missing = self.phrase_cache.get_many(phrases)
+        evicted = 0
+        if missing:
+            missing_phrases = [phrases[idx] for idx in missing]
+            missing_embeddings = self.encode(missing_phrases, encode_batch_sizes)
+            embeddings[missing] = missing_embeddings
+            evicted = self.phrase_cache.put_many(missing_phrases, missing_embeddings)
+
+        if cache_counts is not None:
+            for name, value in (("hits", len(phrases) - len(missing)), ("misses", len(missing)), ("evictions", evicted)):
+                cache_counts[name] = cache_counts.get(name, 0) + value
+        return embeddings
+
+    def embed_documents(self, doc_texts: list[str], encode_batch_sizes: Optional[list[int]] = None) -> np.ndarray:
+        if self.doc_embedding_mode == "full":
+            return self.encode([self.truncate_to_model_input(doc_text) for doc_text in doc_texts], encode_batch_sizes)
+
+        # Фрагменты всех документов кодируются общими батчами, затем усредняются по документам
+        chunked = [self.split_into_chunks(doc_text) for doc_text in doc_texts]
+        chunk_embeddings = self.encode([chunk for chunks, _ in chunked for chunk in chunks], encode_batch_sizes)
+
+        doc_embeddings = []
+        start = 0
+        for chunks, chunk_tokens in chunked:
+            doc_embedding = np.average(chunk_embeddings[start:start + len(chunks)], axis=0, weights=chunk_tokens)
+            start += len(chunks)
+            # Среднее нормированных векторов короче единицы, а MMR для нормированных эмбеддингов считает скалярное произведение
+            if self.normalize_embeddings:
+                doc_embedding = doc_embedding / (np.linalg.norm(doc_embedding) or 1.0)
+            doc_embeddings.append(doc_embedding)
+        return np.vstack(doc_embeddings)
 
     def extract_keywords(
             self,
             doc_text: str,
-            phrases_list: list[FoundPhrases]
+            phrases_list: list[FoundPhrases],
+            encode_batch_sizes: Optional[list[int]] = None,
+            cache_counts: Optional[dict[str, int]] = None
     ) -> List[BertKeyPhrases]:
-        doc_embedding: np.ndarray = self.model.encode([doc_text])[0]
+        """
+        encode_batch_sizes, если передан, дополняется размерами батчей, отправленных в модель;
+        cache_counts -- числом попаданий, промахов и вытеснений кэша эмбеддингов фраз.
+        """
+        return self.extract_keywords_batch([doc_text], [phrases_list], encode_batch_sizes, cache_counts)[0]
 
-        print("phrases_list", phrases_list, sep=" ")
+    def extract_keywords_batch(
+            self,
+            doc_texts: list[str],
+            phrases_lists: list[list[FoundPhrases]],
+            encode_batch_sizes: Optional[list[int]] = None,
+            cache_counts: Optional[dict[str, int]] = None
+    ) -> List[List[BertKeyPhrases]]:
+        """Ключевые фразы группы документов: тексты и кандидаты всех документов кодируются общими батчами."""
+        doc_embeddings: np.ndarray = self.embed_documents(doc_texts, encode_batch_sizes)
+
+        logger.debug("phrases_lists %s", phrases_lists)
+
+        # Кандидаты разных паттернов и документов сильно пересекаются, поэтому кодируем каждую фразу один раз
+        unique_phrases = list(dict.fromkeys(
+            phrase for phrases_list in phrases_lists for phrase_obj in phrases_list for phrase in phrase_obj.found_words
+        ))
+        phrase_index = {phrase: idx for idx, phrase in enumerate(unique_phrases)}
+        all_embeddings: np.ndarray = self.encode_phrases(
+            unique_phrases, encode_batch_sizes, cache_counts
+        ) if unique_phrases else np.empty((0, 0))
+
+        return [
+            self.__select_keywords(doc_embedding, phrases_list, all_embeddings, phrase_index)
+            for doc_embedding, phrases_list in zip(doc_embeddings, phrases_lists)
+        ]
+
+    def __select_keywords(
+            self,
+            doc_embedding: np.ndarray,
+            phrases_list: list[FoundPhrases],
+            all_embeddings: np.ndarray,
+            phrase_index: dict[str, int]
+    ) -> List[BertKeyPhrases]:
         output_data = []
-        for idx, phrase_obj in enumerate(phrases_list):
+        for phrase_obj in phrases_list:
             pattern_config = phrase_obj.pattern_config
-            phrases = phrase_obj.found_words
+            phrases = np.asarray(phrase_obj.found_words, dtype=object)
+
+            if len(phrases) == 0:
+                output_data.append(BertKeyPhrases(pattern_config, []))
+                continue
 
             diversity = pattern_config.diversity
             top_number = pattern_config.top_n
 
-            # Получаем эмбеддинги для всех кандидатов
-            candidate_embeddings: np.ndarray = self.model.encode(phrases)
+            # Берём эмбеддинги кандидатов паттерна из общей матрицы
+            candidate_embeddings: np.ndarray = all_embeddings[[phrase_index[phrase] for phrase in phrases]]
 
             top_n = min(top_number, len(phrases))
 
@@ -57,6 +259,7 @@ class CustomKeyBertForArchive:
                 top_n=top_n,
                 diversity=diversity,
                 threshold_filter=pattern_config.threshold_filter,
+                normalized=self.normalize_embeddings,
             )
 
             # Создаём объект BertOutputData для текущего паттерна
@@ -71,9 +274,13 @@ class CustomKeyBertForArchive:
             candidates: list[str],
             top_n: int,
             diversity: float,
-            threshold_filter: float
+            threshold_filter: float,
+            normalized: bool = False
     ) -> List[KeyPhraseData]:
-        candidate_to_doc_similarity = cosine_similarity(candidate_embeddings, [document_embedding]).flatten()
+        if normalized:
+            candidate_to_doc_similarity = candidate_embeddings @ document_embedding
+        else:
+            candidate_to_doc_similarity = cosine_similarity(candidate_embeddings, [document_embedding]).flatten()
         above_threshold = candidate_to_doc_similarity >= threshold_filter
         candidate_embeddings = candidate_embeddings[above_threshold]
         candidates = candidates[above_threshold]
@@ -82,47 +289,36 @@ class CustomKeyBertForArchive:
         if len(candidates) == 0:
             return []
 
-        # breakpoint()
-
-        candidate_similarity_matrix = cosine_similarity(candidate_embeddings)
+        # Сходство считается только с уже выбранными фразами: матрица n×n не строится
+        if not normalized:
+            candidate_embeddings = normalize(candidate_embeddings)
 
         selected_keywords: List[KeyPhraseData] = []
-        selected_indices = []
-
-        best_initial_idx = np.argmax(candidate_to_doc_similarity)
-
-        selected_keywords.append(
-            KeyPhraseData(candidates[best_initial_idx], round(candidate_to_doc_similarity[best_initial_idx], 4)))
-        selected_indices.append(best_initial_idx)
+        is_selected = np.zeros(len(candidates), dtype=bool)
 
-        while len(selected_keywords) < top_n:
-            candidates_mmr_scores = []
+        best_idx = argmax_with_ties(candidate_to_doc_similarity)
+        # Максимальное сходство каждого кандидата с уже выбранными фразами
+        max_similarity_to_selected = candidate_embeddings @ candidate_embeddings[best_idx]
 
-            for candidate_idx in range(len(candidates)):
-                if candidate_idx in selected_indices:
-                    continue
+        while True:
+            selected_keywords.append(
+                KeyPhraseData(candidates[best_idx], round(candidate_to_doc_similarity[best_idx], 4)))
+            is_selected[best_idx] = True
 
-                relevance = candidate_to_doc_similarity[candidate_idx]
-
-                similarity_to_selected = candidate_similarity_matrix[candidate_idx][selected_indices]
-                max_similarity = max(similarity_to_selected) if selected_indices else 0
-
-                mmr_score = (1 - diversity) * relevance - diversity * max_similarity
-                print(mmr_score)
-
-                candidates_mmr_scores.append((candidate_idx, mmr_score))
-
-            if not candidates_mmr_scores:
+            if len(selected_keywords) >= top_n or is_selected.all():
                 break
 
-            print("candidates", candidates, sep=" ")
-            print("candidates_mmr_scores", candidates_mmr_scores, sep=" ")
-            best_candidate_idx, _ = max(candidates_mmr_scores, key=lambda x: x[1])
+            mmr_scores = (1 - diversity) * candidate_to_doc_similarity - diversity * max_similarity_to_selected
+            mmr_scores[is_selected] = -np.inf
+            best_idx = argmax_with_ties(mmr_scores)
 
-            selected_keywords.append(KeyPhraseData(candidates[best_candidate_idx],
-                                                   round(candidate_to_doc_similarity[best_candidate_idx], 4)))
-            selected_indices.append(best_candidate_idx)
+            np.maximum(
+                max_similarity_to_selected,
+                candidate_embeddings @ candidate_embeddings[best_idx],
+                out=max_similarity_to_selected
+            )
 
+        # Сортировка устойчива: фразы с равной оценкой остаются в порядке выбора
         selected_keywords.sort(key=lambda x: x.value, reverse=True)
 
         return selected_keywords
\ No newline at end of file
@@ -1,6 +1,6 @@
 from typing import List
 
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
 
 def filter_ner(
@@ -9,24 +9,39 @@ def filter_ner(
     filter_type: list[str] = ['PER'],
     max_ents: int = 10
 ) -> List[str]:
-    # Фильтруем по типу и длине
-    without_persons_ents = [
-        ent for ent in input_ner_list
-        if ent.label_ not in filter_type and len(ent.text) > 2
-    ]
-
-    # Удаляем дубликаты по смыслу
-    unique_ents = []
-    for ent in without_persons_ents:
+    unique_texts: List[str] = []
+    # Нормализованный текст каждой уникальной сущности считается один раз
+    unique_normalized: List[str] = []
+    seen_normalized = set()
+
+    for ent in input_ner_list:
+        # Ограничиваем количество: дальнейшие сущности на результат уже не влияют
+        if len(unique_texts) >= max_ents:
+            break
+
+        # Фильтруем по типу и длине
+        if ent.label_ in filter_type or len(ent.text) <= 2:
+            continue
+
+        # Удаляем дубликаты по смыслу
         text = ent.text.strip().lower()
-        is_duplicate = False
-        for existing in unique_ents:
-            if fuzz.partial_ratio(text, existing.text.strip().lower()) >= input_threshold:
-                is_duplicate = True
-                break
+        if input_threshold > 100:
+            # partial_ratio не превышает 100, поэтому дубликатов быть не может
+            is_duplicate = False
+        elif text and text in seen_normalized:
+            is_duplicate = True
+        else:
+            # Один пакетный вызов RapidFuzz вместо цикла по уникальным сущностям
+            is_duplicate = process.extractOne(
+                text,
+                unique_normalized,
+                scorer=fuzz.partial_ratio,
+                score_cutoff=max(input_threshold, 0)
+            ) is not None
+
         if not is_duplicate:
-            unique_ents.append(ent)
+            unique_texts.append(ent.text)
+            unique_normalized.append(text)
+            seen_normalized.add(text)
 
-    # Ограничиваем количество
-    truncated_list = unique_ents[:max_ents]
-    return [item.text for item in truncated_list]
\ No newline at end of file
+    return unique_texts
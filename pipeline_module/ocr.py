@@ -1,26 +1,275 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+import fitz
 import pytesseract
 from PIL import Image
 
+from typing import Optional
+
+from pipeline_module.interfaces import ProgressCallback, RecognizedDocument
+from pipeline_module.timing import add_pooled_cpu_seconds, cpu_seconds
+
+try:
+    import tesserocr
+except ImportError:  # Необязательная зависимость: нужна только для бэкенда "tesserocr"
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+OCR_BACKENDS = ("pytesseract", "tesserocr")
+
+# Символы, которые считаются нормальными для текстового слоя (кроме букв, цифр и пробелов)
+TEXT_LAYER_ALLOWED_PUNCTUATION = set(".,;:!?-–—()[]{}«»\"'/\\№%*+=<>_@#$&|~`^…")
+
+# Состояние процесса из пула параллельного распознавания: каждый процесс открывает PDF сам,
+# поэтому между процессами передаются только путь к файлу, номера страниц и распознанный текст.
+# Пул живёт дольше одного документа: открытый документ запоминается до прихода следующего
+_worker_document = None
+_worker_document_key = None
+_worker_ocr = None
+
+# Инициализированные движки tesserocr текущего процесса: языковые модели загружаются один раз
+_tesserocr_engines = {}
+
+
+def get_tesserocr_engine(lang: str):
+    engine = _tesserocr_engines.get(lang)
+    if engine is None:
+        if tesserocr is None:
+            raise RuntimeError("Для бэкенда OCR 'tesserocr' нужно установить пакет tesserocr")
+        engine = tesserocr.PyTessBaseAPI(lang=lang)
+        _tesserocr_engines[lang] = engine
+    return engine
+
+
+def _init_page_worker(lang: str, dpi: int, backend: str) -> None:
+    global _worker_ocr
+
+    # Tesseract сам распараллеливается через OpenMP, что при нескольких процессах только мешает
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _worker_ocr = RussianPDFOCR(lang=lang, dpi=dpi, backend=backend)
+    _worker_ocr.warm_up()
+
+
+def _recognize_page_in_worker(document_key: tuple, page_idx: int) -> tuple[str, float]:
+    """Текст страницы и процессорное время на неё: процесс пула не завершается, и родитель иначе его не увидит."""
+    global _worker_document, _worker_document_key
+
+    cpu_started_at = cpu_seconds()
+
+    # Ключ -- путь вместе с inode и временем изменения: файл по тому же пути мог быть заменён
+    if _worker_document_key != document_key:
+        if _worker_document is not None:
+            _worker_document.close()
+        _worker_document = fitz.open(document_key[0])
+        _worker_document_key = document_key
+    page_text = _worker_ocr.recognize_page(_worker_document[page_idx])
+    return page_text, cpu_seconds() - cpu_started_at
+
+
+def available_cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
 class RussianPDFOCR:
-    def __init__(self, lang="rus", dpi=300):
+    def __init__(self, lang="rus", dpi=300, workers=1, reserved_cpus=1, use_text_layer=True,
+                 min_text_layer_chars=50, min_text_layer_quality=0.9, min_text_coverage=0.05,
+                 backend="pytesseract"):
+        """
+        backend -- "pytesseract" (отдельный процесс tesseract на страницу) или "tesserocr"
+                   (движок, инициализированный один раз на процесс, без PIL и временных файлов);
+        workers -- максимальное число процессов для постраничного распознавания (1 -- последовательно);
+        reserved_cpus -- сколько ядер оставить свободными под spaCy и модель эмбеддингов;
+        use_text_layer -- брать текст из текстового слоя PDF, если он пригоден, и не запускать OCR;
+        min_text_layer_chars -- минимум непробельных символов в текстовом слое страницы;
+        min_text_layer_quality -- минимальная доля «нормальных» символов (буквы, цифры, пунктуация);
+        min_text_coverage -- минимальная доля площади страницы под текстом, если страница покрыта изображением.
+        """
         self.lang = lang
         self.dpi = dpi
+        self.workers = workers
+        self.reserved_cpus = reserved_cpus
+        self.use_text_layer = use_text_layer
+        self.min_text_layer_chars = min_text_layer_chars
+        self.min_text_layer_quality = min_text_layer_quality
+        self.min_text_coverage = min_text_coverage
+
+        if backend not in OCR_BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд OCR '{backend}', доступны: {', '.join(OCR_BACKENDS)}")
+        if backend == "tesserocr" and tesserocr is None:
+            raise RuntimeError("Для бэкенда OCR 'tesserocr' нужно установить пакет tesserocr")
+        self.backend = backend
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._pool_lock = threading.Lock()
+        self._atexit_registered = False
+
+    def warm_up(self) -> None:
+        if self.backend == "tesserocr":
+            get_tesserocr_engine(self.lang)
+
+    def recognize_page(self, page) -> str:
+        if self.backend == "tesserocr":
+            return self.__recognize_page_tesserocr(page)
+
+        # Создаём изображение с заданным DPI
+        pix = page.get_pixmap(dpi=self.dpi)
+
+        # Преобразуем Pixmap в изображение PIL
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+        # Получаем текст с изображения с использованием pytesseract
+        return pytesseract.image_to_string(img, lang=self.lang)
+
+    def __recognize_page_tesserocr(self, page) -> str:
+        # Одноканальное изображение втрое меньше RGB, а Tesseract всё равно переводит страницу в оттенки серого
+        pix = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY, alpha=False)
+
+        engine = get_tesserocr_engine(self.lang)
+        # Буфер пиксмапа передаётся движку напрямую, без PIL, временного файла и запуска процесса
+        engine.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+        engine.SetSourceResolution(self.dpi)
+        page_text = engine.GetUTF8Text()
+        engine.Clear()
+        return page_text
+
+    def get_pool_size(self, page_count: int) -> int:
+        free_cpus = available_cpu_count() - self.reserved_cpus
+        return max(1, min(self.workers, free_cpus, page_count))
+
+    def get_text_layer(self, page) -> str | None:
+        """Возвращает текст страницы из текстового слоя или None, если страницу нужно распознавать."""
+        page_text = page.get_text("text")
+        meaningful_chars = [char for char in page_text if not char.isspace()]
+        if len(meaningful_chars) < self.min_text_layer_chars:
+            return None
+
+        # Битая кодировка шрифта даёт символы замены и мусор вместо букв
+        good_chars = sum(
+            1 for char in meaningful_chars
+            if char.isalnum() or char in TEXT_LAYER_ALLOWED_PUNCTUATION
+        )
+        if good_chars / len(meaningful_chars) < self.min_text_layer_quality:
+            return None
+
+        # Скан с небольшой подписью поверх изображения: текстовый слой покрывает малую часть страницы
+        page_area = abs(page.rect)
+        if page_area > 0:
+            image_area = sum(abs(fitz.Rect(image["bbox"]) & page.rect) for image in page.get_image_info())
+            text_area = sum(
+                abs(fitz.Rect(block[:4]) & page.rect)
+                for block in page.get_text("blocks") if block[6] == 0
+            )
+            if image_area / page_area >= 0.5 and text_area / page_area < self.min_text_coverage:
+                return None
+
+        return page_text
+
+    def get_text_layers(self, input_pdf_doc) -> list[str | None]:
+        """Текст каждой страницы из текстового слоя; None отмечает страницы, которые нужно распознавать."""
+        if not self.use_text_layer:
+            return [None] * len(input_pdf_doc)
+        return [self.get_text_layer(page) for page in input_pdf_doc]
+
+    @staticmethod
+    def join_pages(pages_text: list[str]) -> str:
+        return "".join(f"\n\n{page_text}" for page_text in pages_text)
+
+    def extract_text(self, input_pdf_doc, progress: Optional[ProgressCallback] = None) -> RecognizedDocument:
+        """Берёт текст из текстового слоя, где он пригоден, и распознаёт через OCR только остальные страницы."""
+        pages_text = self.get_text_layers(input_pdf_doc)
+        ocr_page_indices = [idx for idx, page_text in enumerate(pages_text) if page_text is None]
+        logger.info(f"Текстовый слой: {len(pages_text) - len(ocr_page_indices)} стр., OCR: {len(ocr_page_indices)} стр.")
+
+        if ocr_page_indices:
+            recognized_pages = self.recognize_pages(input_pdf_doc, ocr_page_indices, progress)
+            for page_idx, page_text in zip(ocr_page_indices, recognized_pages):
+                pages_text[page_idx] = page_text
+
+        return RecognizedDocument(
+            text=self.join_pages(pages_text),
+            text_layer_pages=len(pages_text) - len(ocr_page_indices),
+            ocr_pages=len(ocr_page_indices)
+        )
 
     def recognize_pdf(self, input_pdf_doc):
-        full_text = ""
+        pages_text = self.recognize_pages(input_pdf_doc, list(range(len(input_pdf_doc))))
+        return self.join_pages(pages_text)
+
+    def recognize_pages(self, input_pdf_doc, page_indices: list[int],
+                        progress: Optional[ProgressCallback] = None) -> list[str]:
+        pool_size = self.get_pool_size(len(page_indices))
+
+        # Параллельный режим возможен только для документа, открытого из файла
+        if pool_size > 1 and input_pdf_doc.name:
+            return self.__recognize_pages_parallel(input_pdf_doc.name, page_indices, pool_size, progress)
+
+        pages_text = []
+        for idx, page_idx in enumerate(page_indices):
+            logger.debug(f"Распознаётся страница {idx + 1} из {len(page_indices)}...")
+            pages_text.append(self.recognize_page(input_pdf_doc[page_idx]))
+            if progress:
+                progress("ocr", idx + 1, len(page_indices))
+        return pages_text
 
-        for idx, page in enumerate(input_pdf_doc):
-            print(f"Распознаётся страница {idx + 1} из {len(input_pdf_doc)}...")
+    def __get_pool(self) -> ProcessPoolExecutor:
+        """
+        Пул процессов распознавания, общий для всех документов процесса воркера.
 
-            # Создаём изображение с заданным DPI
-            pix = page.get_pixmap(dpi=self.dpi)
+        Запуск spawn-процесса с импортом модулей и загрузкой языковой модели стоит дороже распознавания
+        страницы, поэтому пул создаётся один раз с максимальным числом процессов и закрывается при выходе.
+        """
+        with self._pool_lock:
+            # Пул, созданный до fork, принадлежит родительскому процессу
+            if self._pool is None or self._pool_pid != os.getpid():
+                # spawn, а не fork: родительский процесс воркера держит потоки torch, которые не переживают fork
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.get_pool_size(self.workers),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_page_worker,
+                    initargs=(self.lang, self.dpi, self.backend)
+                )
+                self._pool_pid = os.getpid()
+                if not self._atexit_registered:
+                    atexit.register(self.close)
+                    self._atexit_registered = True
+            return self._pool
 
-            # Преобразуем Pixmap в изображение PIL
-            img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    def close(self) -> None:
+        """Останавливает процессы пула распознавания."""
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._pool_pid = None
 
-            # Получаем текст с изображения с использованием pytesseract
-            page_text = pytesseract.image_to_string(img, lang=self.lang)
-            full_text += f"\n\n{page_text}"
+    def __recognize_pages_parallel(self, pdf_path: str, page_indices: list[int], pool_size: int,
+                                   progress: Optional[ProgressCallback] = None) -> list[str]:
+        logger.info(f"Распознаётся {len(page_indices)} страниц в {pool_size} процессах...")
 
-        return full_text
\ No newline at end of file
+        stat = os.stat(pdf_path)
+        document_key = (pdf_path, stat.st_ino, stat.st_mtime_ns)
+        executor = self.__get_pool()
+        try:
+            # map сохраняет порядок страниц независимо от того, какой процесс закончил первым
+            pages_text = []
+            for page_text, page_cpu_seconds in executor.map(_recognize_page_in_worker, repeat(document_key), page_indices):
+                add_pooled_cpu_seconds(page_cpu_seconds)
+                pages_text.append(page_text)
+                if progress:
+                    progress("ocr", len(pages_text), len(page_indices))
+            return pages_text
+        except BrokenProcessPool:
+            # Процесс пула упал (например, от нехватки памяти): следующий документ получит новый пул
+            self.close()
+            raise
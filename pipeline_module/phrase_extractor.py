@@ -1,10 +1,38 @@
+import logging
+import re
+from bisect import bisect_left
+from functools import lru_cache
 from typing import List
 
-from keyphrase_vectorizers import KeyphraseCountVectorizer
+import nltk
+import numpy as np
+from nltk.chunk.regexp import tag_pattern2re_pattern
 from spacy import Language
+from spacy.tokens import Doc
 
 from pipeline_module.interfaces import FoundPhrases, PatternConfig
 
+logger = logging.getLogger(__name__)
+
+# Фразы длиннее 8 слов не считаются ключевыми (как в KeyphraseCountVectorizer)
+MAX_PHRASE_WORDS = 8
+
+
+@lru_cache(maxsize=128)
+def compile_pos_pattern(pos_pattern: str) -> re.Pattern:
+    """Компилирует POS-паттерн в формате NLTK RegexpParser ('<N.*><ADP>?<N.*>') в регулярное выражение по строке тегов."""
+    return re.compile(tag_pattern2re_pattern(f"({pos_pattern})"))
+
+
+@lru_cache(maxsize=1)
+def get_stop_words() -> frozenset:
+    # Тот же список стоп-слов, что KeyphraseCountVectorizer использует по умолчанию (stop_words='english')
+    try:
+        return frozenset(nltk.corpus.stopwords.words("english"))
+    except LookupError:
+        nltk.download("stopwords")
+        return frozenset(nltk.corpus.stopwords.words("english"))
+
 
 class PhraseCountVectorizerWrapper:
     @staticmethod
@@ -19,19 +47,61 @@ class PhraseCountVectorizerWrapper:
     def __init__(self, nlp_model):
         self.nlp: Language = nlp_model
 
-    def get_key_phrases(self, input_text: str, current_patterns: List[PatternConfig]) -> List[FoundPhrases]:
+    def get_key_phrases(self, processed_doc: Doc, current_patterns: List[PatternConfig]) -> List[FoundPhrases]:
+        """Извлекает фразы по всем паттернам из уже разобранного spaCy документа, не запуская spaCy повторно."""
+        words = [token.text for token in processed_doc if token.text]
+        tags = [token.tag_ for token in processed_doc if token.text]
+
+        # Строка тегов строится один раз и используется всеми паттернами; tag_starts -- позиция '<' каждого тега
+        tag_string = "".join(f"<{tag}>" for tag in tags)
+        tag_starts = []
+        position = 0
+        for tag in tags:
+            tag_starts.append(position)
+            position += len(tag) + 2
+
+        stop_words = get_stop_words()
         results: List[FoundPhrases] = []
         for pattern_obj in current_patterns:
-            current_vectorizer = KeyphraseCountVectorizer(
-                spacy_pipeline=self.nlp,
-                pos_pattern=pattern_obj.pattern,
-                lowercase=True
-            )
-            try:
-                current_vectorizer.fit_transform([input_text])
-                current_phrases = current_vectorizer.get_feature_names_out()
-                results.append(FoundPhrases(pattern_obj, current_phrases))
-            except ValueError as e:
-                print(f"Паттерн '{pattern_obj.name}' не нашёл фраз: {e}")
+            current_phrases = {}
+            for match in compile_pos_pattern(pattern_obj.pattern).finditer(tag_string):
+                first_word = bisect_left(tag_starts, match.start())
+                last_word = bisect_left(tag_starts, match.end())
+
+                phrase = " ".join(word for word in words[first_word:last_word] if word not in stop_words)
+                phrase = phrase.lower().strip()
+                if phrase and phrase not in stop_words and len(phrase.split()) <= MAX_PHRASE_WORDS:
+                    # Словарь сохраняет порядок первого вхождения, значение -- частота фразы в документе
+                    current_phrases[phrase] = current_phrases.get(phrase, 0) + 1
+
+            if not current_phrases:
+                logger.info(f"Паттерн '{pattern_obj.name}' не нашёл фраз")
                 results.append(FoundPhrases(pattern_obj, []))
+                continue
+
+            results.append(FoundPhrases(
+                pattern_obj,
+                np.asarray(list(current_phrases), dtype=object),
+                np.fromiter(current_phrases.values(), dtype=np.int64, count=len(current_phrases))
+            ))
         return results
+
+
+def prerank_phrases(found_phrases: List[FoundPhrases]) -> List[FoundPhrases]:
+    """
+    Оставляет у каждого паттерна не больше pattern_config.max_candidates кандидатов для модели эмбеддингов.
+
+    Кандидаты ранжируются по частоте в документе, при равной частоте выше фраза, встретившаяся раньше;
+    отобранные фразы сохраняют порядок первого вхождения.
+    """
+    results = []
+    for item in found_phrases:
+        max_candidates = item.pattern_config.max_candidates
+        if not max_candidates or len(item.found_words) <= max_candidates or len(item.frequencies) == 0:
+            results.append(item)
+            continue
+
+        # Устойчивая сортировка по убыванию частоты сохраняет порядок вхождения среди равных
+        selected = np.sort(np.argsort(-item.frequencies, kind="stable")[:max_candidates])
+        results.append(FoundPhrases(item.pattern_config, item.found_words[selected], item.frequencies[selected]))
+    return results
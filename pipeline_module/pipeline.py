@@ -1,22 +1,58 @@
+import logging
+from typing import Optional
+
 import spacy
 
-from pipeline_module.declination import TextDeclinationObj
+from pipeline_module.declination import TextDeclinationObj, get_morph_analyzer
 from pipeline_module.interfaces import InputPipelineData, OutputPipelineData, PatternKeyPhrases, PatternConfig, NerConfig, \
-    FoundPhrases
+    FoundPhrases, RecognizedDocument, PipelineTiming, ProgressCallback, StageTiming, BertKeyPhrases
 from pipeline_module.keybert_wrapper import CustomKeyBertForArchive
 from pipeline_module.ner import filter_ner
 from pipeline_module.ocr import RussianPDFOCR
-from pipeline_module.phrase_extractor import PhraseCountVectorizerWrapper
+from pipeline_module.phrase_extractor import PhraseCountVectorizerWrapper, prerank_phrases
+from pipeline_module.timing import measure_stage
+
+logger = logging.getLogger(__name__)
+
+
+def no_progress(stage: str, current: Optional[int], total: Optional[int]) -> None:
+    pass
 
 
 class TextProcessingPipeline:
-    def __init__(self, spacy_model_name: str, bert_model_name: str):
+    def __init__(self, spacy_model_name: str, bert_model_name: str, ocr_workers: int = 1, ocr_reserved_cpus: int = 1,
+                 use_text_layer: bool = True, ocr_backend: str = "pytesseract", encode_batch_size: int = 64,
+                 normalize_embeddings: bool = False, doc_embedding_mode: str = "full", doc_chunk_tokens: int = 0,
+                 doc_max_chunks: int = 0, phrase_cache_dir: Optional[str] = None, phrase_cache_capacity: int = 100000,
+                 spacy_max_length: int = 400000):
         # Инициализация моделей
         self.spacy_nlp_model = spacy.load(spacy_model_name)
-        self.spacy_nlp_model.max_length = 400000  # Увеличиваем максимальную длину текста
-        self.bert_extractor = CustomKeyBertForArchive(bert_model_name)
+        self.spacy_nlp_model.max_length = spacy_max_length  # Увеличиваем максимальную длину текста
+        self.bert_extractor = CustomKeyBertForArchive(
+            bert_model_name,
+            encode_batch_size=encode_batch_size,
+            normalize_embeddings=normalize_embeddings,
+            doc_embedding_mode=doc_embedding_mode,
+            doc_chunk_tokens=doc_chunk_tokens,
+            doc_max_chunks=doc_max_chunks,
+            phrase_cache_dir=phrase_cache_dir,
+            phrase_cache_capacity=phrase_cache_capacity
+        )
         self.phrase_extractor = PhraseCountVectorizerWrapper(self.spacy_nlp_model)
-        self.ocr = RussianPDFOCR()
+        self.ocr = RussianPDFOCR(
+            workers=ocr_workers,
+            reserved_cpus=ocr_reserved_cpus,
+            use_text_layer=use_text_layer,
+            backend=ocr_backend
+        )
+
+    def warm_up(self) -> None:
+        """Прогоняет модели на коротком тексте, чтобы первая задача не платила за ленивую инициализацию"""
+        warm_up_text = "Архивный документ о передаче дел в Москве."
+        self.spacy_nlp_model(warm_up_text)
+        self.bert_extractor.model.encode([warm_up_text])
+        self.ocr.warm_up()
+        get_morph_analyzer().parse("документ")
 
     @staticmethod
     def get_default_config() -> InputPipelineData:
@@ -36,47 +72,145 @@ class TextProcessingPipeline:
             )
         )
 
-    def process_text(self, document_to_process, config: InputPipelineData = None) -> OutputPipelineData:
-        if config is None:
-            config = self.get_default_config()
+    def recognize_document(self, document_to_process, progress: Optional[ProgressCallback] = None) -> RecognizedDocument:
+        logger.info('Распознавание документа')
+        stages = {}
+        with measure_stage(stages, "ocr"):
+            recognized_document = self.ocr.extract_text(document_to_process, progress)
+        recognized_document.ocr_timing = stages["ocr"]
+        return recognized_document
+
+    def process_text(self, document_to_process, config: InputPipelineData = None,
+                     progress: Optional[ProgressCallback] = None) -> OutputPipelineData:
+        recognized_document = self.recognize_document(document_to_process, progress)
+        return self.process_recognized_text(recognized_document, config, progress)
+
+    def check_text_length(self, recognized_document: RecognizedDocument) -> None:
+        """Проверяет длину текста до обработки: в группе слишком длинный текст уронил бы nlp.pipe для всех документов"""
+        max_length = self.spacy_nlp_model.max_length
+        if len(recognized_document.text) > max_length:
+            raise ValueError(
+                f"Текст документа длиннее допустимого ({len(recognized_document.text)} > {max_length} символов)"
+            )
+
+    def process_recognized_text(self, recognized_document: RecognizedDocument,
+                                config: InputPipelineData = None,
+                                progress: Optional[ProgressCallback] = None) -> OutputPipelineData:
+        """Этапы после распознавания: позволяет переиспользовать уже полученный текст документа"""
+        return self.process_recognized_batch([recognized_document], [config], [progress])[0]
+
+    def process_recognized_batch(self, recognized_documents: list[RecognizedDocument],
+                                 configs: list[Optional[InputPipelineData]],
+                                 progresses: Optional[list[Optional[ProgressCallback]]] = None
+                                 ) -> list[OutputPipelineData]:
+        """
+        Этапы после распознавания для группы документов.
 
-        print(f'Распознавание документа')
-        text_from_document = self.ocr.recognize_pdf(document_to_process)
-        processed_through_nlp_text = self.spacy_nlp_model(text_from_document)
+        spaCy обрабатывает тексты через nlp.pipe, а тексты и фразы-кандидаты всех документов кодируются
+        моделью эмбеддингов общими батчами. Время общих этапов делится между документами пропорционально
+        объёму их данных; размеры батчей эмбеддингов и счётчики кэша фраз записываются в timing первого документа группы.
+        """
+        configs = [config or self.get_default_config() for config in configs]
+        progresses = [progress or no_progress for progress in (progresses or [None] * len(recognized_documents))]
+        timings = [self.__ocr_timing(recognized_document) for recognized_document in recognized_documents]
+        texts = [recognized_document.text for recognized_document in recognized_documents]
+
+        for progress in progresses:
+            progress("spacy", None, None)
+        group_stages = {}
+        with measure_stage(group_stages, "spacy"):
+            processed_docs = list(self.spacy_nlp_model.pipe(texts, batch_size=len(texts)))
+        self.__share_stage(timings, group_stages["spacy"], "spacy", [len(text) for text in texts])
 
         # Извлечение фраз по паттернам
-        print(f'Извлечение фраз по паттернам')
-        found_phrases = self.phrase_extractor.get_key_phrases(text_from_document, config.phrases_config)
-        print("found_phrases", found_phrases, sep=" ")
+        logger.info('Извлечение фраз по паттернам')
+        found_phrases_list = []
+        for processed_doc, config, progress, timing in zip(processed_docs, configs, progresses, timings):
+            progress("phrase_extraction", None, None)
+            with measure_stage(timing.stages, "phrase_extraction"):
+                found_phrases = self.phrase_extractor.get_key_phrases(processed_doc, config.phrases_config)
+            timing.candidates_per_pattern = {
+                item.pattern_config.code: len(item.found_words) for item in found_phrases
+            }
+            with measure_stage(timing.stages, "prerank"):
+                found_phrases = prerank_phrases(found_phrases)
+            logger.debug("found_phrases %s", found_phrases)
+            found_phrases_list.append(found_phrases)
 
         # Извлечение ключевых фраз с помощью BERT
-        print(f'Извлечение ключевых фраз с помощью BERT')
-        key_phrases = self.bert_extractor.extract_keywords(text_from_document, found_phrases)
+        logger.info('Извлечение ключевых фраз с помощью BERT')
+        for progress in progresses:
+            progress("embedding", None, None)
+        with measure_stage(group_stages, "bert"):
+            key_phrases_list = self.bert_extractor.extract_keywords_batch(
+                texts, found_phrases_list,
+                encode_batch_sizes=timings[0].encode_batch_sizes,
+                cache_counts=timings[0].phrase_cache
+            )
+        self.__share_stage(timings, group_stages["bert"], "bert", [
+            1 + sum(len(item.found_words) for item in found_phrases) for found_phrases in found_phrases_list
+        ])
+
+        return [
+            self.__finish_document(*args)
+            for args in zip(recognized_documents, processed_docs, key_phrases_list, configs, progresses, timings)
+        ]
+
+    @staticmethod
+    def __ocr_timing(recognized_document: RecognizedDocument) -> PipelineTiming:
+        timing = PipelineTiming()
+        # Текст из кэша OCR пришёл без времени распознавания
+        if recognized_document.ocr_timing is not None:
+            timing.stages["ocr"] = recognized_document.ocr_timing
+            if recognized_document.ocr_pages and recognized_document.ocr_timing.wall_seconds > 0:
+                timing.ocr_pages_per_second = round(
+                    recognized_document.ocr_pages / recognized_document.ocr_timing.wall_seconds, 3
+                )
+        return timing
 
+    @staticmethod
+    def __share_stage(timings: list[PipelineTiming], group_timing: StageTiming, stage: str, weights: list[int]) -> None:
+        total_weight = sum(weights) or 1
+        for timing, weight in zip(timings, weights):
+            timing.stages[stage] = StageTiming(
+                wall_seconds=round(group_timing.wall_seconds * weight / total_weight, 4),
+                cpu_seconds=round(group_timing.cpu_seconds * weight / total_weight, 4)
+            )
+
+    def __finish_document(self, recognized_document: RecognizedDocument, processed_through_nlp_text,
+                          key_phrases: list[BertKeyPhrases], config: InputPipelineData,
+                          progress: ProgressCallback, timing: PipelineTiming) -> OutputPipelineData:
         # Извлечение NER-сущностей
-        print(f'Извлечение NER-сущностей')
-        total_ner_list = filter_ner(processed_through_nlp_text.ents, config.ner_config.input_threshold, config.ner_config.exclude_types, config.ner_config.phrase_amount)
-
-        # Склонение фраз
-        print(f'Склонение NER фраз')
-        declination_obj = TextDeclinationObj(processed_through_nlp_text)
-        declination_ner = declination_obj.decline_phrase_list(total_ner_list, preserve_case=True)
-
-        # Склонение ключевых фраз
-        print(f'Склонение ключевых фраз')
-        declined_key_phrases: list[PatternKeyPhrases] = []
-        for item in key_phrases:
-            original_phrases = [phrase.key_phrase for phrase in item.found_key_phrases]
-            declination_phrases = declination_obj.decline_phrase_list(original_phrases, preserve_case=False)
-            declined_key_phrases.append(PatternKeyPhrases(
-                item.pattern_config,
-                declination_phrases
-            ))
-
-        print(f'Вывод результата')
+        logger.info('Извлечение NER-сущностей')
+        progress("ner", None, None)
+        with measure_stage(timing.stages, "ner"):
+            total_ner_list = filter_ner(processed_through_nlp_text.ents, config.ner_config.input_threshold, config.ner_config.exclude_types, config.ner_config.phrase_amount)
+
+        progress("declination", None, None)
+        with measure_stage(timing.stages, "declination"):
+            # Склонение фраз
+            logger.info('Склонение NER фраз')
+            declination_obj = TextDeclinationObj(processed_through_nlp_text)
+            declination_ner = declination_obj.decline_phrase_list(total_ner_list, preserve_case=True)
+
+            # Склонение ключевых фраз
+            logger.info('Склонение ключевых фраз')
+            declined_key_phrases: list[PatternKeyPhrases] = []
+            for item in key_phrases:
+                original_phrases = [phrase.key_phrase for phrase in item.found_key_phrases]
+                declination_phrases = declination_obj.decline_phrase_list(original_phrases, preserve_case=False)
+                declined_key_phrases.append(PatternKeyPhrases(
+                    item.pattern_config,
+                    declination_phrases
+                ))
+
+        logger.info('Вывод результата')
         return OutputPipelineData(
             declined_key_phrases,
-            declination_ner
+            declination_ner,
+            text_layer_pages=recognized_document.text_layer_pages,
+            ocr_pages=recognized_document.ocr_pages,
+            timing=timing
         )
 
     @staticmethod
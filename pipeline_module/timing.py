@@ -0,0 +1,42 @@
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+from pipeline_module.interfaces import StageTiming
+
+# Процессорное время долгоживущих дочерних процессов (постоянного пула OCR): RUSAGE_CHILDREN учитывает
+# только завершившиеся процессы, поэтому задачи пула возвращают своё время, и оно прибавляется здесь
+_pooled_cpu_seconds = 0.0
+_pooled_cpu_lock = threading.Lock()
+
+
+def add_pooled_cpu_seconds(seconds: float) -> None:
+    global _pooled_cpu_seconds
+    with _pooled_cpu_lock:
+        _pooled_cpu_seconds += seconds
+
+
+def cpu_seconds() -> float:
+    """
+    Процессорное время процесса вместе с дочерними процессами, которых он уже дождался,
+    и временем задач постоянного пула, переданным через add_pooled_cpu_seconds.
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + self_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime
+            + _pooled_cpu_seconds)
+
+
+@contextmanager
+def measure_stage(stages: dict[str, StageTiming], stage: str):
+    """Записывает в stages время выполнения блока: по часам и процессорное."""
+    wall_started_at = time.perf_counter()
+    cpu_started_at = cpu_seconds()
+    try:
+        yield
+    finally:
+        stages[stage] = StageTiming(
+            wall_seconds=round(time.perf_counter() - wall_started_at, 4),
+            cpu_seconds=round(cpu_seconds() - cpu_started_at, 4)
+        )
@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+from pipeline_module.embedding_cache import (
+    HEADER_COUNT, HEADER_TOMBSTONES, TOMBSTONE, PhraseEmbeddingCache, normalize_phrase, open_phrase_cache, phrase_key
+)
+
+DIM = 4
+
+
+def vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+def open_cache(directory, capacity: int = 8) -> PhraseEmbeddingCache:
+    return PhraseEmbeddingCache(str(directory), "test/model", DIM, capacity, normalized=True)
+
+
+def test_put_and_get(tmp_path):
+    cache = open_cache(tmp_path)
+    embeddings = vectors(3)
+
+    assert cache.put_many(["архив", "дело", "фонд"], embeddings) == 0
+    found, missing = cache.get_many(["фонд", "опись", "архив"])
+
+    assert missing == [1]
+    np.testing.assert_array_equal(found[[0, 2]], embeddings[[2, 0]])
+
+
+def test_phrases_are_normalized(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(["  личный   состав "], vectors(1))
+
+    assert normalize_phrase("  личный   состав ") == "личный состав"
+    assert cache.get_many(["личный состав"])[1] == []
+
+
+def test_reopen_keeps_entries(tmp_path):
+    embeddings = vectors(3)
+    open_cache(tmp_path).put_many(["a", "b", "c"], embeddings)
+
+    reopened = open_cache(tmp_path)
+    found, missing = reopened.get_many(["a", "b", "c"])
+
+    assert missing == []
+    np.testing.assert_array_equal(found, embeddings)
+    assert reopened.stats()["entries"] == 3
+
+
+def test_other_capacity_uses_own_directory(tmp_path):
+    small = open_cache(tmp_path, capacity=8)
+    small.put_many(["a"], vectors(1))
+
+    large = open_cache(tmp_path, capacity=16)
+
+    assert large.path != small.path
+    assert large.get_many(["a"])[1] == [0]
+    # Файлы кэша с другой ёмкостью не тронуты
+    assert small.get_many(["a"])[1] == []
+
+
+def test_damaged_files_are_replaced_not_truncated(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(["a"], vectors(1))
+    keys_path = os.path.join(cache.path, "keys.u64")
+    inode = os.stat(keys_path).st_ino
+    with open(keys_path, "r+b") as f:
+        f.truncate(8)
+
+    recreated = open_cache(tmp_path)
+
+    assert os.stat(keys_path).st_ino != inode
+    assert recreated.stats()["entries"] == 0
+    assert recreated.get_many(["a"])[1] == [0]
+
+
+def test_clock_evicts_unreferenced_slot(tmp_path):
+    cache = open_cache(tmp_path, capacity=4)
+    cache.put_many(["a", "b", "c", "d"], vectors(4))
+    # CLOCK снимает отметки со всех слотов и вытесняет первый; затем отмечаем прочитанную фразу
+    assert cache.put_many(["e"], vectors(1, seed=1)) == 1
+    assert cache.get_many(["a"])[1] == [0]
+    cache.get_many(["b"])
+
+    # "b" прочитана недавно и получает второй шанс, вытесняется "c"
+    assert cache.put_many(["f"], vectors(1, seed=2)) == 1
+    _, missing = cache.get_many(["b", "c", "d", "e", "f"])
+    assert missing == [1]
+    assert cache.header[HEADER_COUNT] == 4
+
+
+def test_table_stays_consistent_under_eviction(tmp_path, monkeypatch):
+    cache = open_cache(tmp_path, capacity=4)
+    rebuilds = []
+    rebuild_table = cache._rebuild_table
+    monkeypatch.setattr(cache, "_rebuild_table", lambda: (rebuilds.append(1), rebuild_table()))
+    truth = {}
+    rng = np.random.default_rng(0)
+
+    for round_idx in range(300):
+        phrases = list(dict.fromkeys(f"фраза {idx}" for idx in rng.integers(0, 12, size=3)))
+        found, missing = cache.get_many(phrases)
+        for idx, phrase in enumerate(phrases):
+            if idx not in missing:
+                np.testing.assert_array_equal(found[idx], truth[phrase])
+        new_phrases = [phrases[idx] for idx in missing]
+        new_vectors = vectors(len(new_phrases), seed=round_idx)
+        truth.update(zip(new_phrases, new_vectors))
+        cache.put_many(new_phrases, new_vectors)
+        assert not missing or cache.get_many(new_phrases)[1] == []
+
+        # Счётчик удалённых ячеек совпадает с таблицей и не превышает порога перестройки
+        tombstones = int((cache.table == TOMBSTONE).sum())
+        assert cache.header[HEADER_TOMBSTONES] == tombstones <= cache.capacity // 2
+        # Каждый занятый слот находится через таблицу, несмотря на удалённые ячейки в цепочках
+        live = [int(key) for key in cache.keys if key]
+        assert int((cache.table > 0).sum()) == cache.header[HEADER_COUNT] == len(live)
+        assert all(cache._find(key) >= 0 for key in live)
+
+    assert cache.header[HEADER_COUNT] == cache.capacity
+    assert rebuilds
+
+
+def test_phrase_key_is_never_zero():
+    assert phrase_key("") != 0
+    assert phrase_key("архив") == phrase_key(" архив ")
+
+
+def test_open_phrase_cache_disabled_or_unavailable(tmp_path):
+    assert open_phrase_cache(None, "m", DIM, 8, True) is None
+
+    # Каталог нельзя создать внутри обычного файла: кэш отключается, а не роняет пайплайн
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    assert open_phrase_cache(str(blocker / "cache"), "m", DIM, 8, True) is None
@@ -0,0 +1,111 @@
+from typing import List
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from pipeline_module.interfaces import KeyPhraseData
+from pipeline_module.keybert_wrapper import CustomKeyBertForArchive, argmax_with_ties
+
+mmr = CustomKeyBertForArchive._CustomKeyBertForArchive__mmr
+
+# Допуск задаётся в тесте отдельно от реализации: эталон не должен зависеть от проверяемого кода
+TIE_TOLERANCE = 1e-6
+
+
+def reference_argmax(scores) -> int:
+    """Наименьший индекс среди оценок, отличающихся от максимальной не больше чем на TIE_TOLERANCE."""
+    best_score = max(scores)
+    for idx, score in enumerate(scores):
+        if score >= best_score - TIE_TOLERANCE:
+            return idx
+    raise ValueError("пустой список оценок")
+
+
+def reference_mmr(document_embedding: np.ndarray, candidate_embeddings: np.ndarray, candidates: np.ndarray,
+                  top_n: int, diversity: float, threshold_filter: float) -> List[KeyPhraseData]:
+    """Исходная реализация MMR с полной матрицей сходства кандидатов и тем же выбором среди равных оценок."""
+    candidate_to_doc_similarity = cosine_similarity(candidate_embeddings, [document_embedding]).flatten()
+    above_threshold = candidate_to_doc_similarity >= threshold_filter
+    candidate_embeddings = candidate_embeddings[above_threshold]
+    candidates = candidates[above_threshold]
+    candidate_to_doc_similarity = candidate_to_doc_similarity[above_threshold]
+
+    if len(candidates) == 0:
+        return []
+
+    candidate_similarity_matrix = cosine_similarity(candidate_embeddings)
+
+    best_initial_idx = reference_argmax(candidate_to_doc_similarity)
+    selected_keywords = [KeyPhraseData(candidates[best_initial_idx], round(candidate_to_doc_similarity[best_initial_idx], 4))]
+    selected_indices = [best_initial_idx]
+
+    while len(selected_keywords) < top_n and len(selected_indices) < len(candidates):
+        mmr_scores = np.full(len(candidates), -np.inf)
+        for candidate_idx in range(len(candidates)):
+            if candidate_idx in selected_indices:
+                continue
+            max_similarity = max(candidate_similarity_matrix[candidate_idx][selected_indices])
+            mmr_scores[candidate_idx] = (1 - diversity) * candidate_to_doc_similarity[candidate_idx] - diversity * max_similarity
+
+        best_candidate_idx = reference_argmax(mmr_scores)
+        selected_keywords.append(KeyPhraseData(candidates[best_candidate_idx],
+                                               round(candidate_to_doc_similarity[best_candidate_idx], 4)))
+        selected_indices.append(best_candidate_idx)
+
+    selected_keywords.sort(key=lambda x: x.value, reverse=True)
+    return selected_keywords
+
+
+def embedding_set(seed: int, size: int = 120, dim: int = 32) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Эмбеддинги кандидатов с повторами: одинаковые векторы дают точно равные оценки MMR."""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(size, dim)).astype(np.float32) + 0.2
+    duplicates = rng.choice(size, size=size // 4, replace=False)
+    embeddings[duplicates] = embeddings[rng.choice(size, size=len(duplicates))]
+    document_embedding = embeddings.mean(axis=0) + rng.normal(scale=0.1, size=dim).astype(np.float32)
+    candidates = np.array([f"фраза {idx}" for idx in range(size)], dtype=object)
+    return document_embedding, embeddings, candidates
+
+
+@pytest.mark.parametrize("seed", range(300))
+@pytest.mark.parametrize("normalized", [False, True])
+def test_mmr_matches_reference(seed: int, normalized: bool):
+    document_embedding, embeddings, candidates = embedding_set(seed)
+    if normalized:
+        embeddings = normalize(embeddings)
+        document_embedding = normalize([document_embedding])[0]
+
+    for top_n, diversity, threshold_filter in ((10, 0.3, 0.1), (15, 0.7, 0.0), (len(candidates), 0.5, 0.2)):
+        expected = reference_mmr(document_embedding, embeddings, candidates, top_n, diversity, threshold_filter)
+        actual = mmr(document_embedding, embeddings, candidates, top_n, diversity, threshold_filter, normalized)
+
+        assert [item.key_phrase for item in actual] == [item.key_phrase for item in expected]
+        assert [item.value for item in actual] == pytest.approx([item.value for item in expected], abs=1e-4)
+
+
+@pytest.mark.parametrize("normalized", [False, True])
+def test_mmr_exact_ties_pick_lowest_index(normalized: bool):
+    # Все кандидаты одинаково близки к документу; b -- копия a, d -- копия c, e одинаково далёк от a и c.
+    # Первой выбирается a, затем c и d равны по избыточности -- берётся c, затем e, затем из равных b и d -- b
+    document_embedding = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    embeddings = np.array([
+        [1.0, 1.0, 0.0],
+        [1.0, 1.0, 0.0],
+        [1.0, -1.0, 0.0],
+        [1.0, -1.0, 0.0],
+        [1.0, 0.0, 1.0],
+    ], dtype=np.float32)
+    if normalized:
+        embeddings = normalize(embeddings)
+    candidates = np.array(["a", "b", "c", "d", "e"], dtype=object)
+
+    actual = mmr(document_embedding, embeddings, candidates, 5, 0.5, 0.0, normalized)
+
+    assert [item.key_phrase for item in actual] == ["a", "c", "e", "b", "d"]
+
+
+def test_argmax_with_ties_picks_lowest_index():
+    assert argmax_with_ties(np.array([0.1, 0.5, 0.5 - 1e-9, 0.5])) == 1
+    assert argmax_with_ties(np.array([-np.inf, 0.2, 0.3])) == 2
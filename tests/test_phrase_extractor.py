@@ -0,0 +1,72 @@
+import dataclasses
+
+import pytest
+import spacy
+from spacy.tokens import Doc
+
+from pipeline_module.phrase_extractor import PhraseCountVectorizerWrapper, prerank_phrases
+from pipeline_module.pipeline import TextProcessingPipeline
+
+# Размеченный вручную текст: результат не зависит от модели spaCy
+WORDS = ("Архив передал документы о передаче дел в Москве . Новый городской архив хранит старые документы "
+         "1950 года . Документы the архива").split()
+TAGS = ("NOUN VERB NOUN ADP NOUN NOUN ADP PROPN PUNCT ADJ ADJ NOUN VERB ADJ NOUN "
+        "NUM NOUN PUNCT NOUN NOUN NOUN").split()
+
+EXPECTED_PHRASES = {
+    "one_noun": {"архив", "документы", "передаче", "дел", "1950", "года", "архива"},
+    # Стоп-слово внутри фразы удаляется: "Документы the" даёт "документы"
+    "bigramm_noun": {"документы о передаче", "документы 1950", "документы"},
+    "bigramm_adj_noun": {"городской архив", "старые документы"},
+    "long_phrases": {"документы о передаче дел", "старые документы 1950 года", "документы архива"},
+}
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    return spacy.blank("ru")
+
+
+@pytest.fixture(scope="module")
+def tagged_doc(nlp):
+    return Doc(nlp.vocab, words=WORDS, tags=TAGS)
+
+
+@pytest.fixture(scope="module")
+def patterns():
+    return TextProcessingPipeline.get_default_config().phrases_config
+
+
+def test_default_patterns_phrases(nlp, tagged_doc, patterns):
+    found = PhraseCountVectorizerWrapper(nlp).get_key_phrases(tagged_doc, patterns)
+
+    assert {item.pattern_config.code: set(item.found_words) for item in found} == EXPECTED_PHRASES
+
+
+def test_frequencies_follow_first_occurrence(nlp, tagged_doc, patterns):
+    one_noun = PhraseCountVectorizerWrapper(nlp).get_key_phrases(tagged_doc, patterns)[0]
+
+    assert list(one_noun.found_words) == ["архив", "документы", "передаче", "дел", "1950", "года", "архива"]
+    assert list(one_noun.frequencies) == [2, 3, 1, 1, 1, 1, 1]
+
+
+def test_matches_keyphrase_count_vectorizer(nlp, tagged_doc, patterns):
+    keyphrase_vectorizers = pytest.importorskip("keyphrase_vectorizers")
+    found = PhraseCountVectorizerWrapper(nlp).get_key_phrases(tagged_doc, patterns)
+
+    for item in found:
+        vectorizer = keyphrase_vectorizers.KeyphraseCountVectorizer(
+            spacy_pipeline=nlp,
+            pos_pattern=item.pattern_config.pattern,
+            lowercase=True,
+            custom_pos_tagger=lambda raw_documents: list(zip(WORDS, TAGS))
+        )
+        vectorizer.fit_transform([" ".join(WORDS)])
+        assert set(item.found_words) == set(vectorizer.get_feature_names_out()), item.pattern_config.code
+
+
+def test_prerank_keeps_most_frequent_in_document_order(nlp, tagged_doc, patterns):
+    limited = [dataclasses.replace(patterns[0], max_candidates=3)]
+    found = PhraseCountVectorizerWrapper(nlp).get_key_phrases(tagged_doc, limited)
+
+    assert list(prerank_phrases(found)[0].found_words) == ["архив", "документы", "передаче"]
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import pytest
+
+# Lua-скрипты выполняются в fakeredis (нужен пакет lupa), настоящий Redis для тестов не требуется
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from app.celery_folder.stage_state import DocumentStageState
+from app.job_coalescing import JOB_PREFIX, LEASE_PREFIX, InflightJobs
+from app.upload_quota import UploadQuota
+from pipeline_module.interfaces import InputApiData, StageTiming
+
+CONFIG = {"phrases_config": [], "ner_config": {"input_threshold": 1, "exclude_types": [], "phrase_amount": 1}}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def client(server):
+    return fakeredis.FakeRedis(server=server)
+
+
+def input_data(callback: str) -> InputApiData:
+    return InputApiData(file_link="http://files/doc.pdf", callback_url=f"http://clients/{callback}", config=CONFIG)
+
+
+# --- UploadQuota ---
+
+@pytest.fixture
+def quota(server, client):
+    return UploadQuota(client, fakeredis.FakeAsyncRedis(server=server), "quota", 100)
+
+
+def test_quota_reserve_respects_limit(quota):
+    assert quota.reserve(60)
+    assert not quota.reserve(50)
+    assert quota.used() == 60
+    assert quota.reserve(40)
+    assert quota.used() == 100
+
+
+def test_quota_release_never_goes_below_zero(quota):
+    quota.reserve(30)
+    quota.release(50)
+    assert quota.used() == 0
+
+
+def test_quota_async_methods_share_counter(quota):
+    async def reserve_and_release():
+        assert await quota.reserve_async(70)
+        assert not await quota.reserve_async(40)
+        await quota.release_async(20)
+
+    asyncio.run(reserve_and_release())
+    assert quota.used() == 50
+
+
+def test_quota_remove_file_releases_its_size(quota, tmp_path):
+    file_path = tmp_path / "doc.pdf"
+    file_path.write_bytes(b"x" * 25)
+    quota.reserve(25)
+
+    quota.remove_file(str(file_path))
+
+    assert not file_path.exists()
+    assert quota.used() == 0
+
+
+# --- DocumentStageState ---
+
+@pytest.fixture
+def stage_state(client):
+    return DocumentStageState(client, 3600)
+
+
+def test_store_pages_counts_each_page_once(stage_state):
+    ocr_pages = stage_state.create("s1", {"job_id": "j1"}, ["слой", None, None, None])
+    assert ocr_pages == [1, 2, 3]
+
+    assert stage_state.store_pages("s1", {1: "один", 2: "два"}) == 1
+    # Повторно выполненная задача группы не уменьшает счётчик второй раз
+    assert stage_state.store_pages("s1", {1: "один", 2: "два"}) == 1
+    assert stage_state.store_pages("s1", {3: "три"}) == 0
+    assert stage_state.get_pages("s1", 4) == ["слой", "один", "два", "три"]
+
+
+def test_store_pages_rejected_after_failure(stage_state):
+    stage_state.create("s1", {"job_id": "j1"}, [None, None])
+
+    assert stage_state.mark_failed("s1")
+    assert not stage_state.mark_failed("s1")
+    assert stage_state.store_pages("s1", {0: "текст"}) == -1
+
+
+def test_ocr_timing_is_summed_over_tasks(stage_state):
+    stage_state.add_ocr_timing("s1", StageTiming(wall_seconds=1.5, cpu_seconds=1.0))
+    stage_state.add_ocr_timing("s1", StageTiming(wall_seconds=0.5, cpu_seconds=2.0))
+
+    assert stage_state.get_ocr_timing("s1") == StageTiming(wall_seconds=2.0, cpu_seconds=3.0)
+
+
+# --- InflightJobs ---
+
+@pytest.fixture
+def jobs(client):
+    return InflightJobs(client, ttl_seconds=3600, queued_lease_seconds=1, heartbeat_seconds=0.1)
+
+
+def test_identical_request_joins_running_job(jobs):
+    assert jobs.join_or_create("link", "j1", input_data("a")) == ("j1", None)
+    assert jobs.join_or_create("link", "j2", input_data("b")) == ("j1", None)
+
+    waiting = jobs.finish("j1")
+    assert [item.callback_url for item in waiting] == ["http://clients/a", "http://clients/b"]
+    assert jobs.finish("j1") == []
+
+
+def test_finished_job_is_replaced_by_new_one(jobs):
+    jobs.join_or_create("link", "j1", input_data("a"))
+    jobs.finish("j1")
+
+    assert jobs.join_or_create("link", "j2", input_data("b")) == ("j2", None)
+
+
+def test_job_with_expired_lease_is_taken_over(jobs, client):
+    jobs.join_or_create("link", "j1", input_data("a"))
+    jobs.join_or_create("link", "j1", input_data("b"))
+    # Воркер упал: аренду никто не продлил
+    client.delete(f"{LEASE_PREFIX}:j1")
+
+    assert jobs.join_or_create("link", "j2", input_data("c")) == ("j2", "j1")
+    assert not client.exists(f"{JOB_PREFIX}:j1")
+    assert [item.callback_url for item in jobs.finish("j2")] == [
+        "http://clients/a", "http://clients/b", "http://clients/c"
+    ]
+
+
+def test_merge_by_content_moves_waiters_to_live_job(jobs):
+    jobs.join_or_create("link-1", "j1", input_data("a"))
+    assert jobs.merge_by_content("content", "link-1", "j1") == ("j1", None)
+    jobs.join_or_create("link-2", "j2", input_data("b"))
+
+    assert jobs.merge_by_content("content", "link-2", "j2") == ("j1", None)
+    # Ключ второй ссылки теперь ведёт в общее задание
+    assert jobs.join_or_create("link-2", "j3", input_data("c")) == ("j1", None)
+    assert len(jobs.finish("j1")) == 3
+
+
+def test_merge_by_content_takes_over_dead_job(jobs, client):
+    jobs.join_or_create("link-1", "j1", input_data("a"))
+    jobs.merge_by_content("content", "link-1", "j1")
+    client.delete(f"{LEASE_PREFIX}:j1")
+    jobs.join_or_create("link-2", "j2", input_data("b"))
+
+    assert jobs.merge_by_content("content", "link-2", "j2") == ("j2", "j1")
+    assert len(jobs.finish("j2")) == 2
+
+
+def test_keep_alive_renews_lease_while_processing(jobs, client):
+    jobs.join_or_create("link", "j1", input_data("a"))
+
+    with jobs.keep_alive(["j1", None]):
+        # Дольше аренды в очереди: задание живо, пока воркер продлевает аренду
+        time.sleep(1.3)
+        assert client.exists(f"{LEASE_PREFIX}:j1")
+        assert client.pttl(f"{LEASE_PREFIX}:j1") <= 300
+
+    # После обработки аренда снова рассчитана на ожидание в очереди
+    assert 300 < client.pttl(f"{LEASE_PREFIX}:j1") <= 1000
+
+
+def test_keep_alive_does_not_revive_finished_job(jobs, client):
+    jobs.join_or_create("link", "j1", input_data("a"))
+
+    with jobs.keep_alive(["j1"]):
+        jobs.finish("j1")
+        time.sleep(0.3)
+
+    assert not client.exists(f"{LEASE_PREFIX}:j1")